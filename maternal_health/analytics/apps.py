@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+# AnalyticsConfig with ready() method to import the signal handlers that keep summary rollups up to date.
+class AnalyticsConfig(AppConfig):
+    name = 'analytics'
+
+    def ready(self):
+        import analytics.signals  # noqa: F401
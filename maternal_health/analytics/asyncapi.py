@@ -0,0 +1,145 @@
+from functools import wraps
+
+from django.conf import settings
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse
+from django.urls import reverse
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from patients.identity import aget_patient_id
+from .cache import SUMMARY_CACHE_HEADER, summary_cache, summary_cache_key
+from .columnar import stream_queryset_columnar
+from .exports import stream_queryset_csv
+from .jobs import exceeds_export_threshold, export_filename, export_format_error, submit_export_job
+from .serializers import ExportJobSerializer
+
+
+'''
+
+Async analytics views. DRF's APIView is synchronous, so under ASGI a slow
+summary or export would hold a worker thread for its whole duration. The
+views decorated here are plain async Django views that authenticate with
+the same DRF authentication classes (in a thread, as they query the
+database) and then use the async ORM, cache and streaming responses.
+
+'''
+def api_response(data, status=status.HTTP_200_OK, headers=None):
+    """JSON response encoded the way DRF's JSONRenderer encodes it (dates, decimals, lazy strings)."""
+    return JsonResponse(
+        data, status=status, headers=headers, encoder=JSONEncoder, safe=False,
+        json_dumps_params={'ensure_ascii': not api_settings.UNICODE_JSON},
+    )
+
+
+# Same status rules as APIView.handle_exception: 401 with WWW-Authenticate when the first
+# authenticator names a scheme, otherwise 403
+def _auth_error(request, exc):
+    status_code, headers = exc.status_code, {}
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        authenticators = request.authenticators
+        header = authenticators[0].authenticate_header(request) if authenticators else None
+        if header:
+            headers['WWW-Authenticate'] = header
+        else:
+            status_code = status.HTTP_403_FORBIDDEN
+    return api_response({'detail': exc.detail}, status=status_code, headers=headers)
+
+
+def async_api_view(view):
+    """
+    Decorate an async GET view taking a DRF Request: authenticates with
+    DEFAULT_AUTHENTICATION_CLASSES and answers 401/403 like IsAuthenticated would.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return api_response(
+                {'detail': f'Method "{request.method}" not allowed.'},
+                status=status.HTTP_405_METHOD_NOT_ALLOWED, headers={'Allow': 'GET, HEAD'},
+            )
+
+        request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+        try:
+            user = await sync_to_async(lambda: request.user)()
+        except exceptions.APIException as exc:
+            return _auth_error(request, exc)
+        if not (user and user.is_authenticated):
+            return _auth_error(request, exceptions.NotAuthenticated())
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+async def asummary_response(metric, scope, scope_id, role, build):
+    """
+    Serve a summary from the cache, awaiting `build()` to compute and store it on a miss.
+
+    `scope` is the rollup scope the summary reads; a None scope (a request whose
+    parents do not match) is never cached.
+    """
+    if scope is None:
+        return api_response(await build(), headers={SUMMARY_CACHE_HEADER: 'MISS'})
+
+    cache = summary_cache()
+    key = summary_cache_key(metric, scope, scope_id, role)
+    data = await cache.aget(key)
+    hit = data is not None
+    if not hit:
+        data = await build()
+        await cache.aset(key, data, getattr(settings, 'SUMMARY_CACHE_TIMEOUT', 300))
+    return api_response(data, headers={SUMMARY_CACHE_HEADER: 'HIT' if hit else 'MISS'})
+
+
+async def export_response(request, dataset, queryset, filters):
+    """
+    Export `queryset` in the requested ?format= (csv, parquet or arrow).
+
+    Exports with more rows than EXPORT_JOB_THRESHOLD are too large to stream within a
+    request: they are queued as an export job and answered with 202 pointing at it.
+    `filters` are the endpoint's URL kwargs, which the job needs to rebuild the queryset.
+    """
+    export_format = request.query_params.get('format', 'csv')
+    error = export_format_error(export_format)
+    if error:
+        return api_response({'detail': error}, status=status.HTTP_400_BAD_REQUEST)
+
+    if await exceeds_export_threshold(queryset):
+        job = await sync_to_async(submit_export_job)(request.user, dataset, filters, export_format)
+        location = request.build_absolute_uri(reverse('export-job-detail', kwargs={'pk': job.pk}))
+        data = ExportJobSerializer(job, context={'request': request}).data
+        return api_response(data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
+    filename = export_filename(dataset, export_format)
+    if export_format == 'csv':
+        return stream_queryset_csv(queryset, filename, asynchronous=is_asgi(request))
+    return stream_queryset_columnar(queryset, filename, export_format, asynchronous=is_asgi(request))
+
+
+def is_asgi(request):
+    """Whether the request is being served by the ASGI handler, where responses should stream asynchronously."""
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+async def summary_patient_pk(user, patient_pk):
+    """
+    Resolve the patient scope of a summary request.
+
+    Patients are scoped to their own record, and asking for anyone else's is forbidden;
+    clinicians and admins keep the requested scope. Returns (patient_pk, error response or None).
+    """
+    role = getattr(user, 'role', None)
+    if role == 'patient':
+        own_id = await aget_patient_id(user)
+        if own_id is None:
+            return None, api_response({'detail': 'Patient record not found.'}, status=status.HTTP_404_NOT_FOUND)
+        if patient_pk is not None and int(patient_pk) != own_id:
+            return None, api_response({'detail': 'Forbidden.'}, status=status.HTTP_403_FORBIDDEN)
+        return own_id, None
+    if role not in ['doctor', 'nurse', 'admin']:
+        return None, api_response({'detail': 'Forbidden.'}, status=status.HTTP_403_FORBIDDEN)
+    return patient_pk, None
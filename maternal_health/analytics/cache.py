@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+# Header telling clients whether a summary came from the cache
+SUMMARY_CACHE_HEADER = 'X-Cache'
+
+# Cached summaries are kept per role so role-specific shaping can never leak across roles
+SUMMARY_CACHE_ROLES = ['patient', 'doctor', 'nurse', 'admin']
+
+
+def summary_cache():
+    return caches[getattr(settings, 'SUMMARY_CACHE_ALIAS', 'default')]
+
+
+def summary_cache_key(metric, scope, scope_id, role):
+    return f'summary:{metric}:{scope}:{scope_id}:{role}'
+
+
+def summary_batch(entries, role, build):
+    """
+    Serve many summaries with one cache round trip.
+
+    `entries` are (metric, scope, scope_id) tuples. `build(missing)` is called once with the
+    entries that were not cached and must return {entry: data} for them. Returns
+    ({entry: data}, number of entries that were built).
+    """
+    cache = summary_cache()
+    keys = {entry: summary_cache_key(*entry, role) for entry in entries}
+    cached = cache.get_many(list(keys.values()))
+    data = {entry: cached[key] for entry, key in keys.items() if key in cached}
+    missing = [entry for entry in keys if entry not in data]
+    if missing:
+        built = build(missing)
+        cache.set_many({keys[entry]: built[entry] for entry in missing}, getattr(settings, 'SUMMARY_CACHE_TIMEOUT', 300))
+        data.update(built)
+    return data, len(missing)
+
+
+def invalidate_summaries(metric, scopes, using='default'):
+    """
+    Drop the cached summaries of `metric` for every (scope, scope_id) in `scopes`, for all roles.
+
+    Keys are dropped straight away and again when the surrounding transaction commits, so a
+    summary cached by a concurrent request before the commit does not outlive the write.
+    """
+    keys = [
+        summary_cache_key(metric, scope, scope_id, role)
+        for scope, scope_id in set(scopes)
+        for role in SUMMARY_CACHE_ROLES
+    ]
+    if not keys:
+        return
+    summary_cache().delete_many(keys)
+    transaction.on_commit(lambda: summary_cache().delete_many(keys), using=using)
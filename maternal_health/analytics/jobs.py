@@ -0,0 +1,154 @@
+import gzip
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .columnar import COLUMNAR_FORMATS, columnar_available, iter_columnar
+from .exports import EXPORT_CHUNK_SIZE, write_queryset_csv
+from .models import ExportJob
+from .replica import read_database
+
+
+'''
+
+Background exports. An export endpoint asked for more rows than
+EXPORT_JOB_THRESHOLD (or a client posting to /api/analytics/exports/)
+queues an ExportJob instead of streaming; the run_export_worker command
+claims queued jobs and runs them in a process pool, writing gzipped CSV,
+Parquet or Arrow files under MEDIA_ROOT/exports/ that the download
+endpoint then serves.
+
+'''
+
+# Rows above which the export endpoints queue a job instead of streaming the file
+EXPORT_JOB_THRESHOLD = 100000
+
+# Seconds a job may stay running before it is taken to have lost its worker
+EXPORT_JOB_TIMEOUT = 60 * 60
+
+# Dataset -> (queryset builder taking (user, filters), file name without extension, filters it accepts).
+# The builders are the export endpoints' own, imported lazily as the app views import this module.
+EXPORT_DATASETS = {
+    'visits': ('visits.views._build_visit_queryset', 'visits_export', ('patient_pk', 'pregnancy_pk', 'delivery_pk')),
+    'pregnancies': ('pregnancies.views._build_pregnancy_queryset', 'pregnancies_export', ('patient_pk',)),
+    'deliveries': ('deliveries.views._build_delivery_queryset', 'deliveries_export', ('patient_pk',)),
+}
+
+# Values of the export endpoints' ?format= parameter
+EXPORT_FORMATS = ['csv', *COLUMNAR_FORMATS]
+
+
+def export_job_threshold():
+    return getattr(settings, 'EXPORT_JOB_THRESHOLD', EXPORT_JOB_THRESHOLD)
+
+
+async def exceeds_export_threshold(queryset):
+    """Whether `queryset` has more rows than the threshold, without counting all of them."""
+    threshold = export_job_threshold()
+    return await queryset.order_by()[threshold:threshold + 1].aexists()
+
+
+def export_format_error(export_format):
+    """Why `export_format` cannot be served, or None if it can."""
+    if export_format not in EXPORT_FORMATS:
+        return f"format must be one of: {', '.join(EXPORT_FORMATS)}."
+    if export_format in COLUMNAR_FORMATS and not columnar_available():
+        return 'Parquet and Arrow exports need pyarrow installed on the server.'
+    return None
+
+
+def export_filename(dataset, export_format):
+    extension = COLUMNAR_FORMATS[export_format][1] if export_format in COLUMNAR_FORMATS else export_format
+    return f"{EXPORT_DATASETS[dataset][1]}.{extension}"
+
+
+def submit_export_job(user, dataset, filters, export_format='csv'):
+    """Queue an export of `dataset` as `user` sees it; `filters` are the endpoint's URL kwargs."""
+    allowed = EXPORT_DATASETS[dataset][2]
+    filters = {name: int(value) for name, value in filters.items() if name in allowed and value is not None}
+    return ExportJob.objects.create(user=user, dataset=dataset, filters=filters, export_format=export_format)
+
+
+def fail_stale_export_jobs(now=None):
+    """
+    Fail the jobs running for longer than EXPORT_JOB_TIMEOUT, whose worker must have died (a killed
+    command or a lost machine), so their clients stop polling. Returns how many were failed.
+    """
+    timeout = getattr(settings, 'EXPORT_JOB_TIMEOUT', EXPORT_JOB_TIMEOUT)
+    now = now or timezone.now()
+    return ExportJob.objects.filter(status='running', started_at__lt=now - timedelta(seconds=timeout)).update(
+        status='failed', error=f'The export did not finish within {timeout} seconds; its worker stopped.', finished_at=now,
+    )
+
+
+def claim_export_jobs(limit):
+    """
+    Mark up to `limit` of the oldest pending jobs as running and return their ids.
+
+    Each job is claimed with a conditional UPDATE, so several workers can share one queue.
+    Jobs abandoned by a dead worker are failed first.
+    """
+    claimed = []
+    if limit <= 0:
+        return claimed
+    fail_stale_export_jobs()
+    pending = ExportJob.objects.filter(status='pending').order_by('created_at', 'pk').values_list('pk', flat=True)
+    for job_id in pending[:limit]:
+        if ExportJob.objects.filter(pk=job_id, status='pending').update(status='running', started_at=timezone.now()):
+            claimed.append(job_id)
+    return claimed
+
+
+# Columnar files are compressed internally; CSV is gzipped as a whole
+def job_download_name(job):
+    name = export_filename(job.dataset, job.export_format)
+    return f"{name}.gz" if job.export_format == 'csv' else name
+
+
+def _write_export(queryset, export_format, path, chunk_size):
+    if export_format == 'csv':
+        with gzip.open(path, 'wt', encoding='utf-8', newline='') as stream:
+            return write_queryset_csv(queryset, stream, chunk_size=chunk_size)
+    counter = []
+    with open(path, 'wb') as stream:
+        for chunk in iter_columnar(queryset, export_format, counter=counter):
+            stream.write(chunk)
+    return counter[0]
+
+
+def run_export_job(job_id, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Run one claimed job: write its rows in the job's format and record the outcome on the job.
+
+    Runs in a worker process, so it takes the job id rather than the instance. The file is
+    written under a temporary name and moved into place once complete. Returns the job.
+    """
+    job = ExportJob.objects.select_related('user').get(pk=job_id)
+    builder_path, _, _ = EXPORT_DATASETS[job.dataset]
+    name = f"exports/{job.pk}-{job_download_name(job)}"
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    partial = f"{path}.part"
+
+    try:
+        queryset = import_string(builder_path)(job.user, job.filters).using(read_database())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        job.row_count = _write_export(queryset, job.export_format, partial, chunk_size)
+        os.replace(partial, path)
+    except Exception as exc:
+        if os.path.exists(partial):
+            os.remove(partial)
+        return fail_export_job(job_id, exc)
+
+    job.file.name = name
+    job.status = 'done'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['file', 'row_count', 'status', 'finished_at'])
+    return job
+
+
+def fail_export_job(job_id, exc):
+    ExportJob.objects.filter(pk=job_id).update(status='failed', error=str(exc) or exc.__class__.__name__, finished_at=timezone.now())
+    return ExportJob.objects.get(pk=job_id)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from analytics.rollups import REBUILD_CHUNK_SIZE, ROLLUP_SPECS, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the summary rollup tables from the visit, pregnancy and delivery tables.'
+
+    def add_arguments(self, parser):
+        metrics = sorted(spec.metric for spec in ROLLUP_SPECS.values())
+        parser.add_argument('--metric', choices=metrics, action='append', help='Only rebuild this metric (repeatable).')
+        parser.add_argument('--chunk-size', type=int, default=REBUILD_CHUNK_SIZE)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        for spec in ROLLUP_SPECS.values():
+            if options['metric'] and spec.metric not in options['metric']:
+                continue
+            buckets = rebuild_rollups(spec, chunk_size=options['chunk_size'], using=options['database'])
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {spec.metric} rollups: {buckets} buckets'))
@@ -0,0 +1,72 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from analytics.jobs import claim_export_jobs, fail_export_job, run_export_job
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued CSV export jobs in a pool of worker processes, one job per process, '
+        'writing gzipped files under MEDIA_ROOT/exports/. Several workers can share the queue.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='Jobs run in parallel (0 runs them in this process).')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between checks for new jobs.')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty instead of waiting for new jobs.')
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 0:
+            self._run_inline(options)
+        else:
+            self._run_pool(options)
+
+    def _report(self, job):
+        if job.status == 'done':
+            self.stdout.write(self.style.SUCCESS(f'Export #{job.pk} ({job.dataset}): {job.row_count} rows -> {job.file.name}'))
+        else:
+            self.stdout.write(self.style.ERROR(f'Export #{job.pk} ({job.dataset}) failed: {job.error}'))
+
+    def _run_inline(self, options):
+        while True:
+            claimed = claim_export_jobs(1)
+            if claimed:
+                self._report(run_export_job(claimed[0]))
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['poll_interval'])
+
+    def _run_pool(self, options):
+        processes = options['processes']
+        # Spawned processes set Django up afresh instead of inheriting this process's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        running = {}
+
+        with ProcessPoolExecutor(processes, mp_context=context, initializer=django.setup) as pool:
+            self.stdout.write(f'Export worker started with {processes} processes')
+            while True:
+                for job_id in claim_export_jobs(processes - len(running)):
+                    running[pool.submit(run_export_job, job_id)] = job_id
+
+                if not running:
+                    if options['once']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        job = future.result()
+                    except Exception as exc:  # the worker process died before recording the outcome
+                        job = fail_export_job(job_id, exc)
+                    self._report(job)
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from analytics.replica import copy_sqlite_database, replica_alias, stamp_heartbeat
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresh the read replica: stamp the replica heartbeat on default and, for a local SQLite '
+        'replica, copy default over it. Run it with --interval to keep the replica in sync.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', help='Replica alias (default: REPLICA_DATABASE, or "replica").')
+        parser.add_argument('--interval', type=float, default=0, help='Sync every this many seconds (0 syncs once).')
+        parser.add_argument(
+            '--heartbeat-only', action='store_true',
+            help='Only stamp the heartbeat, for a replica the database server keeps in sync.',
+        )
+
+    def handle(self, *args, **options):
+        alias = options['database'] or replica_alias() or 'replica'
+        if alias not in connections.settings or alias == DEFAULT_DB_ALIAS:
+            raise CommandError(f'"{alias}" is not a replica database alias.')
+        if not options['heartbeat_only'] and not (connections[alias].vendor == connections[DEFAULT_DB_ALIAS].vendor == 'sqlite'):
+            raise CommandError('Only SQLite databases can be copied; use --heartbeat-only with server-side replication.')
+
+        while True:
+            beat_at = stamp_heartbeat()
+            if not options['heartbeat_only']:
+                copy_sqlite_database(connections[alias].settings_dict['NAME'])
+            self.stdout.write(self.style.SUCCESS(f'Replica "{alias}" synced at {beat_at:%Y-%m-%d %H:%M:%S}'))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SummaryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=20)),
+                ('scope', models.CharField(max_length=20)),
+                ('scope_id', models.PositiveBigIntegerField(default=0)),
+                ('dimension', models.CharField(max_length=30)),
+                ('bucket', models.CharField(blank=True, max_length=100, null=True)),
+                ('count', models.BigIntegerField(default=0)),
+                ('total', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['metric', 'scope', 'scope_id'], name='analytics_s_metric_1895be_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:23
+
+from django.db import migrations, models
+
+
+# Fold rows that concurrent first writes duplicated into one per bucket, keeping their summed deltas.
+def merge_duplicate_buckets(apps, schema_editor):
+    SummaryRollup = apps.get_model('analytics', 'SummaryRollup')
+    rollups = SummaryRollup.objects.using(schema_editor.connection.alias)
+    key = ('metric', 'scope', 'scope_id', 'dimension', 'bucket')
+    duplicates = (
+        rollups.order_by().values(*key)
+        .annotate(rows=models.Count('pk'), keep=models.Min('pk'), count_sum=models.Sum('count'), total_sum=models.Sum('total'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in list(duplicates):
+        rollups.filter(pk=duplicate['keep']).update(count=duplicate['count_sum'], total=duplicate['total_sum'])
+        rollups.filter(**{field: duplicate[field] for field in key}).exclude(pk=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_replicaheartbeat'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_buckets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='summaryrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('bucket__isnull', False)), fields=('metric', 'scope', 'scope_id', 'dimension', 'bucket'), name='summaryrollup_unique_bucket'),
+        ),
+        migrations.AddConstraint(
+            model_name='summaryrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('bucket__isnull', True)), fields=('metric', 'scope', 'scope_id', 'dimension'), name='summaryrollup_unique_null_bucket'),
+        ),
+    ]
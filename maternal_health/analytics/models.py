@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.db import models
+
+
+# One aggregate bucket behind the summary endpoints: how many records fall into `bucket` of `dimension`
+# for a metric (visits, pregnancies, deliveries) within a scope (global, patient, pregnancy, delivery),
+# plus the running sum of a numeric field. Kept up to date incrementally by analytics.signals.
+class SummaryRollup(models.Model):
+    metric = models.CharField(max_length=20)
+    scope = models.CharField(max_length=20)
+    scope_id = models.PositiveBigIntegerField(default=0)  # 0 for the global scope
+    dimension = models.CharField(max_length=30)
+    bucket = models.CharField(max_length=100, null=True, blank=True)
+    count = models.BigIntegerField(default=0)
+    total = models.BigIntegerField(default=0)  # sum in the field's smallest unit, e.g. tenths of g/dL
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['metric', 'scope', 'scope_id']),
+        ]
+        # One row per bucket, so concurrent first writes cannot create a duplicate that later deltas
+        # update twice. NULL buckets never conflict in a plain unique index, hence the second one.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['metric', 'scope', 'scope_id', 'dimension', 'bucket'],
+                condition=models.Q(bucket__isnull=False), name='summaryrollup_unique_bucket',
+            ),
+            models.UniqueConstraint(
+                fields=['metric', 'scope', 'scope_id', 'dimension'],
+                condition=models.Q(bucket__isnull=True), name='summaryrollup_unique_null_bucket',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.metric} {self.scope}:{self.scope_id} {self.dimension}={self.bucket} ({self.count})"
+
+
+# An export run in the background by the run_export_worker command; the file (gzipped CSV, Parquet or Arrow) lands under MEDIA_ROOT/exports/.
+# `filters` holds the URL kwargs of the export endpoint (patient_pk, pregnancy_pk, delivery_pk).
+class ExportJob(models.Model):
+    DATASETS = [
+        ("visits", "Visits"),
+        ("pregnancies", "Pregnancies"),
+        ("deliveries", "Deliveries"),
+    ]
+    STATUSES = [
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='export_jobs', on_delete=models.CASCADE)
+    dataset = models.CharField(max_length=20, choices=DATASETS)
+    filters = models.JSONField(default=dict, blank=True)
+    FORMATS = [
+        ("csv", "CSV (gzipped)"),
+        ("parquet", "Parquet"),
+        ("arrow", "Arrow IPC stream"),
+    ]
+    export_format = models.CharField(max_length=10, choices=FORMATS, default='csv')
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    row_count = models.PositiveBigIntegerField(null=True, blank=True)
+    file = models.FileField(upload_to='exports/', blank=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),  # the worker's queue
+        ]
+
+    def __str__(self):
+        return f"{self.dataset} export #{self.pk} ({self.status})"
+
+
+# Heartbeat for measuring replica lag: sync_replica stamps the single row on the primary, and the copy of
+# it on the replica tells how old the replica's data is (see analytics.replica).
+class ReplicaHeartbeat(models.Model):
+    beat_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"heartbeat {self.beat_at.isoformat()}"
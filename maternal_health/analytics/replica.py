@@ -0,0 +1,213 @@
+import re
+import sqlite3
+import time
+from contextvars import ContextVar
+from hashlib import sha256
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils import timezone
+
+from .models import ReplicaHeartbeat
+
+
+'''
+
+Read-replica routing. With REPLICA_DATABASE set, GET and HEAD requests
+to the routes matched by REPLICA_ROUTES (summaries, exports, calendars
+and list pages by default) read from the replica, so heavy analytics
+traffic stays off the database that takes clinical writes. Everything
+else, and every write, goes to `default`. A request reads from
+`default` instead when:
+
+- the replica's data is older than REPLICA_MAX_LAG seconds, judged by
+  the ReplicaHeartbeat row copied to it, or is unreachable;
+- the same client (the same Authorization header or session) made a
+  successful write in the last REPLICA_READ_YOUR_WRITES seconds, so it
+  always sees its own changes.
+
+Background export jobs read from the replica under the same lag rule.
+The sync_replica command stamps the heartbeat on `default` and, for a
+local SQLite replica, copies `default` over it.
+
+'''
+
+# The database reads of the current request go to; None means default. Set per request by the middleware.
+_read_alias = ContextVar('replica_read_alias', default=None)
+
+REPLICA_ROUTES = r'^(?!export-job).+-(list|summary|export|calendar|high-risk)$'
+
+REPLICA_MAX_LAG = 30  # seconds
+
+REPLICA_READ_YOUR_WRITES = 10  # seconds
+
+# How long a replica's heartbeat is trusted before it is read again
+REPLICA_LAG_CHECK_INTERVAL = 5  # seconds
+
+# Alias -> (monotonic time checked, heartbeat on the replica or None)
+_heartbeats = {}
+
+_SAFE_METHODS = ('GET', 'HEAD')
+
+# Users, tokens and sessions are always read from default, so credentials issued a moment ago work on replica routes
+_PRIMARY_APPS = {'auth', 'authtoken', 'contenttypes', 'sessions', 'token_blacklist', 'users'}
+
+
+def replica_alias():
+    return getattr(settings, 'REPLICA_DATABASE', None)
+
+
+def _replica_heartbeat(alias):
+    checked = _heartbeats.get(alias)
+    if checked is None or time.monotonic() - checked[0] >= getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', REPLICA_LAG_CHECK_INTERVAL):
+        try:
+            beat_at = ReplicaHeartbeat.objects.using(alias).values_list('beat_at', flat=True).first()
+        except DatabaseError:
+            beat_at = None  # not synced yet, or down
+        checked = _heartbeats[alias] = (time.monotonic(), beat_at)
+    return checked[1]
+
+
+def replica_lag(alias):
+    """How many seconds old the data on replica `alias` is, or None if that is unknown."""
+    beat_at = _replica_heartbeat(alias)
+    return None if beat_at is None else max((timezone.now() - beat_at).total_seconds(), 0.0)
+
+
+def fresh_replica():
+    """The replica alias if one is configured and within REPLICA_MAX_LAG, else None."""
+    alias = replica_alias()
+    if not alias:
+        return None
+    lag = replica_lag(alias)
+    return alias if lag is not None and lag <= getattr(settings, 'REPLICA_MAX_LAG', REPLICA_MAX_LAG) else None
+
+
+def read_database():
+    """The alias background reads (export jobs) should use."""
+    return fresh_replica() or DEFAULT_DB_ALIAS
+
+
+def stamp_heartbeat():
+    """Record the time on default. Replication carries the row over, and its age on the replica is the lag."""
+    beat_at = timezone.now()
+    ReplicaHeartbeat.objects.using(DEFAULT_DB_ALIAS).update_or_create(pk=1, defaults={'beat_at': beat_at})
+    return beat_at
+
+
+def copy_sqlite_database(target, source_alias=DEFAULT_DB_ALIAS):
+    """
+    Copy SQLite database `source_alias` over the file `target` with SQLite's online backup.
+
+    The copy is written in one step, so readers of `target` see either the old or the new data.
+    """
+    source = connections[source_alias]
+    source.ensure_connection()
+    destination = sqlite3.connect(target)
+    try:
+        source.connection.backup(destination)
+    finally:
+        destination.close()
+
+
+def _client_key(request):
+    credentials = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    return f"replica-pin:{sha256(credentials.encode()).hexdigest()}" if credentials else None
+
+
+class ReplicaRouter:
+    """Send the reads of replica-routed requests to the replica; all writes and migrations go to default."""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in _PRIMARY_APPS:
+            return None
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Explicit, so instances read from the replica are still saved to default
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # A row read from the replica is the same row as on default
+        databases = {DEFAULT_DB_ALIAS, replica_alias()}
+        return True if obj1._state.db in databases and obj2._state.db in databases else None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of default, schema included
+        return db != replica_alias() if replica_alias() else None
+
+
+def _end_routing():
+    _read_alias.set(None)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Pick the database each request reads from, and pin clients that have just written to default.
+
+    The choice is made once the URL is resolved and holds until the response is fully sent, so
+    streamed exports keep reading from the database they started on. Works in both modes: under
+    ASGI the alias is set in the request's own context, which the async views and the threads
+    running their queries see.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        _read_alias.set(None)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            _read_alias.set(None)
+            raise
+        key = self._pin_key(request, response)
+        if key:
+            cache.set(key, True, getattr(settings, 'REPLICA_READ_YOUR_WRITES', REPLICA_READ_YOUR_WRITES))
+        return self._end(response)
+
+    async def __acall__(self, request):
+        _read_alias.set(None)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            _read_alias.set(None)
+            raise
+        key = self._pin_key(request, response)
+        if key:
+            await cache.aset(key, True, getattr(settings, 'REPLICA_READ_YOUR_WRITES', REPLICA_READ_YOUR_WRITES))
+        return self._end(response)
+
+    def _pin_key(self, request, response):
+        # Clients that have just written read their own writes from default for a while
+        if request.method not in _SAFE_METHODS and response.status_code < 400 and replica_alias():
+            return _client_key(request)
+        return None
+
+    def _end(self, response):
+        if response.streaming:
+            response._resource_closers.append(_end_routing)
+        else:
+            _end_routing()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in _SAFE_METHODS or not replica_alias():
+            return None
+        match = request.resolver_match
+        if not match.url_name or not re.search(getattr(settings, 'REPLICA_ROUTES', REPLICA_ROUTES), match.url_name):
+            return None
+        key = _client_key(request)
+        if key and cache.get(key):
+            return None  # read your own writes
+        _read_alias.set(fresh_replica())
+        return None
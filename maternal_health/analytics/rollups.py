@@ -0,0 +1,349 @@
+from collections import defaultdict
+from datetime import datetime
+from decimal import Context, Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, CharField, Count, F, Q, Sum, Value, When
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from deliveries.models import Delivery
+from pregnancies.models import Pregnancy
+from visits.models import Visit
+from .cache import invalidate_summaries
+from .models import SummaryRollup
+
+
+# Averages keep the 15 significant digits the database aggregates used to return.
+AVERAGE_CONTEXT = Context(prec=15)
+
+REBUILD_CHUNK_SIZE = 2000
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def _flag(value):
+    return None if value is None else ('true' if value else 'false')
+
+
+# Hypertension in pregnancy starts at 140/90 and is severe from 160/110
+HYPERTENSIVE_BP = (140, 90)
+SEVERE_BP = (160, 110)
+
+
+def bp_category(systolic, diastolic):
+    if systolic is None or diastolic is None:
+        return None
+    if systolic >= SEVERE_BP[0] or diastolic >= SEVERE_BP[1]:
+        return 'severe'
+    if systolic >= HYPERTENSIVE_BP[0] or diastolic >= HYPERTENSIVE_BP[1]:
+        return 'hypertensive'
+    return 'normal'
+
+
+def _bp_category_expression(systolic, diastolic):
+    def reaches(limits):
+        return Q(**{f'{systolic}__gte': limits[0]}) | Q(**{f'{diastolic}__gte': limits[1]})
+
+    return Case(
+        When(Q(**{f'{systolic}__isnull': True}) | Q(**{f'{diastolic}__isnull': True}), then=Value(None)),
+        When(reaches(SEVERE_BP), then=Value('severe')),
+        When(reaches(HYPERTENSIVE_BP), then=Value('hypertensive')),
+        default=Value('normal'),
+        output_field=CharField(),
+    )
+
+
+def band_10(value):
+    """Lower bound of the value's 10-unit band, e.g. 127 -> '120'."""
+    return None if value is None else str(value // 10 * 10)
+
+
+def month_bucket(value):
+    """First day of the value's month as an ISO string, matching TruncMonth in the current time zone."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        value = value.date()
+    return value.replace(day=1).isoformat()
+
+
+# How the database computes each bucket function, for summaries of a filtered queryset: bucket
+# function -> (expression over the histogram's fields, function turning its value into the bucket)
+BUCKET_EXPRESSIONS = {
+    _text: (F, _text),
+    _flag: (F, _flag),
+    month_bucket: (TruncMonth, month_bucket),
+    bp_category: (_bp_category_expression, _text),
+    band_10: (lambda name: F(name) / 10 * 10, band_10),
+}
+
+
+class RollupSpec:
+    """
+    Describes how the records of one model feed the rollup table.
+
+    scopes:     scope name -> foreign key whose id identifies the scope (the global scope is implicit)
+    histograms: dimension -> (field, function turning the field value into a bucket); the field may be
+                a tuple of fields whose values are all passed to the function
+    sums:       numeric fields whose count and running total are kept for averages
+    """
+
+    def __init__(self, metric, model, scopes, histograms, sums):
+        self.metric = metric
+        self.model = model
+        opts = model._meta
+        self.scopes = {scope: opts.get_field(name).attname for scope, name in scopes.items()}
+        self.histograms = {}
+        histogram_fields = set()
+        for dimension, (names, to_bucket) in histograms.items():
+            names = names if isinstance(names, tuple) else (names,)
+            self.histograms[dimension] = (tuple(opts.get_field(name).attname for name in names), to_bucket)
+            histogram_fields.update(names)
+        self.sum_fields = {name: opts.get_field(name) for name in sums}
+        # Fields needed to compute contributions, used to load as little as possible
+        self.fields = sorted(set(scopes.values()) | histogram_fields | set(sums))
+
+    def _scaled(self, field, value):
+        # Sums are stored as integers in the field's smallest unit so they never drift
+        value = field.to_python(value)
+        if field.get_internal_type() == 'DecimalField':
+            return int(value.scaleb(field.decimal_places).to_integral_value())
+        return int(value)
+
+    def contributions(self, instance):
+        """Map every rollup key the instance counts towards to its (count, total) contribution."""
+        facts = [('total', None, 0)]
+        for dimension, (attnames, to_bucket) in self.histograms.items():
+            facts.append((dimension, to_bucket(*(getattr(instance, attname) for attname in attnames)), 0))
+        for name, field in self.sum_fields.items():
+            value = getattr(instance, field.attname)
+            if value is not None:
+                facts.append((name, None, self._scaled(field, value)))
+
+        scopes = [('global', 0)] + [(scope, getattr(instance, attname)) for scope, attname in self.scopes.items()]
+        result = {}
+        for scope, scope_id in scopes:
+            if scope_id is None:
+                continue
+            for dimension, bucket, total in facts:
+                result[(scope, scope_id, dimension, bucket)] = (1, total)
+        return result
+
+
+VISIT_ROLLUP = RollupSpec(
+    'visits', Visit,
+    scopes={'patient': 'patient', 'pregnancy': 'pregnancy', 'delivery': 'delivery'},
+    histograms={
+        'visit_type': ('visit_type', _text),
+        'month': ('visit_date', month_bucket),
+        'bp_category': (('systolic', 'diastolic'), bp_category),
+        'systolic_band': ('systolic', band_10),
+    },
+    sums=['hemoglobin_level', 'weight_kg', 'systolic', 'diastolic'],
+)
+
+PREGNANCY_ROLLUP = RollupSpec(
+    'pregnancies', Pregnancy,
+    scopes={'patient': 'patient'},
+    histograms={'blood_type': ('blood_type', _text), 'month': ('expected_delivery_date', month_bucket)},
+    sums=['gestational_age_weeks'],
+)
+
+DELIVERY_ROLLUP = RollupSpec(
+    'deliveries', Delivery,
+    scopes={'patient': 'patient'},
+    histograms={
+        'delivery_mode': ('delivery_mode', _text),
+        'alive': ('alive', _flag),
+        'place_of_delivery': ('place_of_delivery', _text),  # per-facility counts
+        'month': ('delivery_date', month_bucket),
+    },
+    sums=['birth_weight_g'],
+)
+
+ROLLUP_SPECS = {spec.model: spec for spec in (VISIT_ROLLUP, PREGNANCY_ROLLUP, DELIVERY_ROLLUP)}
+
+
+def spec_for(model):
+    """Rollup spec for a model or one of its proxies, or None if the model is not rolled up."""
+    return ROLLUP_SPECS.get(model._meta.concrete_model)
+
+
+def _merge(deltas, contributions, sign):
+    for key, (count, total) in contributions.items():
+        delta = deltas[key]
+        delta[0] += sign * count
+        delta[1] += sign * total
+
+
+def _nonzero(deltas):
+    return {key: delta for key, delta in deltas.items() if delta != [0, 0]}
+
+
+def collect_deltas(spec, added=(), removed=()):
+    """Net change to every rollup key when `added` records appear and `removed` records go away."""
+    deltas = defaultdict(lambda: [0, 0])
+    for instance in added:
+        _merge(deltas, spec.contributions(instance), 1)
+    for instance in removed:
+        _merge(deltas, spec.contributions(instance), -1)
+    return _nonzero(deltas)
+
+
+def diff_contributions(previous, current):
+    """Net change between two contributions() results of the same record."""
+    deltas = defaultdict(lambda: [0, 0])
+    _merge(deltas, current, 1)
+    _merge(deltas, previous, -1)
+    return _nonzero(deltas)
+
+
+def apply_deltas(spec, deltas, using='default'):
+    """Add `deltas` to the stored buckets, creating buckets the first time they are touched."""
+    if not deltas:
+        return
+    rollups = SummaryRollup.objects.using(using)
+    with transaction.atomic(using=using):
+        for (scope, scope_id, dimension, bucket), (count, total) in deltas.items():
+            key = {'metric': spec.metric, 'scope': scope, 'scope_id': scope_id, 'dimension': dimension, 'bucket': bucket}
+            change = {'count': F('count') + count, 'total': F('total') + total}
+            if rollups.filter(**key).update(**change):
+                continue
+            try:
+                with transaction.atomic(using=using):
+                    rollups.create(**key, count=count, total=total)
+            except IntegrityError:
+                # Another transaction created the bucket after the update found none; the unique
+                # constraint made this insert wait for it, so the update now finds its row
+                rollups.filter(**key).update(**change)
+    invalidate_summaries(spec.metric, [(scope, scope_id) for scope, scope_id, _, _ in deltas], using=using)
+
+
+def rebuild_rollups(spec, chunk_size=REBUILD_CHUNK_SIZE, using='default'):
+    """Recompute every bucket of a metric from its base table. Returns the number of buckets written."""
+    records = spec.model._base_manager.using(using).only(*spec.fields).iterator(chunk_size=chunk_size)
+    deltas = defaultdict(lambda: [0, 0])
+    for instance in records:
+        _merge(deltas, spec.contributions(instance), 1)
+
+    with transaction.atomic(using=using):
+        stale = SummaryRollup.objects.using(using).filter(metric=spec.metric)
+        scopes = set(stale.values_list('scope', 'scope_id').distinct())
+        stale.delete()
+        SummaryRollup.objects.using(using).bulk_create(
+            [
+                SummaryRollup(
+                    metric=spec.metric, scope=scope, scope_id=scope_id, dimension=dimension,
+                    bucket=bucket, count=count, total=total,
+                )
+                for (scope, scope_id, dimension, bucket), (count, total) in deltas.items()
+            ],
+            batch_size=chunk_size,
+        )
+    scopes.update((scope, scope_id) for scope, scope_id, _, _ in deltas)
+    invalidate_summaries(spec.metric, scopes, using=using)
+    return len(deltas)
+
+
+def _bucket_order(bucket):
+    # NULL buckets first, like the GROUP BY ... ORDER BY the summaries used to run
+    return (bucket is not None, bucket or '')
+
+
+class RollupSnapshot:
+    """The buckets of one metric within one scope, read in a single query."""
+
+    def __init__(self, spec, rows):
+        self.spec = spec
+        self._buckets = defaultdict(dict)
+        for dimension, bucket, count, total in rows:
+            counts = self._buckets[dimension].setdefault(bucket, [0, 0])
+            counts[0] += count
+            counts[1] += total
+
+    def count(self):
+        return self._buckets['total'].get(None, [0, 0])[0]
+
+    def histogram(self, dimension):
+        buckets = self._buckets[dimension]
+        return {bucket: buckets[bucket][0] for bucket in sorted(buckets, key=_bucket_order) if buckets[bucket][0]}
+
+    def monthly(self, dimension='month'):
+        return [{'month': month, 'count': count} for month, count in self.histogram(dimension).items()]
+
+    def bands(self, dimension, width=10):
+        """Counts per numeric band (see band_10), lowest band first; records without a value are left out."""
+        counts = self.histogram(dimension)
+        lows = sorted(int(bucket) for bucket in counts if bucket is not None)
+        return [{'from': low, 'to': low + width - 1, 'count': counts[str(low)]} for low in lows]
+
+    def average(self, name):
+        field = self.spec.sum_fields[name]
+        count, total = self._buckets[name].get(None, [0, 0])
+        if not count:
+            return None
+        if field.get_internal_type() == 'DecimalField':
+            return AVERAGE_CONTEXT.divide(Decimal(total).scaleb(-field.decimal_places), count)
+        return total / count
+
+
+async def aread_rollup(spec, scope, scope_id=0):
+    """Load the buckets of `spec` for one scope through the async ORM; pass scope=None for an empty result."""
+    if scope is None:
+        return RollupSnapshot(spec, [])
+    rows = SummaryRollup.objects.filter(
+        metric=spec.metric, scope=scope, scope_id=scope_id,
+    ).values_list('dimension', 'bucket', 'count', 'total')
+    return RollupSnapshot(spec, [row async for row in rows])
+
+
+async def asummarize(spec, queryset):
+    """
+    A RollupSnapshot of the records in `queryset`, for the date ranges the stored rollups (kept for
+    all time) cannot answer. The database computes it: one query for the count and the sums, and
+    one grouped query per histogram.
+    """
+    queryset = queryset.order_by()
+    sums = {}
+    for name in spec.sum_fields:
+        sums[f'{name}_count'] = Count(name)
+        sums[f'{name}_sum'] = Sum(name)
+    totals = await queryset.aaggregate(records=Count('pk'), **sums)
+
+    rows = [('total', None, totals['records'], 0)]
+    for name, field in spec.sum_fields.items():
+        total = totals[f'{name}_sum']
+        rows.append((name, None, totals[f'{name}_count'], 0 if total is None else spec._scaled(field, total)))
+    for dimension, (attnames, to_bucket) in spec.histograms.items():
+        expression, from_value = BUCKET_EXPRESSIONS[to_bucket]
+        grouped = queryset.annotate(rollup_bucket=expression(*attnames)).values('rollup_bucket').annotate(records=Count('pk'))
+        async for group in grouped.values_list('rollup_bucket', 'records'):
+            rows.append((dimension, from_value(group[0]), group[1], 0))
+    return RollupSnapshot(spec, rows)
+
+
+def read_rollups(specs, scope, scope_ids):
+    """
+    Load the buckets of several metrics for many scopes of one kind in a single query.
+
+    Returns {(metric, scope_id): RollupSnapshot} with an entry for every combination; scopes
+    without records get an empty snapshot, the same as aread_rollup returns.
+    """
+    specs = list(specs)
+    scope_ids = list(scope_ids)
+    rows = defaultdict(list)
+    if specs and scope_ids:
+        buckets = SummaryRollup.objects.filter(
+            metric__in=[spec.metric for spec in specs], scope=scope, scope_id__in=scope_ids,
+        ).values_list('metric', 'scope_id', 'dimension', 'bucket', 'count', 'total')
+        for metric, scope_id, *row in buckets:
+            rows[(metric, scope_id)].append(row)
+    return {
+        (spec.metric, scope_id): RollupSnapshot(spec, rows[(spec.metric, scope_id)])
+        for spec in specs for scope_id in scope_ids
+    }
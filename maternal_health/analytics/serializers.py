@@ -0,0 +1,46 @@
+from django.urls import reverse
+from rest_framework import serializers
+
+from .jobs import EXPORT_DATASETS, export_format_error, submit_export_job
+from .models import ExportJob
+
+
+# Serializer for background export jobs. Clients choose the dataset and its filters (the export endpoint's
+# patient_pk/pregnancy_pk/delivery_pk) and the file format; everything else is set by the worker, and download_url appears once the file is ready.
+class ExportJobSerializer(serializers.ModelSerializer):
+    format = serializers.ChoiceField(source='export_format', choices=ExportJob.FORMATS, default='csv')
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = ['id', 'dataset', 'filters', 'format', 'status', 'row_count', 'error', 'created_at', 'started_at', 'finished_at', 'download_url']
+        read_only_fields = ['status', 'row_count', 'error', 'created_at', 'started_at', 'finished_at']
+
+    def get_download_url(self, obj):
+        if obj.status != 'done':
+            return None
+        url = reverse('export-job-download', kwargs={'pk': obj.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def validate(self, data):
+        filters = data.get('filters') or {}
+        if not isinstance(filters, dict):
+            raise serializers.ValidationError({'filters': 'Must be an object.'})
+        allowed = EXPORT_DATASETS[data['dataset']][2]
+        unknown = sorted(set(filters) - set(allowed))
+        if unknown:
+            raise serializers.ValidationError({'filters': f"Unknown filters for {data['dataset']}: {', '.join(unknown)}."})
+        for name, value in filters.items():
+            if value is not None and (isinstance(value, bool) or not str(value).isdigit()):
+                raise serializers.ValidationError({'filters': f'{name} must be an id.'})
+        error = export_format_error(data['export_format'])
+        if error:
+            raise serializers.ValidationError({'format': error})
+        data['filters'] = filters
+        return data
+
+    def create(self, validated_data):
+        return submit_export_job(
+            self.context['request'].user, validated_data['dataset'], validated_data['filters'], validated_data['export_format'],
+        )
@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .rollups import apply_deltas, diff_contributions, spec_for
+
+'''
+
+Signals that keep the summary rollups in step with Visit, Pregnancy and
+Delivery writes (including their proxy models). An update only touches the
+buckets whose values actually changed; deletes subtract the record again.
+Bulk writes that bypass signals call collect_deltas()/apply_deltas() directly,
+and `manage.py rebuild_rollups` recomputes everything from scratch.
+
+'''
+@receiver(pre_save)
+def remember_rollup_contributions(sender, instance, using, **kwargs):
+    spec = spec_for(sender)
+    if spec is None or instance._state.adding or instance.pk is None:
+        return
+    previous = sender._base_manager.using(using).filter(pk=instance.pk).only(*spec.fields).first()
+    instance._rollup_previous = spec.contributions(previous) if previous else {}
+
+
+@receiver(post_save)
+def update_rollups_on_save(sender, instance, using, **kwargs):
+    spec = spec_for(sender)
+    if spec is None:
+        return
+    previous = instance.__dict__.pop('_rollup_previous', {})
+    apply_deltas(spec, diff_contributions(previous, spec.contributions(instance)), using=using)
+
+
+@receiver(post_delete)
+def update_rollups_on_delete(sender, instance, using, **kwargs):
+    spec = spec_for(sender)
+    if spec is None:
+        return
+    apply_deltas(spec, diff_contributions(spec.contributions(instance), {}), using=using)
@@ -0,0 +1,612 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, transaction
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from deliveries.models import Delivery
+from patients.models import Patient
+from pregnancies.models import Pregnancy
+from visits.models import Visit
+from .cache import SUMMARY_CACHE_HEADER, summary_cache
+from . import replica
+from .columnar import columnar_available, pa, pq
+from .models import ExportJob, ReplicaHeartbeat, SummaryRollup
+from .rollups import VISIT_ROLLUP, apply_deltas
+
+User = get_user_model()
+
+
+class SummaryRollupTests(TestCase):
+    """Test that summary rollups follow visit, pregnancy and delivery writes"""
+
+    def setUp(self):
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.pregnancy = Pregnancy.objects.create(
+            patient=self.patient, gestational_age_weeks=20,
+            last_menstrual_period=date(2024, 1, 20), blood_type='O+',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+    def _create_visit(self, **kwargs):
+        defaults = {
+            'patient': self.patient,
+            'pregnancy': self.pregnancy,
+            'provider': self.doctor_user,
+            'visit_type': 'Antenatal',
+            'blood_pressure': '120/80',
+            'heart_rate': 80,
+        }
+        defaults.update(kwargs)
+        return Visit.objects.create(**defaults)
+
+    def _rollup_rows(self):
+        return sorted(
+            SummaryRollup.objects.filter(count__gt=0).values_list('metric', 'scope', 'scope_id', 'dimension', 'bucket', 'count', 'total'),
+            key=repr,
+        )
+
+    def test_visit_summary_follows_updates_and_deletes(self):
+        """Editing or deleting a visit should move it between rollup buckets"""
+        first = self._create_visit(hemoglobin_level='11.0', weight_kg='60.00')
+        self._create_visit(hemoglobin_level='12.0')
+
+        first.visit_type = 'General'
+        first.hemoglobin_level = '10.0'
+        first.save()
+
+        url = f'/api/patients/{self.patient.id}/pregnancies/{self.pregnancy.id}/analytics/visits/summary/'
+        data = self.client.get(url).json()
+        self.assertEqual(data['total_visits'], 2)
+        self.assertEqual(data['by_type'], {'Antenatal': 1, 'General': 1})
+        self.assertEqual(data['average_hemoglobin'], 11.0)
+        self.assertEqual(data['average_weight_kg'], 60.0)
+
+        first.delete()
+        data = self.client.get(url).json()
+        self.assertEqual(data['total_visits'], 1)
+        self.assertEqual(data['by_type'], {'Antenatal': 1})
+        self.assertEqual(data['average_weight_kg'], None)
+
+    def test_pregnancy_summary_reads_rollups(self):
+        """Pregnancy summary should be served from rollups with the same shape as before"""
+        Pregnancy.objects.create(patient=self.patient, gestational_age_weeks=11)
+
+        response = self.client.get(f'/api/patients/{self.patient.id}/analytics/pregnancies/summary/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {
+            'total_pregnancies': 2,
+            'by_blood_type': {'null': 1, 'O+': 1},
+            'average_gestational_age_weeks': 15.5,
+            'monthly_expected_deliveries': [
+                {'month': None, 'count': 1},
+                {'month': '2024-10-01', 'count': 1},
+            ],
+        })
+
+    def test_rebuild_command_matches_incremental_rollups(self):
+        """Rebuilding from the base tables should give exactly the incrementally maintained buckets"""
+        visit = self._create_visit(hemoglobin_level='11.5', weight_kg='64.25')
+        visit.weight_kg = '65.75'
+        visit.save()
+        Delivery.objects.create(
+            pregnancy=self.pregnancy, patient=self.patient, delivery_mode='cesarean', birth_weight_g=3100,
+            place_of_delivery='Hospital A', skilled_birth_attendant=True, newborn_gender='Male',
+            apgar_score_1min=8, apgar_score_5min=9, alive=False,
+        )
+        incremental = self._rollup_rows()
+
+        call_command('rebuild_rollups', stdout=StringIO())
+
+        self.assertEqual(self._rollup_rows(), incremental)
+
+    def test_concurrent_first_writes_share_one_bucket(self):
+        """A bucket another transaction creates between the update and the insert should be updated, not duplicated"""
+        key = ('global', 0, 'visit_type', 'Antenatal')
+        apply_deltas(VISIT_ROLLUP, {key: [1, 0]})
+
+        update = QuerySet.update
+        calls = []
+
+        def lose_the_race(queryset, **kwargs):
+            # The first update runs before the other transaction's row is visible
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', lose_the_race):
+            apply_deltas(VISIT_ROLLUP, {key: [2, 0]})
+
+        rows = SummaryRollup.objects.filter(metric=VISIT_ROLLUP.metric, scope='global', dimension='visit_type', bucket='Antenatal')
+        self.assertEqual(list(rows.values_list('count', flat=True)), [3])
+        for bucket in ('Antenatal', None):
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                for _ in range(2):
+                    SummaryRollup.objects.create(metric='test', scope='global', dimension='visit_type', bucket=bucket)
+
+
+class SummaryCacheTests(TestCase):
+    """Test that summaries are cached per scope and role and dropped when their scope changes"""
+
+    def setUp(self):
+        summary_cache().clear()
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        other_user = User.objects.create_user(username='patient2', password='testpass123', role='patient')
+        self.other_patient = Patient.objects.get(user=other_user)
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.pregnancy = Pregnancy.objects.create(patient=self.patient, gestational_age_weeks=20)
+        self.other_pregnancy = Pregnancy.objects.create(patient=self.other_patient, gestational_age_weeks=30)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+    def _get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_repeat_request_is_served_from_cache(self):
+        """The second identical request should be a hit and return the same body"""
+        url = f'/api/patients/{self.patient.id}/analytics/pregnancies/summary/'
+        first = self._get(url)
+        second = self._get(url)
+
+        self.assertEqual(first[SUMMARY_CACHE_HEADER], 'MISS')
+        self.assertEqual(second[SUMMARY_CACHE_HEADER], 'HIT')
+        self.assertEqual(first.json(), second.json())
+
+    def test_write_drops_only_affected_scopes(self):
+        """A pregnancy write should refresh its patient and the global summary but keep other patients cached"""
+        own = f'/api/patients/{self.patient.id}/analytics/pregnancies/summary/'
+        other = f'/api/patients/{self.other_patient.id}/analytics/pregnancies/summary/'
+        everyone = '/api/analytics/pregnancies/summary/'
+        for url in (own, other, everyone):
+            self._get(url)
+
+        Pregnancy.objects.create(patient=self.patient, gestational_age_weeks=8)
+
+        response = self._get(own)
+        self.assertEqual(response[SUMMARY_CACHE_HEADER], 'MISS')
+        self.assertEqual(response.json()['total_pregnancies'], 2)
+        self.assertEqual(self._get(everyone)[SUMMARY_CACHE_HEADER], 'MISS')
+        self.assertEqual(self._get(other)[SUMMARY_CACHE_HEADER], 'HIT')
+
+    def test_roles_are_cached_separately_and_invalidated_together(self):
+        """Each role gets its own entry, and a write drops the entries of every role"""
+        url = f'/api/patients/{self.patient.id}/analytics/pregnancies/summary/'
+        self._get(url)
+        self.client.force_authenticate(user=self.patient_user)
+        self.assertEqual(self._get(url)[SUMMARY_CACHE_HEADER], 'MISS')
+        self.assertEqual(self._get(url)[SUMMARY_CACHE_HEADER], 'HIT')
+
+        self.pregnancy.gestational_age_weeks = 22
+        self.pregnancy.save()
+
+        self.assertEqual(self._get(url)[SUMMARY_CACHE_HEADER], 'MISS')
+        self.client.force_authenticate(user=self.doctor_user)
+        self.assertEqual(self._get(url)[SUMMARY_CACHE_HEADER], 'MISS')
+
+    def test_batch_submission_invalidates_visit_summaries(self):
+        """Bulk inserts bypass signals but should still drop the cached visit summaries"""
+        url = f'/api/patients/{self.patient.id}/pregnancies/{self.pregnancy.id}/analytics/visits/summary/'
+        self.assertEqual(self._get(url).json()['total_visits'], 0)
+
+        rows = [{'patient': self.patient.id, 'pregnancy': self.pregnancy.id, 'blood_pressure': '120/80', 'heart_rate': 80}]
+        self.client.post('/api/visits/batch/', rows, format='json')
+
+        response = self._get(url)
+        self.assertEqual(response[SUMMARY_CACHE_HEADER], 'MISS')
+        self.assertEqual(response.json()['total_visits'], 1)
+
+
+class BatchSummaryTests(TestCase):
+    """Test the batch summary endpoint used by dashboards"""
+
+    def setUp(self):
+        summary_cache().clear()
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.patients = []
+        for index in range(3):
+            user = User.objects.create_user(username=f'patient{index}', password='testpass123', role='patient')
+            patient = Patient.objects.get(user=user)
+            pregnancy = Pregnancy.objects.create(patient=patient, gestational_age_weeks=20 + index, blood_type='A+')
+            for _ in range(index + 1):
+                Visit.objects.create(
+                    patient=patient, pregnancy=pregnancy, provider=self.doctor_user, visit_type='Antenatal',
+                    blood_pressure='120/80', heart_rate=80, hemoglobin_level=11.5,
+                )
+            self.patients.append(patient)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+    def _batch(self, ids, scope='patient'):
+        return self.client.get('/api/analytics/summary/batch/', {'scope': scope, 'ids': ','.join(map(str, ids))})
+
+    def test_batch_matches_single_scope_summaries(self):
+        """Every summary in the batch should equal what the per-patient endpoints return"""
+        ids = [patient.id for patient in self.patients]
+        response = self._batch(ids)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual([result['id'] for result in results], ids)
+
+        for result in results:
+            for metric in ('visits', 'pregnancies', 'deliveries'):
+                single = self.client.get(f'/api/patients/{result["id"]}/analytics/{metric}/summary/')
+                self.assertEqual(result[metric], single.json())
+
+    def test_batch_reads_all_rollups_in_one_query(self):
+        """Uncached summaries for any number of ids should take one query, and cached ones none"""
+        ids = [patient.id for patient in self.patients]
+        with self.assertNumQueries(1):
+            self.assertEqual(self._batch(ids[:1])[SUMMARY_CACHE_HEADER], 'MISS')
+        with self.assertNumQueries(1):
+            self.assertEqual(self._batch(ids)[SUMMARY_CACHE_HEADER], 'MISS')
+        with self.assertNumQueries(0):
+            self.assertEqual(self._batch(ids)[SUMMARY_CACHE_HEADER], 'HIT')
+
+    def test_pregnancy_scope_returns_visit_summaries(self):
+        """Pregnancy ids should return visit summaries only, including empty ones for unknown ids"""
+        pregnancy = Pregnancy.objects.get(patient=self.patients[2])
+        results = self._batch([pregnancy.id, 999999], scope='pregnancy').json()['results']
+
+        self.assertEqual(set(results[0]), {'id', 'visits'})
+        self.assertEqual(results[0]['visits']['total_visits'], 3)
+        self.assertEqual(results[1]['visits']['total_visits'], 0)
+
+    def test_invalid_requests_are_rejected(self):
+        """Bad scopes or ids should return 400 and patients should be forbidden"""
+        self.assertEqual(self._batch([1], scope='facility').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._batch([]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._batch(['1', 'x']).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._batch(range(1, 202)).status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_authenticate(user=self.patients[0].user)
+        self.assertEqual(self._batch([self.patients[0].id]).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class AsyncAnalyticsViewTests(TestCase):
+    """Test the async summary and export views through the ASGI request path"""
+
+    def setUp(self):
+        summary_cache().clear()
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=patient_user)
+        pregnancy = Pregnancy.objects.create(patient=self.patient, gestational_age_weeks=20)
+        for pressure in ('120/80', '145/92'):
+            Visit.objects.create(
+                patient=self.patient, pregnancy=pregnancy, provider=self.doctor_user, visit_type='Antenatal',
+                blood_pressure=pressure, heart_rate=80, hemoglobin_level=11.5,
+            )
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.doctor_user).key}'}
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+    async def test_export_streams_asynchronously_under_asgi(self):
+        """Under ASGI the export should be an async stream with the same CSV as the WSGI path"""
+        response = await self.async_client.get('/api/analytics/visits/export/', headers=self.headers)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+
+        def sync_export():
+            response = self.client.get('/api/analytics/visits/export/')
+            return response.is_async, b''.join(response.streaming_content)
+
+        self.assertEqual(await sync_to_async(sync_export)(), (False, body))
+
+    def test_session_patient_exports(self):
+        """A patient logged in with a session should export their own records from the async views"""
+        Delivery.objects.create(
+            pregnancy=Pregnancy.objects.get(patient=self.patient), delivery_mode='vaginal', birth_weight_g=3100,
+            place_of_delivery='Kigali', skilled_birth_attendant=True, newborn_gender='Female',
+            apgar_score_1min=8, apgar_score_5min=9,
+        )
+        client = APIClient()
+        client.force_login(self.patient.user)
+        for dataset in ('visits', 'deliveries', 'pregnancies'):
+            with self.subTest(dataset=dataset):
+                response = client.get(f'/api/analytics/{dataset}/export/')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertGreater(len(b''.join(response.streaming_content).splitlines()), 1)
+
+    async def test_summary_matches_and_is_cached(self):
+        """The async summary should return the rollup summary and use the summary cache"""
+        url = f'/api/patients/{self.patient.id}/analytics/visits/summary/'
+        first = await self.async_client.get(url, headers=self.headers)
+        second = await self.async_client.get(url, headers=self.headers)
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.json()['total_visits'], 2)
+        self.assertEqual(first.json()['elevated_bp_visits'], 1)
+        self.assertEqual((first[SUMMARY_CACHE_HEADER], second[SUMMARY_CACHE_HEADER]), ('MISS', 'HIT'))
+
+    async def test_authentication_is_enforced(self):
+        """Missing or bad credentials should get 401 and other methods 405"""
+        response = await self.async_client.get('/api/analytics/pregnancies/summary/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+
+        response = await self.async_client.get('/api/analytics/pregnancies/summary/', headers={'Authorization': 'Token nope'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = await self.async_client.post('/api/analytics/pregnancies/summary/', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class ExportJobTests(TestCase):
+    """Test background export jobs: submitting, the worker, polling and downloading"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = self.settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        other = Patient.objects.get(user=User.objects.create_user(username='patient2', password='testpass123', role='patient'))
+        for patient in (self.patient, self.patient, other):
+            pregnancy = Pregnancy.objects.create(patient=patient, gestational_age_weeks=20)
+            Visit.objects.create(patient=patient, pregnancy=pregnancy, provider=self.doctor_user, visit_type='Antenatal', heart_rate=80)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+    def _run_worker(self):
+        call_command('run_export_worker', processes=0, once=True, stdout=StringIO())
+
+    def test_submit_poll_and_download(self):
+        """A submitted job should run in the worker and download as the gzipped streaming CSV"""
+        response = self.client.post('/api/analytics/exports/', {'dataset': 'visits', 'filters': {'patient_pk': self.patient.id}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_url = response['Location']
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertIsNone(response.data['download_url'])
+        self.assertEqual(self.client.get(f'{job_url}download/').status_code, status.HTTP_409_CONFLICT)
+
+        self._run_worker()
+
+        job = self.client.get(job_url).data
+        self.assertEqual((job['status'], job['row_count']), ('done', 2))
+        download = self.client.get(job['download_url'])
+        self.assertEqual(download.status_code, status.HTTP_200_OK)
+        self.assertEqual(download['Content-Type'], 'application/gzip')
+        csv_text = gzip.decompress(b''.join(download.streaming_content))
+        streamed = self.client.get(f'/api/patients/{self.patient.id}/analytics/visits/export/')
+        self.assertEqual(csv_text, b''.join(streamed.streaming_content))
+
+    def test_large_exports_become_jobs(self):
+        """Exports above EXPORT_JOB_THRESHOLD should be queued, and the job keeps the patient's own scope"""
+        self.client.force_authenticate(user=self.patient_user)
+        with self.settings(EXPORT_JOB_THRESHOLD=2):
+            self.assertEqual(self.client.get('/api/analytics/visits/export/').status_code, status.HTTP_200_OK)
+        with self.settings(EXPORT_JOB_THRESHOLD=1):
+            response = self.client.get('/api/analytics/visits/export/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['dataset'], 'visits')
+
+        self._run_worker()
+        self.assertEqual(self.client.get(response['Location']).data['row_count'], 2)
+
+    def test_jobs_of_a_dead_worker_fail(self):
+        """Jobs left running past EXPORT_JOB_TIMEOUT should be failed when a worker next claims jobs"""
+        stale = ExportJob.objects.create(user=self.doctor_user, dataset='visits', status='running', started_at=timezone.now() - timedelta(hours=2))
+        recent = ExportJob.objects.create(user=self.doctor_user, dataset='visits', status='running', started_at=timezone.now())
+
+        self._run_worker()
+
+        stale.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertEqual(stale.status, 'failed')
+        self.assertIn('worker stopped', stale.error)
+        self.assertIsNotNone(stale.finished_at)
+        self.assertEqual(recent.status, 'running')
+        self.assertEqual(self.client.get(f'/api/analytics/exports/{stale.pk}/').data['status'], 'failed')
+
+    def test_jobs_are_private_and_validated(self):
+        """Users should only see their own jobs, and unknown datasets or filters are rejected"""
+        response = self.client.post('/api/analytics/exports/', {'dataset': 'deliveries'}, format='json')
+        job_url = response['Location']
+
+        self.client.force_authenticate(user=self.patient_user)
+        self.assertEqual(self.client.get(job_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/analytics/exports/').data['count'], 0)
+
+        for payload in ({'dataset': 'rollups'}, {'dataset': 'pregnancies', 'filters': {'delivery_pk': 1}}):
+            response = self.client.post('/api/analytics/exports/', payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@skipUnless(columnar_available(), 'pyarrow is not installed')
+class ColumnarExportTests(TestCase):
+    """Test Parquet and Arrow exports with native column types"""
+
+    def setUp(self):
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        patient = Patient.objects.get(user=User.objects.create_user(username='patient1', password='testpass123', role='patient'))
+        pregnancy = Pregnancy.objects.create(patient=patient, gestational_age_weeks=20, last_menstrual_period=date(2024, 1, 20))
+        for hemoglobin in (Decimal('11.5'), None, Decimal('9.8')):
+            Visit.objects.create(
+                patient=patient, pregnancy=pregnancy, provider=self.doctor_user, visit_type='Antenatal',
+                heart_rate=80, hemoglobin_level=hemoglobin, weight_kg=Decimal('61.25'),
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+    def test_parquet_export_keeps_native_types(self):
+        """Parquet exports should carry decimals, timestamps and nulls as typed columns in pk order"""
+        response = self.client.get('/api/analytics/visits/export/?format=parquet')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="visits_export.parquet"')
+
+        table = pq.read_table(BytesIO(b''.join(response.streaming_content)))
+        visits = list(Visit.objects.order_by('pk'))
+        self.assertEqual(table.column('id').to_pylist(), [visit.pk for visit in visits])
+        self.assertEqual(table.column('hemoglobin_level').to_pylist(), [Decimal('11.5'), None, Decimal('9.8')])
+        self.assertEqual(str(table.schema.field('weight_kg').type), 'decimal128(5, 2)')
+        self.assertEqual(table.column('visit_date').to_pylist()[0], visits[0].visit_date)
+        self.assertEqual(table.num_columns, len(Visit._meta.concrete_fields))
+
+    async def test_arrow_stream_under_asgi(self):
+        """Under ASGI the Arrow IPC stream should be sent asynchronously"""
+        token = await sync_to_async(Token.objects.create)(user=self.doctor_user)
+        response = await self.async_client.get(
+            '/api/analytics/pregnancies/export/?format=arrow', headers={'Authorization': f'Token {token.key}'},
+        )
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        table = pa.ipc.open_stream(body).read_all()
+        self.assertEqual(table.column('last_menstrual_period').to_pylist(), [date(2024, 1, 20)])
+
+    def test_unknown_format_and_background_jobs(self):
+        """Unknown formats are rejected, and large columnar exports become jobs in the same format"""
+        response = self.client.get('/api/analytics/visits/export/?format=xlsx')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with self.settings(EXPORT_JOB_THRESHOLD=1, MEDIA_ROOT=tempfile.mkdtemp()):
+            self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT, ignore_errors=True)
+            response = self.client.get('/api/analytics/visits/export/?format=parquet')
+            self.assertEqual((response.status_code, response.json()['format']), (status.HTTP_202_ACCEPTED, 'parquet'))
+            call_command('run_export_worker', processes=0, once=True, stdout=StringIO())
+
+            download = self.client.get(self.client.get(response['Location']).data['download_url'])
+            self.assertEqual(download['Content-Type'], 'application/vnd.apache.parquet')
+            self.assertEqual(pq.read_table(BytesIO(b''.join(download.streaming_content))).num_rows, 3)
+
+
+class ReplicaRoutingTests(TestCase):
+    """Test read-replica routing: lag tolerance, read-your-writes and the sync command"""
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        routing = self.settings(REPLICA_DATABASE='replica')
+        routing.enable()
+        self.addCleanup(routing.disable)
+        replica._heartbeats.clear()
+        cache.clear()
+        summary_cache().clear()
+
+        # The replica test database starts empty, so reads served from it find no visits
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.patient = Patient.objects.get(user=User.objects.create_user(username='patient1', password='testpass123', role='patient'))
+        self.pregnancy = Pregnancy.objects.create(patient=self.patient, gestational_age_weeks=20)
+        self.visit = Visit.objects.create(patient=self.patient, pregnancy=self.pregnancy, provider=self.doctor_user, visit_type='Antenatal', heart_rate=80)
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.doctor_user).key}'}
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=self.headers['Authorization'])
+
+    def _beat(self, age):
+        ReplicaHeartbeat.objects.using('replica').update_or_create(pk=1, defaults={'beat_at': timezone.now() - age})
+        replica._heartbeats.clear()
+
+    def _listed_visits(self, client=None):
+        return (client or self.client).get('/api/visits/').data['count']
+
+    def test_reads_go_to_a_fresh_replica(self):
+        """Lists, summaries and export jobs should read the replica; other routes and logins read default"""
+        self._beat(timedelta(seconds=5))
+
+        self.assertEqual(self._listed_visits(), 0)
+        self.assertEqual(self.client.get('/api/analytics/visits/summary/').json()['total_visits'], 0)
+        self.assertEqual(self.client.get(f'/api/visits/{self.visit.id}/').status_code, status.HTTP_200_OK)
+
+        job = ExportJob.objects.create(user=self.doctor_user, dataset='visits')
+        call_command('run_export_worker', processes=0, once=True, stdout=StringIO())
+        job.refresh_from_db()
+        self.addCleanup(lambda: job.file.delete(save=False))
+        self.assertEqual((job.status, job.row_count), ('done', 0))
+
+    async def test_async_views_read_the_replica_under_asgi(self):
+        """Under ASGI the middleware should run without adaptation and route the async view's reads"""
+        await sync_to_async(self._beat)(timedelta(seconds=5))
+
+        async def view(request):
+            return HttpResponse()
+
+        # Run as a coroutine, so Django does not adapt it by moving the rest of the chain to a thread
+        self.assertTrue(iscoroutinefunction(replica.ReplicaRoutingMiddleware(view)))
+        response = await self.async_client.get('/api/analytics/visits/summary/', headers=self.headers)
+        self.assertEqual(response.json()['total_visits'], 0)
+        self.assertIsNone(replica._read_alias.get())
+
+        with self.settings(REPLICA_DATABASE=None):
+            summary_cache().clear()
+            response = await self.async_client.get('/api/analytics/visits/summary/', headers=self.headers)
+        self.assertEqual(response.json()['total_visits'], 1)
+
+    def test_lagging_or_unsynced_replica_is_skipped(self):
+        """A heartbeat older than REPLICA_MAX_LAG, or none at all, should send reads to default"""
+        self.assertEqual(self._listed_visits(), 1)
+
+        self._beat(timedelta(minutes=5))
+        self.assertEqual(self._listed_visits(), 1)
+        with self.settings(REPLICA_MAX_LAG=600):
+            replica._heartbeats.clear()
+            self.assertEqual(self._listed_visits(), 0)
+
+        with self.settings(REPLICA_DATABASE=None):
+            self.assertEqual(self._listed_visits(), 1)
+
+    def test_clients_read_their_own_writes(self):
+        """After a write, the same client should read from default until the pin expires"""
+        self._beat(timedelta(seconds=5))
+        other = APIClient()
+        other.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=User.objects.create_user(username="doctor2", password="testpass123", role="doctor")).key}')
+
+        row = {'patient': self.patient.id, 'pregnancy': self.pregnancy.id, 'blood_pressure': '120/80', 'heart_rate': 80}
+        self.assertEqual(self.client.post('/api/visits/batch/', [row], format='json').status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(self._listed_visits(), 2)
+        self.assertEqual(self._listed_visits(other), 0)
+        cache.clear()  # the pin expires
+        self.assertEqual(self._listed_visits(), 0)
+
+
+
+class ReplicaSyncTests(TransactionTestCase):
+    """Test the sync_replica command (committed data, as SQLite's backup cannot copy an open transaction)"""
+
+    def test_sync_replica(self):
+        """sync_replica should stamp the heartbeat, and the SQLite copy should hold default's data"""
+        User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        call_command('sync_replica', heartbeat_only=True, stdout=StringIO())
+        self.assertLess(timezone.now() - ReplicaHeartbeat.objects.get(pk=1).beat_at, timedelta(seconds=5))
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        target = os.path.join(directory, 'replica.sqlite3')
+        replica.copy_sqlite_database(target)
+        copy = sqlite3.connect(target)
+        self.addCleanup(copy.close)
+        self.assertEqual(copy.execute('SELECT COUNT(*) FROM patients_patient').fetchone(), (1,))
+        self.assertEqual(copy.execute('SELECT COUNT(*) FROM analytics_replicaheartbeat').fetchone(), (1,))
+
+        with self.assertRaises(CommandError):
+            call_command('sync_replica', database='default', stdout=StringIO())
@@ -0,0 +1,15 @@
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
+
+from .views import ExportJobViewSet, batch_summaries
+
+router = DefaultRouter()
+router.register(r'analytics/exports', ExportJobViewSet, basename='export-job')
+
+urlpatterns = [
+	# Summaries of many patients, pregnancies or deliveries in one request
+	path('analytics/summary/batch/', batch_summaries, name='batch-summaries'),
+
+	# Background export jobs: submit, poll and download
+	path('', include(router.urls)),
+]
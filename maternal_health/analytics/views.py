@@ -0,0 +1,120 @@
+from django.http import FileResponse
+from django.urls import reverse
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from deliveries.views import delivery_summary_data
+from patients.permissions import IsClinicianOrAdmin
+from pregnancies.views import pregnancy_summary_data
+from visits.views import visit_summary_data
+from .cache import SUMMARY_CACHE_HEADER, summary_batch
+from .columnar import COLUMNAR_FORMATS
+from .jobs import job_download_name
+from .models import ExportJob
+from .rollups import DELIVERY_ROLLUP, PREGNANCY_ROLLUP, VISIT_ROLLUP, read_rollups
+from .serializers import ExportJobSerializer
+
+
+# Upper bound on ids accepted by one batch summary request
+BATCH_SUMMARY_MAX_IDS = 200
+
+# Summaries returned per scope kind: (response key, rollup spec, payload builder)
+BATCH_SUMMARIES = {
+    'patient': [
+        ('visits', VISIT_ROLLUP, visit_summary_data),
+        ('pregnancies', PREGNANCY_ROLLUP, pregnancy_summary_data),
+        ('deliveries', DELIVERY_ROLLUP, delivery_summary_data),
+    ],
+    'pregnancy': [('visits', VISIT_ROLLUP, visit_summary_data)],
+    'delivery': [('visits', VISIT_ROLLUP, visit_summary_data)],
+}
+
+
+def _parse_ids(raw):
+    ids = []
+    for value in (raw or '').split(','):
+        value = value.strip()
+        if not value:
+            continue
+        if not value.isdigit():
+            return None
+        if int(value) not in ids:
+            ids.append(int(value))
+    return ids
+
+
+# Batch summary endpoint for dashboards: the summaries of many patients (or pregnancies/deliveries) in one request.
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsClinicianOrAdmin])
+def batch_summaries(request):
+    """
+    Return the visit, pregnancy and delivery summaries of every id in `ids` as JSON.
+
+    `scope` is `patient` (default), `pregnancy` or `delivery`; pregnancy and delivery scopes
+    return visit summaries only. Each summary has the same shape as the single-scope summary
+    endpoints. Cached summaries are reused, and the rest are read from the rollups in one query.
+    """
+    scope = request.query_params.get('scope', 'patient')
+    if scope not in BATCH_SUMMARIES:
+        return Response({'detail': f'scope must be one of: {", ".join(BATCH_SUMMARIES)}.'}, status=status.HTTP_400_BAD_REQUEST)
+    ids = _parse_ids(request.query_params.get('ids'))
+    if not ids:
+        return Response({'detail': 'ids must be a comma-separated list of integers.'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(ids) > BATCH_SUMMARY_MAX_IDS:
+        return Response({'detail': f'At most {BATCH_SUMMARY_MAX_IDS} ids per request.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    summaries = BATCH_SUMMARIES[scope]
+    builders = {spec.metric: (spec, to_data) for _, spec, to_data in summaries}
+
+    def build(missing):
+        specs = [builders[metric][0] for metric in {metric for metric, _, _ in missing}]
+        snapshots = read_rollups(specs, scope, {scope_id for _, _, scope_id in missing})
+        return {
+            (metric, scope, scope_id): builders[metric][1](snapshots[(metric, scope_id)])
+            for metric, _, scope_id in missing
+        }
+
+    entries = [(spec.metric, scope, scope_id) for scope_id in ids for _, spec, _ in summaries]
+    data, built = summary_batch(entries, request.user.role, build)
+    results = [
+        {'id': scope_id, **{name: data[(spec.metric, scope, scope_id)] for name, spec, _ in summaries}}
+        for scope_id in ids
+    ]
+    response = Response({'scope': scope, 'results': results})
+    response[SUMMARY_CACHE_HEADER] = 'MISS' if built else 'HIT'
+    return response
+
+
+# Background exports: submit a job, poll it, then download the file once it is done.
+# Users see their own jobs; admins see everyone's.
+class ExportJobViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    serializer_class = ExportJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = ExportJob.objects.order_by('-created_at', '-pk')
+        if self.request.user.role != 'admin':
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        # 202: the job is queued for run_export_worker; poll the Location until it is done
+        location = request.build_absolute_uri(reverse('export-job-detail', kwargs={'pk': serializer.instance.pk}))
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != 'done':
+            return Response({'detail': 'Export is not ready.', 'status': job.status}, status=status.HTTP_409_CONFLICT)
+        try:
+            handle = job.file.open('rb')
+        except FileNotFoundError:
+            return Response({'detail': 'Export file no longer exists.'}, status=status.HTTP_410_GONE)
+        content_type = COLUMNAR_FORMATS[job.export_format][0] if job.export_format in COLUMNAR_FORMATS else 'application/gzip'
+        return FileResponse(handle, as_attachment=True, filename=job_download_name(job), content_type=content_type)
@@ -0,0 +1,6 @@
+from django.apps import AppConfig
+
+
+# BenchmarksConfig for the synthetic-data generator and the API benchmark runner (management commands only, no models).
+class BenchmarksConfig(AppConfig):
+    name = 'benchmarks'
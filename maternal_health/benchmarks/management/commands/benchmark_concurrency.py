@@ -0,0 +1,43 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from benchmarks.runner import run_concurrency_benchmark
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream several CSV exports through the ASGI handler while timing short CRUD requests, '
+        'and report CRUD latency percentiles on an idle server and under export load.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Also write the report to this JSON file.')
+        parser.add_argument('--exports', type=int, default=4, help='Concurrent exports to run.')
+        parser.add_argument('--requests', type=int, default=50, help='CRUD requests timed per phase.')
+        parser.add_argument('--export-url', help='Export to stream (default: the global visits export).')
+        parser.add_argument('--crud-url', help='CRUD route to time (default: a patient detail).')
+        parser.add_argument('--role', default='doctor', choices=['doctor', 'nurse', 'admin'], help='Role of the benchmark user.')
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username=f'benchmark-{options["role"]}', defaults={'role': options['role']})
+        report = run_concurrency_benchmark(
+            user, exports=options['exports'], requests=options['requests'],
+            export_url=options['export_url'], crud_url=options['crud_url'],
+        )
+
+        crud = report['crud']
+        for phase in ('idle_ms', 'under_load_ms'):
+            latency = crud[phase]
+            self.stdout.write(f'{crud["path"]} {phase[:-3]:10} p50 {latency["p50"]:8.2f} ms  p95 {latency["p95"]:8.2f} ms')
+        durations = report['export']['duration_ms']
+        if durations:
+            self.stdout.write(f'{len(durations)} x {report["export"]["path"]}: slowest {max(durations):.0f} ms, {report["export"]["response_bytes"]} bytes each')
+
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Report written to {options["output"]}'))
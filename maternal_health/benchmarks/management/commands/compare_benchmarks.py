@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.runner import compare_reports
+
+
+class Command(BaseCommand):
+    help = 'Compare two run_benchmarks reports route by route and flag p95 or query-count regressions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('baseline')
+        parser.add_argument('candidate')
+        parser.add_argument('--threshold', type=float, default=1.25, help='p95 ratio above which a route counts as slower.')
+        parser.add_argument('--min-delta-ms', type=float, default=1.0, help='Ignore p95 changes smaller than this.')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error if any route regressed.')
+
+    def handle(self, *args, **options):
+        reports = []
+        for path in (options['baseline'], options['candidate']):
+            with open(path) as handle:
+                reports.append(json.load(handle))
+
+        rows = compare_reports(*reports, threshold=options['threshold'], min_delta_ms=options['min_delta_ms'])
+        for row in rows:
+            line = (
+                f'{row["name"]:45} p95 {row["p95_before"]:8.2f} -> {row["p95_after"]:8.2f} ms  '
+                f'queries {row["queries_before"]:3} -> {row["queries_after"]:3}'
+            )
+            self.stdout.write(self.style.ERROR(line + '  REGRESSED') if row['regressed'] else line)
+
+        regressed = [row['name'] for row in rows if row['regressed']]
+        if regressed and options['fail_on_regression']:
+            raise CommandError(f'{len(regressed)} routes regressed: {", ".join(regressed)}')
+        self.stdout.write(self.style.SUCCESS(f'Compared {len(rows)} routes, {len(regressed)} regressed'))
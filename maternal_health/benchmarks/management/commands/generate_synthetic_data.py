@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from analytics.rollups import ROLLUP_SPECS, rebuild_rollups
+from benchmarks.synthetic import SyntheticDataGenerator
+from patients.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-generate synthetic patients with pregnancies, deliveries and visits for benchmarking. '
+        'Each patient yields about 13 rows with the default rates, so --patients 750000 gives roughly 10M rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=10000)
+        parser.add_argument('--pregnancies', type=float, default=1.3, help='Average pregnancies per patient.')
+        parser.add_argument('--delivery-rate', type=float, default=0.7, help='Share of past-due pregnancies that are delivered.')
+        parser.add_argument('--antenatal-visits', type=int, default=6, help='Visits per pregnancy.')
+        parser.add_argument('--postnatal-visits', type=int, default=2, choices=[0, 1, 2, 3], help='Visits per delivery.')
+        parser.add_argument('--general-visits', type=int, default=1, help='General visits per patient.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Patients written per transaction.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='synthetic', help='Prefix for generated usernames and identifiers.')
+        parser.add_argument('--skip-derived', action='store_true', help='Do not rebuild the summary rollups and patient search index.')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        generator = SyntheticDataGenerator(
+            prefix=options['prefix'], seed=options['seed'], batch_size=options['batch_size'],
+            pregnancies=options['pregnancies'], delivery_rate=options['delivery_rate'],
+            antenatal_visits=options['antenatal_visits'], postnatal_visits=options['postnatal_visits'],
+            general_visits=options['general_visits'], using=options['database'],
+        )
+        started = time.perf_counter()
+
+        def progress(done, counts):
+            rows = sum(counts.values())
+            self.stdout.write(f'{done}/{options["patients"]} patients, {rows} rows, {rows / (time.perf_counter() - started):.0f} rows/s')
+
+        counts = generator.generate(options['patients'], progress=progress)
+        summary = ', '.join(f'{written} {name}' for name, written in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Generated {summary} in {time.perf_counter() - started:.1f}s'))
+
+        # bulk_create skips the signals that maintain rollups and the search index
+        if not options['skip_derived']:
+            for spec in ROLLUP_SPECS.values():
+                buckets = rebuild_rollups(spec, using=options['database'])
+                self.stdout.write(self.style.SUCCESS(f'Rebuilt {spec.metric} rollups: {buckets} buckets'))
+            backend = get_search_backend(options['database'])
+            if backend is not None:
+                self.stdout.write(self.style.SUCCESS(f'Indexed {backend.rebuild()} patients for search'))
@@ -0,0 +1,41 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from benchmarks.runner import run_benchmarks
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Request every named API route through the Django test client and write latency percentiles, '
+        'query counts and peak memory to a JSON report. Run against generate_synthetic_data output.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='benchmark-report.json')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--role', default='doctor', choices=['doctor', 'nurse', 'admin'], help='Role of the benchmark user.')
+        parser.add_argument('--include', help='Only routes whose URL name matches this regular expression.')
+        parser.add_argument('--prefix', default='api/', help='Only routes under this path prefix.')
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username=f'benchmark-{options["role"]}', defaults={'role': options['role']})
+
+        def progress(name, result):
+            latency = result['latency_ms']
+            self.stdout.write(
+                f'{name:45} {result["status"]}  p50 {latency["p50"]:8.2f} ms  p95 {latency["p95"]:8.2f} ms  '
+                f'{result["queries"]["max"]:3} queries  {result["peak_memory_kb"]:9.1f} KB'
+            )
+
+        report = run_benchmarks(
+            user, iterations=options['iterations'], warmup=options['warmup'],
+            prefix=options['prefix'], include=options['include'], progress=progress,
+        )
+        with open(options['output'], 'w') as handle:
+            json.dump(report, handle, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Benchmarked {len(report["routes"])} routes, report written to {options["output"]}'))
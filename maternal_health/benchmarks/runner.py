@@ -0,0 +1,309 @@
+import asyncio
+import gc
+import math
+import re
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connections
+from django.db.models import Exists, OuterRef
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from rest_framework.authtoken.models import Token
+
+from deliveries.models import Delivery
+from patients.models import Patient
+from pregnancies.models import Pregnancy
+from visits.models import Visit
+
+
+# URL kwargs the runner knows how to fill; routes needing anything else (e.g. format suffixes) are skipped
+SAMPLE_KWARGS = {'patient_pk', 'pregnancy_pk', 'delivery_pk', 'pk'}
+
+# Resource segment in front of <pk> -> key of the sample record used for it
+DETAIL_SEGMENTS = {'patients': 'patient', 'pregnancies': 'pregnancy', 'deliveries': 'delivery', 'visits': 'visit'}
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Route:
+    def __init__(self, name, template, kwargs, detail_segment):
+        self.name = name
+        self.template = template
+        self.kwargs = kwargs
+        self.detail_segment = detail_segment
+
+
+def _walk(patterns, prefix='', namespace='', kwargs=frozenset()):
+    for entry in patterns:
+        regex = entry.pattern.regex
+        pattern = prefix + str(entry.pattern)
+        names = kwargs | set(regex.groupindex)
+        if isinstance(entry, URLResolver):
+            inner = f'{namespace}{entry.namespace}:' if entry.namespace else namespace
+            yield from _walk(entry.url_patterns, pattern, inner, names)
+        elif isinstance(entry, URLPattern) and entry.name:
+            yield namespace + entry.name, pattern, names, entry.callback
+
+
+def _serves_get(callback):
+    # Viewset routes list their HTTP methods in `actions`; write-only actions such as batch uploads are skipped
+    actions = getattr(callback, 'actions', None)
+    if actions is not None:
+        return 'get' in actions
+    view_class = getattr(callback, 'cls', None) or getattr(callback, 'view_class', None)
+    return view_class is None or 'get' in view_class.http_method_names and hasattr(view_class, 'get')
+
+
+def discover_routes(prefix='api/', include=None):
+    """Named GET routes under `prefix` whose URL kwargs can be filled from sample records."""
+    routes = {}
+    for name, pattern, kwargs, callback in _walk(get_resolver().url_patterns):
+        plain = pattern.lstrip('^')
+        if not plain.startswith(prefix) or not kwargs <= SAMPLE_KWARGS or not _serves_get(callback):
+            continue
+        if include and not re.search(include, name):
+            continue
+        detail = None
+        if 'pk' in kwargs:
+            match = re.search(r'(\w+)/\(\?P<pk>', pattern) or re.search(r'(\w+)/<(?:int:)?pk>', pattern)
+            detail = DETAIL_SEGMENTS.get(match.group(1)) if match else None
+            if detail is None:
+                continue
+        # The same viewsets are mounted by several url modules; keep the first registration of each name
+        routes.setdefault(name, Route(name, pattern, kwargs, detail))
+    return list(routes.values())
+
+
+def sample_records():
+    """
+    One consistent chain of records to fill URLs with: a delivered pregnancy with antenatal and
+    postnatal visits. Falls back to whatever exists, in which case some routes may return 404.
+    """
+    # Through Visit subqueries rather than reverse joins, which miss visits in partition tables on SQLite
+    postnatal_visits = Visit.objects.filter(delivery=OuterRef('pk'), patient=OuterRef('patient'))
+    antenatal_visits = Visit.objects.filter(pregnancy=OuterRef('pregnancy'), patient=OuterRef('patient'))
+    delivery = (
+        Delivery.objects.filter(Exists(postnatal_visits), Exists(antenatal_visits)).order_by('pk').first()
+        or Delivery.objects.order_by('pk').first()
+    )
+    pregnancy = delivery.pregnancy if delivery else Pregnancy.objects.order_by('pk').first()
+    patient = pregnancy.patient if pregnancy else Patient.objects.order_by('pk').first()
+    antenatal = Visit.objects.filter(pregnancy=pregnancy, patient=patient).order_by('pk').first() if pregnancy else None
+    postnatal = Visit.objects.filter(delivery=delivery, patient=patient).order_by('pk').first() if delivery else None
+    any_visit = Visit.objects.order_by('pk').first()
+    return {
+        'patient': patient, 'pregnancy': pregnancy, 'delivery': delivery,
+        'antenatal_visit': antenatal or any_visit, 'postnatal_visit': postnatal or antenatal or any_visit,
+    }
+
+
+def route_url(route, samples):
+    kwargs = {}
+    for name in route.kwargs:
+        if name == 'pk':
+            if route.detail_segment == 'visit':
+                record = samples['postnatal_visit' if 'delivery_pk' in route.kwargs else 'antenatal_visit']
+            else:
+                record = samples[route.detail_segment]
+        else:
+            record = samples[name[:-len('_pk')]]
+        if record is None:
+            return None
+        kwargs[name] = record.pk
+    return reverse(route.name, kwargs=kwargs)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def _request(client, url, headers):
+    response = client.get(url, **headers)
+    # Streaming responses (CSV exports) only do their work while being consumed
+    size = sum(len(chunk) for chunk in response.streaming_content) if response.streaming else len(response.content)
+    return response.status_code, size
+
+
+def benchmark_route(client, url, headers, iterations, warmup):
+    for _ in range(warmup):
+        _request(client, url, headers)
+
+    latencies, queries = [], []
+    status = size = None
+    connection = connections['default']
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            status, size = _request(client, url, headers)
+            latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured))
+
+    # Memory is traced in a separate run so tracemalloc overhead does not skew the timings
+    gc.collect()
+    tracemalloc.start()
+    _request(client, url, headers)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'status': status,
+        'response_bytes': size,
+        'latency_ms': {
+            **{f'p{pct}': round(percentile(latencies, pct), 3) for pct in PERCENTILES},
+            'mean': round(statistics.fmean(latencies), 3),
+            'max': round(max(latencies), 3),
+        },
+        'queries': {'min': min(queries), 'max': max(queries)},
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=settings.BASE_DIR, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def run_benchmarks(user, iterations=20, warmup=2, prefix='api/', include=None, progress=None):
+    """Drive every discovered route as `user` through the test client and return the report dict."""
+    token, _ = Token.objects.get_or_create(user=user)
+    headers = {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+    samples = sample_records()
+    results = {}
+
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        client = Client()
+        for route in discover_routes(prefix, include):
+            url = route_url(route, samples)
+            if url is None:
+                continue
+            results[route.name] = {'path': url, **benchmark_route(client, url, headers, iterations, warmup)}
+            if progress:
+                progress(route.name, results[route.name])
+
+    return {
+        'meta': {
+            'created_at': datetime.now(dt_timezone.utc).isoformat(),
+            'git_commit': git_commit(),
+            'database': connections['default'].vendor,
+            'role': user.role,
+            'iterations': iterations,
+            'warmup': warmup,
+            'row_counts': {
+                'patients': Patient.objects.count(), 'pregnancies': Pregnancy.objects.count(),
+                'deliveries': Delivery.objects.count(), 'visits': Visit.objects.count(),
+            },
+        },
+        'routes': results,
+    }
+
+
+async def _timed_gets(client, url, headers, count):
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        response = await client.get(url, headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies, response.status_code
+
+
+async def _consume(client, url, headers):
+    started = time.perf_counter()
+    response = await client.get(url, headers=headers)
+    size = 0
+    if response.is_async:
+        async for chunk in response.streaming_content:
+            size += len(chunk)
+    else:
+        size = len(response.getvalue())
+    return (time.perf_counter() - started) * 1000, size
+
+
+def _latency_summary(latencies):
+    return {
+        **{f'p{pct}': round(percentile(latencies, pct), 3) for pct in PERCENTILES},
+        'mean': round(statistics.fmean(latencies), 3),
+    }
+
+
+def run_concurrency_benchmark(user, exports=4, requests=50, export_url=None, crud_url=None):
+    """
+    Measure how short CRUD requests fare while long CSV exports stream, through the ASGI handler.
+
+    CRUD latencies are taken once on an idle server and once alongside `exports`
+    concurrent exports; under ASGI the two should stay close.
+    """
+    token, _ = Token.objects.get_or_create(user=user)
+    headers = {'Authorization': f'Token {token.key}'}
+    export_url = export_url or reverse('visits-export')
+    if crud_url is None:
+        patient = sample_records()['patient']
+        crud_url = reverse('patient-detail', kwargs={'pk': patient.pk}) if patient else reverse('patient-list')
+
+    async def measure():
+        client = AsyncClient()
+        await _timed_gets(client, crud_url, headers, 2)  # warm up
+        idle, crud_status = await _timed_gets(client, crud_url, headers, requests)
+        loaded, *export_runs = await asyncio.gather(
+            _timed_gets(client, crud_url, headers, requests),
+            *[_consume(client, export_url, headers) for _ in range(exports)],
+        )
+        return idle, loaded[0], crud_status, export_runs
+
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        idle, loaded, crud_status, export_runs = async_to_sync(measure)()
+
+    return {
+        'meta': {
+            'created_at': datetime.now(dt_timezone.utc).isoformat(),
+            'git_commit': git_commit(),
+            'database': connections['default'].vendor,
+            'role': user.role,
+            'exports': exports,
+            'requests': requests,
+        },
+        'crud': {
+            'path': crud_url,
+            'status': crud_status,
+            'idle_ms': _latency_summary(idle),
+            'under_load_ms': _latency_summary(loaded),
+        },
+        'export': {
+            'path': export_url,
+            'duration_ms': [round(duration, 3) for duration, _ in export_runs],
+            'response_bytes': export_runs[0][1] if export_runs else 0,
+        },
+    }
+
+
+def compare_reports(old, new, threshold=1.25, min_delta_ms=1.0):
+    """
+    Per-route p95 and query changes between two reports.
+
+    A route regresses when its p95 grows by more than `threshold` times and by at least
+    `min_delta_ms`, or when it issues more queries than before.
+    """
+    rows = []
+    for name in sorted(set(old['routes']) & set(new['routes'])):
+        before, after = old['routes'][name], new['routes'][name]
+        p95_before, p95_after = before['latency_ms']['p95'], after['latency_ms']['p95']
+        slower = p95_after > p95_before * threshold and p95_after - p95_before >= min_delta_ms
+        more_queries = after['queries']['max'] > before['queries']['max']
+        rows.append({
+            'name': name,
+            'p95_before': p95_before, 'p95_after': p95_after,
+            'queries_before': before['queries']['max'], 'queries_after': after['queries']['max'],
+            'regressed': slower or more_queries,
+        })
+    return rows
@@ -0,0 +1,219 @@
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from deliveries.models import Delivery
+from patients.models import Patient
+from pregnancies.models import Pregnancy, week_start
+from visits.models import Visit
+
+User = get_user_model()
+
+
+FIRST_NAMES = [
+    'Alice', 'Aline', 'Amina', 'Beatrice', 'Chantal', 'Claudine', 'Diane', 'Esperance', 'Esther', 'Fatuma',
+    'Francine', 'Grace', 'Immaculee', 'Jeanne', 'Josiane', 'Liliane', 'Marie', 'Nadine', 'Odette', 'Solange',
+]
+LAST_NAMES = [
+    'Uwase', 'Uwamahoro', 'Mukamana', 'Ingabire', 'Umutoni', 'Nyiraneza', 'Mukandayisenga', 'Uwimana',
+    'Niyonsaba', 'Mutesi', 'Akimana', 'Iradukunda', 'Nishimwe', 'Uwera', 'Kayitesi', 'Musabyimana',
+]
+FACILITIES = ['Kigali District Hospital', 'Muhima Health Centre', 'Kacyiru Health Centre', 'Remera Health Centre', 'Home']
+LANGUAGES = ['Kinyarwanda', 'English', 'French', 'Swahili']
+EDUCATION_LEVELS = ['None', 'Primary', 'Secondary', 'University']
+OCCUPATIONS = ['Farmer', 'Teacher', 'Trader', 'Nurse', 'Student', 'Homemaker']
+MARITAL_STATUSES = ['Married', 'Single', 'Widowed', 'Divorced']
+
+# Rough population weights so histograms look like real registers
+BLOOD_TYPES = (['O+', 'A+', 'B+', 'AB+', 'O-', 'A-', 'B-', 'AB-'], [38, 30, 17, 5, 4, 3, 2, 1])
+DELIVERY_MODES = (['vaginal', 'cesarean', 'assisted'], [78, 18, 4])
+
+# Bulk inserts call pre_save(add=True), which would stamp every auto_now_add field with "now"
+DATED_FIELDS = {Visit: ['visit_date', 'created_at'], Delivery: ['delivery_date', 'created_at']}
+
+
+@contextmanager
+def explicit_dates():
+    """Let bulk_create keep the historical dates set on synthetic records."""
+    fields = [model._meta.get_field(name) for model, names in DATED_FIELDS.items() for name in names]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class SyntheticDataGenerator:
+    """
+    Bulk-generates patients with pregnancies, deliveries and visits whose relationships are consistent.
+
+    Each patient gets `pregnancies` pregnancies on average. Pregnancies that are past their due date
+    are delivered with probability `delivery_rate`. Every pregnancy gets `antenatal_visits`
+    visits, every delivery gets `postnatal_visits` visits and every patient gets `general_visits`
+    visits. Records are written `batch_size` patients at a time, so memory stays flat at any scale.
+    """
+
+    def __init__(self, prefix='synthetic', seed=0, batch_size=1000, pregnancies=1.3, delivery_rate=0.7,
+                 antenatal_visits=6, postnatal_visits=2, general_visits=1, using='default'):
+        self.prefix = prefix
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.pregnancies = pregnancies
+        self.delivery_rate = delivery_rate
+        self.antenatal_visits = antenatal_visits
+        self.postnatal_visits = postnatal_visits
+        self.general_visits = general_visits
+        self.using = using
+        self.today = timezone.localdate()
+        self.password = make_password(f'{prefix}-password')
+
+    def _choice(self, weighted):
+        values, weights = weighted
+        return self.rng.choices(values, weights)[0]
+
+    def _moment(self, day):
+        return timezone.make_aware(datetime.combine(day, time(self.rng.randint(7, 16), self.rng.randint(0, 59))))
+
+    def _blood_pressure(self):
+        # About one visit in ten is hypertensive
+        systolic = int(self.rng.gauss(118, 14))
+        diastolic = int(systolic * 0.65 + self.rng.gauss(0, 6))
+        return f'{systolic}/{diastolic}'
+
+    def clinicians(self, count=20):
+        """Doctors and nurses who act as providers of the synthetic visits."""
+        names = [f'{self.prefix}-clinician-{index}' for index in range(count)]
+        existing = {user.username: user for user in User.objects.using(self.using).filter(username__in=names)}
+        missing = [
+            User(username=name, role='doctor' if index % 3 == 0 else 'nurse', password=self.password)
+            for index, name in enumerate(names) if name not in existing
+        ]
+        User.objects.using(self.using).bulk_create(missing)
+        return list(User.objects.using(self.using).filter(username__in=names))
+
+    def generate(self, patients, progress=None):
+        """Create `patients` patients and their records. Returns the number of rows written per model."""
+        providers = self.clinicians()
+        start = User.objects.using(self.using).filter(username__startswith=f'{self.prefix}-patient-').count()
+        counts = {'users': 0, 'patients': 0, 'pregnancies': 0, 'deliveries': 0, 'visits': 0}
+
+        with explicit_dates():
+            for offset in range(0, patients, self.batch_size):
+                size = min(self.batch_size, patients - offset)
+                batch = self._write_batch(start + offset, size, providers)
+                for name, written in batch.items():
+                    counts[name] += written
+                if progress:
+                    progress(offset + size, counts)
+        return counts
+
+    def _write_batch(self, first, size, providers):
+        rng = self.rng
+        with transaction.atomic(using=self.using):
+            users = []
+            for number in range(first, first + size):
+                first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                users.append(User(
+                    username=f'{self.prefix}-patient-{number}', password=self.password, role='patient',
+                    first_name=first_name, last_name=last_name,
+                    email=f'{first_name}.{last_name}.{number}@{self.prefix}.example'.lower(),
+                ))
+            User.objects.using(self.using).bulk_create(users)
+
+            patients = []
+            for number, user in zip(range(first, first + size), users):
+                gravidity = rng.randint(1, 6)
+                patients.append(Patient(
+                    user=user, first_name=user.first_name, last_name=user.last_name,
+                    medical_record_number=f'{self.prefix}-MRN-{number:08d}',
+                    national_id=f'{self.prefix}-NID-{number:08d}',
+                    phone_number=f'+2507{rng.randint(20000000, 99999999)}',
+                    date_of_birth=self.today - timedelta(days=rng.randint(16 * 365, 45 * 365)),
+                    address=f'{rng.randint(1, 400)} KG {rng.randint(1, 700)} St', marital_status=rng.choice(MARITAL_STATUSES),
+                    educational_level=rng.choice(EDUCATION_LEVELS), occupation=rng.choice(OCCUPATIONS),
+                    gravidity=gravidity, parity=rng.randint(0, gravidity - 1), communication_language=rng.choice(LANGUAGES),
+                ))
+            Patient.objects.using(self.using).bulk_create(patients)
+
+            pregnancies = []
+            for patient in patients:
+                count = int(self.pregnancies) + (rng.random() < self.pregnancies % 1)
+                for _ in range(count):
+                    lmp = self.today - timedelta(days=rng.randint(30, 3 * 365))
+                    edd = lmp + timedelta(days=280)
+                    # bulk_create skips Pregnancy.save() and the delivery signals, so the calendar fields are set here
+                    pregnancies.append(Pregnancy(
+                        patient=patient, last_menstrual_period=lmp, expected_delivery_date=edd, edd_week=week_start(edd),
+                        is_delivered=edd < self.today and rng.random() < self.delivery_rate,
+                        planned_place_of_delivery=rng.choice(FACILITIES),
+                        gestational_age_weeks=min((self.today - lmp).days // 7, 42),
+                        blood_type=self._choice(BLOOD_TYPES), hiv_status=rng.random() < 0.03,
+                        diabetes_status=rng.random() < 0.05, hypertension_status=rng.random() < 0.08,
+                        multiple_pregnancy=rng.random() < 0.02,
+                    ))
+            Pregnancy.objects.using(self.using).bulk_create(pregnancies)
+
+            deliveries = []
+            for pregnancy in pregnancies:
+                if pregnancy.is_delivered:
+                    day = min(pregnancy.expected_delivery_date + timedelta(days=rng.randint(-21, 10)), self.today)
+                    moment = self._moment(day)
+                    deliveries.append(Delivery(
+                        pregnancy=pregnancy, patient_id=pregnancy.patient_id, delivery_date=moment, created_at=moment,
+                        delivery_mode=self._choice(DELIVERY_MODES), birth_weight_g=max(600, int(rng.gauss(3200, 450))),
+                        place_of_delivery=pregnancy.planned_place_of_delivery if rng.random() < 0.85 else rng.choice(FACILITIES),
+                        skilled_birth_attendant=rng.random() < 0.9,
+                        newborn_gender=rng.choice(['Female', 'Male']), apgar_score_1min=rng.randint(5, 10),
+                        apgar_score_5min=rng.randint(7, 10), alive=rng.random() < 0.98,
+                    ))
+            Delivery.objects.using(self.using).bulk_create(deliveries)
+
+            visits = []
+            for pregnancy in pregnancies:
+                last_day = min(pregnancy.expected_delivery_date, self.today)
+                first_day = pregnancy.last_menstrual_period + timedelta(weeks=8)
+                for index in range(self.antenatal_visits):
+                    if first_day >= last_day:
+                        break
+                    day = first_day + (last_day - first_day) * index // self.antenatal_visits
+                    visits.append(self._visit(pregnancy.patient_id, providers, day, 'Antenatal', pregnancy=pregnancy))
+            for delivery in deliveries:
+                for days in [2, 42, 90][:self.postnatal_visits]:
+                    day = delivery.delivery_date.date() + timedelta(days=days)
+                    if day <= self.today:
+                        visits.append(self._visit(
+                            delivery.patient_id, providers, day, 'Postnatal', delivery=delivery,
+                            breastfeeding_status=rng.random() < 0.9,
+                        ))
+            for patient in patients:
+                for _ in range(self.general_visits):
+                    day = self.today - timedelta(days=rng.randint(0, 3 * 365))
+                    visits.append(self._visit(patient.pk, providers, day, 'General'))
+            Visit.objects.using(self.using).bulk_create(visits, batch_size=self.batch_size)
+
+        return {
+            'users': len(users), 'patients': len(patients), 'pregnancies': len(pregnancies),
+            'deliveries': len(deliveries), 'visits': len(visits),
+        }
+
+    def _visit(self, patient_id, providers, day, visit_type, **fields):
+        rng = self.rng
+        moment = self._moment(day)
+        visit = Visit(
+            patient_id=patient_id, provider=rng.choice(providers), visit_date=moment, created_at=moment,
+            visit_type=visit_type, blood_pressure=self._blood_pressure(), heart_rate=rng.randint(60, 110),
+            hemoglobin_level=Decimal(rng.randint(85, 140)) / 10, weight_kg=Decimal(rng.randint(4500, 9500)) / 100,
+            **fields,
+        )
+        if visit_type == 'Antenatal':
+            visit.fetal_heart_rate = rng.randint(110, 160)
+        visit.sync_blood_pressure()
+        return visit
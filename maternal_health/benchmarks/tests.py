@@ -0,0 +1,206 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from analytics.models import SummaryRollup
+from benchmarks.runner import sample_records
+from config.metrics import RequestMetricsMiddleware, _new_series, registry
+from deliveries.models import Delivery
+from patients.models import Patient
+from pregnancies.models import Pregnancy
+from visits.models import Visit
+from visits.routing import forget_partitions
+
+User = get_user_model()
+
+
+class SyntheticDataTests(TestCase):
+    """Test the synthetic data generator"""
+
+    def test_generated_records_are_consistent(self):
+        """Generated deliveries and visits should belong to the patient of their pregnancy or delivery"""
+        call_command('generate_synthetic_data', patients=30, batch_size=8, seed=3, stdout=StringIO())
+
+        self.assertEqual(Patient.objects.filter(user__username__startswith='synthetic-patient-').count(), 30)
+        self.assertGreaterEqual(Pregnancy.objects.count(), 30)
+        self.assertTrue(Delivery.objects.exists())
+        self.assertFalse(Delivery.objects.exclude(patient=F('pregnancy__patient')).exists())
+        self.assertFalse(Visit.objects.filter(pregnancy__isnull=False).exclude(patient=F('pregnancy__patient')).exists())
+        self.assertFalse(Visit.objects.filter(delivery__isnull=False).exclude(patient=F('delivery__patient')).exists())
+        self.assertFalse(Visit.objects.filter(systolic__isnull=True).exists())
+
+        # Historical dates are kept instead of being stamped with the insert time
+        self.assertGreater(Visit.objects.dates('visit_date', 'month').count(), 1)
+        # bulk_create skips signals, so rollups are rebuilt afterwards
+        self.assertEqual(
+            SummaryRollup.objects.get(metric='visits', scope='global', dimension='total').count,
+            Visit.objects.count(),
+        )
+
+
+class BenchmarkRunnerTests(TestCase):
+    """Test the benchmark runner and report comparison"""
+
+    def setUp(self):
+        call_command('generate_synthetic_data', patients=5, seed=1, stdout=StringIO())
+        handle, self.report_path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        self.addCleanup(os.remove, self.report_path)
+
+    @override_settings(VISIT_PARTITION_REFRESH=0)
+    def test_samples_survive_visit_partitioning(self):
+        """The sample delivery should still be one with visits once they move to partition tables"""
+        if connection.vendor != 'sqlite':
+            self.skipTest('per-period tables are for SQLite')
+        self.addCleanup(forget_partitions)
+        # Only a later delivery has visits, so falling back to the first one is noticed
+        first = Delivery.objects.order_by('pk').first()
+        Visit.objects.filter(delivery=first).delete()
+        Visit.objects.filter(pregnancy=first.pregnancy).delete()
+        samples = sample_records()
+
+        call_command('partition_visits', stdout=StringIO())
+
+        self.assertEqual(sample_records(), samples)
+        self.assertNotEqual(samples['delivery'], first)
+        self.assertEqual(samples['postnatal_visit'].delivery, samples['delivery'])
+
+    def test_report_covers_routes(self):
+        """Every matching route should be requested successfully and reported with percentiles and query counts"""
+        call_command(
+            'run_benchmarks', output=self.report_path, iterations=3, warmup=0,
+            include='^(patient|pregnancy-visits|delivery-visits)-(list|detail)$|summary$', stdout=StringIO(),
+        )
+        with open(self.report_path) as handle:
+            report = json.load(handle)
+
+        routes = report['routes']
+        self.assertIn('patient-list', routes)
+        self.assertIn('delivery-visits-detail', routes)
+        self.assertIn('visits-summary', routes)
+        self.assertNotIn('visits-batch', routes)  # POST-only
+        for name, result in routes.items():
+            self.assertEqual(result['status'], 200, name)
+            self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+            self.assertGreater(result['queries']['max'], 0)
+            self.assertGreater(result['peak_memory_kb'], 0)
+        self.assertEqual(report['meta']['row_counts']['patients'], 5)
+
+    def test_concurrency_benchmark_streams_exports(self):
+        """The concurrency benchmark should time CRUD requests idle and alongside streaming exports"""
+        call_command('benchmark_concurrency', output=self.report_path, exports=2, requests=3, stdout=StringIO())
+        with open(self.report_path) as handle:
+            report = json.load(handle)
+
+        self.assertEqual(report['crud']['status'], 200)
+        for phase in ('idle_ms', 'under_load_ms'):
+            self.assertLessEqual(report['crud'][phase]['p50'], report['crud'][phase]['p95'])
+        self.assertEqual(len(report['export']['duration_ms']), 2)
+        self.assertGreater(report['export']['response_bytes'], 0)
+
+    def test_compare_flags_regressions(self):
+        """A route that became slower or issues more queries should be flagged"""
+        route = {'path': '/api/patients/', 'latency_ms': {'p95': 4.0}, 'queries': {'max': 2}}
+        baseline = {'routes': {'patient-list': route, 'visits-summary': route}}
+        candidate = {'routes': {
+            'patient-list': dict(route, latency_ms={'p95': 9.0}),
+            'visits-summary': dict(route, queries={'max': 3}),
+        }}
+        paths = []
+        for report in (baseline, candidate):
+            handle, path = tempfile.mkstemp(suffix='.json')
+            with os.fdopen(handle, 'w') as stream:
+                json.dump(report, stream)
+            self.addCleanup(os.remove, path)
+            paths.append(path)
+
+        with self.assertRaisesMessage(CommandError, '2 routes regressed'):
+            call_command('compare_benchmarks', *paths, fail_on_regression=True, stdout=StringIO())
+
+
+class RequestMetricsTests(TestCase):
+    """Test the request metrics middleware and the /metrics/ endpoint"""
+
+    def setUp(self):
+        with registry.lock:
+            registry.series.clear()
+        self.admin = User.objects.create_user(username='admin1', password='testpass123', role='admin')
+        self.doctor = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.client = APIClient()
+
+    def scrape(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return response.content.decode()
+
+    def test_requests_grouped_by_route_name(self):
+        """Requests should be counted per URL pattern name with latency, query and size histograms"""
+        self.client.force_authenticate(user=self.doctor)
+        for _ in range(2):
+            self.assertEqual(self.client.get('/api/patients/').status_code, 200)
+        self.client.get('/no-such-page/')
+
+        body = self.scrape()
+        self.assertIn('http_requests_total{route="patient-list",method="GET",status="200"} 2', body)
+        self.assertIn('http_request_duration_seconds_count{route="patient-list",method="GET"} 2', body)
+        self.assertIn('http_request_duration_seconds_bucket{route="patient-list",method="GET",le="+Inf"} 2', body)
+        self.assertIn('http_response_size_bytes_count{route="patient-list",method="GET"} 2', body)
+        self.assertIn('http_requests_total{route="unmatched",method="GET",status="404"} 1', body)
+        queries = [line for line in body.splitlines() if line.startswith('http_request_db_queries_sum{route="patient-list"')]
+        self.assertEqual(len(queries), 1)
+        self.assertGreater(int(queries[0].split()[-1]), 0)
+
+    async def test_async_views_are_measured_without_adaptation(self):
+        """Under ASGI the middleware should run async, and count the queries of async views"""
+        headers = {'Authorization': f'Token {(await Token.objects.acreate(user=self.doctor)).key}'}
+        async def view(request):
+            return HttpResponse()
+
+        # Run as a coroutine, so Django does not adapt it by moving the rest of the chain to a thread
+        self.assertTrue(iscoroutinefunction(RequestMetricsMiddleware(view)))
+        response = await self.async_client.get('/api/analytics/visits/summary/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        body = await sync_to_async(self.scrape)()
+        self.assertIn('http_requests_total{route="visits-summary",method="GET",status="200"} 1', body)
+        queries = [line for line in body.splitlines() if line.startswith('http_request_db_queries_sum{route="visits-summary"')]
+        self.assertGreater(int(queries[0].split()[-1]), 0)
+
+    def test_admins_only(self):
+        """Only admins may read the metrics"""
+        self.assertEqual(self.client.get('/metrics/').status_code, 401)
+        self.client.force_authenticate(user=self.doctor)
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+
+    def test_metrics_dir_merges_processes(self):
+        """With METRICS_DIR set, the totals written by other processes should be added in"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        other = _new_series()
+        other['status']['200'] = 5
+        other['latency'][0] = 5
+        with open(os.path.join(directory, '999999.json'), 'w') as stream:
+            json.dump([['patient-list', 'GET', other]], stream)
+
+        with self.settings(METRICS_DIR=directory):
+            self.client.force_authenticate(user=self.doctor)
+            self.client.get('/api/patients/')
+            body = self.scrape()
+
+        self.assertIn('http_requests_total{route="patient-list",method="GET",status="200"} 6', body)
+        self.assertTrue(os.path.exists(os.path.join(directory, f'{os.getpid()}.json')))
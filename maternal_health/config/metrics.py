@@ -0,0 +1,288 @@
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework.views import APIView
+
+from users.permissions import IsAdminRole
+
+
+'''
+
+Per-route request metrics. RequestMetricsMiddleware records, for every
+request, its latency, the number and duration of SQL queries it ran,
+the response size and the status code, grouped by URL pattern name
+(e.g. `visit-list`) and HTTP method. Each process aggregates into fixed
+histogram buckets in memory, so recording a request costs a few dict
+and list updates. With METRICS_DIR set, every process also writes its
+totals to <METRICS_DIR>/<pid>.json at most every METRICS_FLUSH_INTERVAL
+seconds, and the /metrics/ endpoint (admins only) merges all of them,
+so any worker of a multi-process deployment can serve the numbers for
+the whole deployment in the Prometheus text format.
+
+'''
+
+# Upper bounds of the histogram buckets; every histogram also has a +Inf bucket
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+RESPONSE_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+METRICS_FLUSH_INTERVAL = 10
+
+# Route label of requests that matched no URL pattern
+UNMATCHED_ROUTE = 'unmatched'
+
+_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def route_name(request):
+    """The URL pattern name of the view that handled `request`, or its route if the pattern has no name."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNMATCHED_ROUTE
+    return match.view_name if match.url_name else match.route
+
+
+def _response_size(response):
+    if response.has_header('Content-Length'):
+        return int(response['Content-Length'])
+    if response.streaming:
+        return None  # not known until the body has been sent
+    return len(response.content)
+
+
+def _observe(histogram, buckets, value):
+    histogram[bisect_left(buckets, value)] += 1
+
+
+def _new_series():
+    return {
+        'status': {},
+        'latency': [0] * (len(LATENCY_BUCKETS) + 1), 'latency_sum': 0.0,
+        'queries': [0] * (len(QUERY_COUNT_BUCKETS) + 1), 'queries_sum': 0,
+        'query_seconds': 0.0,
+        'size': [0] * (len(RESPONSE_SIZE_BUCKETS) + 1), 'size_sum': 0,
+    }
+
+
+def merge_series(target, series):
+    """Add the totals of `series` into `target` (both as kept by MetricsRegistry)."""
+    for status, count in series['status'].items():
+        target['status'][status] = target['status'].get(status, 0) + count
+    for name in ('latency', 'queries', 'size'):
+        target[name] = [a + b for a, b in zip(target[name], series[name])]
+    for name in ('latency_sum', 'queries_sum', 'query_seconds', 'size_sum'):
+        target[name] += series[name]
+
+
+class MetricsRegistry:
+    """In-process totals per (route, method). Thread-safe; a forked worker starts from zero."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.series = {}
+        self.last_flush = time.monotonic()
+
+    def observe(self, route, method, status, seconds, queries, query_seconds, size):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._reset()
+            series = self.series.get((route, method))
+            if series is None:
+                series = self.series[(route, method)] = _new_series()
+            status = str(status)
+            series['status'][status] = series['status'].get(status, 0) + 1
+            _observe(series['latency'], LATENCY_BUCKETS, seconds)
+            series['latency_sum'] += seconds
+            _observe(series['queries'], QUERY_COUNT_BUCKETS, queries)
+            series['queries_sum'] += queries
+            series['query_seconds'] += query_seconds
+            if size is not None:
+                _observe(series['size'], RESPONSE_SIZE_BUCKETS, size)
+                series['size_sum'] += size
+        self.maybe_flush()
+
+    def snapshot(self):
+        """The totals as a JSON-serialisable list of [route, method, series]."""
+        with self.lock:
+            return [[route, method, copy.deepcopy(series)] for (route, method), series in self.series.items()]
+
+    def maybe_flush(self):
+        directory = metrics_dir()
+        if directory and time.monotonic() - self.last_flush >= getattr(settings, 'METRICS_FLUSH_INTERVAL', METRICS_FLUSH_INTERVAL):
+            self.flush(directory)
+
+    def flush(self, directory):
+        """Write this process's totals to <directory>/<pid>.json, replacing the previous file atomically."""
+        self.last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        descriptor, partial = tempfile.mkstemp(dir=directory, suffix='.part')
+        with os.fdopen(descriptor, 'w') as stream:
+            json.dump(self.snapshot(), stream)
+        os.replace(partial, os.path.join(directory, f'{self.pid}.json'))
+
+    def collect(self):
+        """
+        Totals per (route, method) for the whole deployment.
+
+        With METRICS_DIR set this process flushes first and the files of all processes are
+        merged, including those of processes that have exited, so counters never go back.
+        """
+        directory = metrics_dir()
+        if not directory:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush(directory)
+            snapshots = []
+            for name in sorted(os.listdir(directory)):
+                if name.endswith('.json'):
+                    try:
+                        with open(os.path.join(directory, name)) as stream:
+                            snapshots.append(json.load(stream))
+                    except (OSError, ValueError):
+                        continue  # removed or being replaced; its totals are in the next scrape
+
+        totals = {}
+        for snapshot in snapshots:
+            for route, method, series in snapshot:
+                merge_series(totals.setdefault((route, method), _new_series()), series)
+        return totals
+
+
+registry = MetricsRegistry()
+
+
+class _QueryTimer:
+    """Database execute wrapper counting the queries of one request and the time spent in them."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+def _watch_queries(queries):
+    # Entered in the thread that runs the request's queries, since connections are per thread
+    stack = ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(queries))
+    return stack
+
+
+class RequestMetricsMiddleware:
+    """
+    Record latency, SQL queries, response size and status of each request in `registry`.
+
+    Should come first in MIDDLEWARE so the latency covers the other middleware and the size is
+    the (compressed) size sent. For streaming responses the latency ends when the response is
+    returned, before the body is streamed, and the size is only known if Content-Length is set.
+
+    Works in both modes, so under ASGI the async views are not run through a thread. An async
+    request's queries run in its thread-sensitive sync thread, so the query timer is installed there.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = _QueryTimer()
+        start = time.perf_counter()
+        with _watch_queries(queries):
+            response = self.get_response(request)
+        self._observe(request, response, queries, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        queries = _QueryTimer()
+        start = time.perf_counter()
+        watching = await sync_to_async(_watch_queries)(queries)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(watching.close)()
+        self._observe(request, response, queries, time.perf_counter() - start)
+        return response
+
+    def _observe(self, request, response, queries, elapsed):
+        method = request.method if request.method in _METHODS else 'other'
+        registry.observe(route_name(request), method, response.status_code, elapsed, queries.count, queries.seconds, _response_size(response))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(route, method, **extra):
+    labels = {'route': route, 'method': method, **extra}
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _histogram_lines(name, route, method, counts, total, buckets):
+    lines = []
+    cumulative = 0
+    for bound, count in zip((*buckets, '+Inf'), counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{_labels(route, method, le=bound)} {cumulative}')
+    lines.append(f'{name}_sum{_labels(route, method)} {total}')
+    lines.append(f'{name}_count{_labels(route, method)} {cumulative}')
+    return lines
+
+
+def render_metrics(totals):
+    """`totals` from MetricsRegistry.collect() in the Prometheus text exposition format."""
+    keys = sorted(totals)
+    requests = ['# HELP http_requests_total Requests by route, method and status code.', '# TYPE http_requests_total counter']
+    latency = ['# HELP http_request_duration_seconds Time to produce the response.', '# TYPE http_request_duration_seconds histogram']
+    queries = ['# HELP http_request_db_queries SQL queries run per request.', '# TYPE http_request_db_queries histogram']
+    query_seconds = ['# HELP http_request_db_query_seconds_total Time spent in SQL queries.', '# TYPE http_request_db_query_seconds_total counter']
+    sizes = ['# HELP http_response_size_bytes Response body size, where known.', '# TYPE http_response_size_bytes histogram']
+
+    for route, method in keys:
+        series = totals[(route, method)]
+        for status, count in sorted(series['status'].items()):
+            requests.append(f'http_requests_total{_labels(route, method, status=status)} {count}')
+        latency += _histogram_lines('http_request_duration_seconds', route, method, series['latency'], series['latency_sum'], LATENCY_BUCKETS)
+        queries += _histogram_lines('http_request_db_queries', route, method, series['queries'], series['queries_sum'], QUERY_COUNT_BUCKETS)
+        query_seconds.append(f'http_request_db_query_seconds_total{_labels(route, method)} {series["query_seconds"]}')
+        sizes += _histogram_lines('http_response_size_bytes', route, method, series['size'], series['size_sum'], RESPONSE_SIZE_BUCKETS)
+
+    return '\n'.join(requests + latency + queries + query_seconds + sizes) + '\n'
+
+
+# Prometheus scrape endpoint, for admins only (scrapers authenticate with an admin's token)
+class MetricsView(APIView):
+    permission_classes = [IsAdminRole]
+
+    def get(self, request):
+        return HttpResponse(render_metrics(registry.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
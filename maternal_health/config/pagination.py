@@ -0,0 +1,138 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (view.cursor_ordering, id).
+
+    Each page is fetched with a WHERE on the last row of the previous page instead of
+    an OFFSET, and no COUNT(*) is run, so every page costs the same however deep it is.
+    The ordering field may be nullable; NULLs sort first, and a page that crosses from
+    the NULLs to the values takes a second query. The `ordering` query parameter does
+    not apply to cursor pages.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+    display_page_controls = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.field = queryset.model._meta.get_field(view.cursor_ordering)
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        value, pk, reverse = self.decode_cursor(encoded) if encoded else (None, None, False)
+
+        name = self.field.name
+        if reverse:
+            ordering = [F(name).desc(nulls_last=True), F('pk').desc()]
+        else:
+            ordering = [F(name).asc(nulls_first=True), F('pk').asc()]
+        queryset = queryset.order_by(*ordering)
+
+        # One extra row tells us whether there is another page in this direction. The rows beyond the
+        # cursor are read segment by segment; a later segment is only queried when the page is not full.
+        rows = []
+        for segment in self._after(name, value, pk, reverse) if pk is not None else [Q()]:
+            rows += queryset.filter(segment)[:self.page_size + 1 - len(rows)]
+            if len(rows) > self.page_size:
+                break
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.rows = rows
+        self.has_next = has_more if not reverse else pk is not None
+        self.has_previous = has_more if reverse else pk is not None
+        return rows
+
+    def _after(self, name, value, pk, reverse):
+        """
+        The rows strictly beyond (value, pk) in the page direction, with NULLs before every value, as
+        a list of filters in page order. Each one is a range seek on the (field, id) index: an OR of
+        the NULL and non-NULL rows, or a bare `field > value OR (field = value AND id > pk)`, would
+        make SQLite walk the index from the start.
+        """
+        if value is None:
+            if reverse:
+                return [Q(**{f'{name}__isnull': True, 'pk__lt': pk})]
+            return [Q(**{f'{name}__isnull': True, 'pk__gt': pk}), Q(**{f'{name}__isnull': False})]
+        if reverse:
+            segments = [Q(**{f'{name}__lte': value}) & (Q(**{f'{name}__lt': value}) | Q(**{name: value, 'pk__lt': pk}))]
+            if self.field.null:
+                segments.append(Q(**{f'{name}__isnull': True}))
+            return segments
+        return [Q(**{f'{name}__gte': value}) & (Q(**{f'{name}__gt': value}) | Q(**{name: value, 'pk__gt': pk}))]
+
+    def encode_cursor(self, row, reverse):
+        value = getattr(row, self.field.attname)
+        payload = {'v': None if value is None else value.isoformat(), 'id': row.pk, 'r': int(reverse)}
+        token = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def decode_cursor(self, encoded):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            value = None if payload['v'] is None else self.field.to_python(payload['v'])
+            return value, int(payload['id']), bool(payload['r'])
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.rows:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.rows[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class PageOrCursorPagination(PageNumberPagination):
+    """
+    Page-number pagination by default, keyset pagination when the client asks for it.
+
+    Send `?pagination=cursor` (or follow a `next`/`previous` link that carries a
+    `cursor`) on views that define `cursor_ordering`. Other views and requests keep
+    the `count`/`page` responses existing clients rely on.
+    """
+
+    pagination_query_param = 'pagination'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if getattr(view, 'cursor_ordering', None) and (
+            request.query_params.get(self.pagination_query_param) == 'cursor'
+            or KeysetPagination.cursor_query_param in request.query_params
+        ):
+            self.keyset = KeysetPagination()
+            self.display_page_controls = False
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 import os
 
@@ -43,11 +44,16 @@ INSTALLED_APPS = [
     'pregnancies',
     'deliveries',
     'visits',
+    'analytics',
+    'benchmarks',  # synthetic data and API benchmarks (management commands)
     'rest_framework',  # For API development
     'rest_framework.authtoken',  # For token-based authentication
+    'rest_framework_simplejwt.token_blacklist',  # rotated and logged-out JWT refresh tokens
 ]
 
 MIDDLEWARE = [
+    'config.metrics.RequestMetricsMiddleware',  # per-route latency, queries and sizes; keep first
+    'analytics.replica.ReplicaRoutingMiddleware',  # summary/export/list reads from the read replica
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,7 +83,8 @@ TEMPLATES = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',  # Bearer access tokens, no database lookup
+        'users.authentication.PatientTokenAuthentication',  # DRF tokens; loads the caller's Patient in the same query
         'rest_framework.authentication.SessionAuthentication',  # keep this for browsable API login
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -93,10 +100,23 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'config.pagination.PageOrCursorPagination',  # ?pagination=cursor for keyset pages
     'PAGE_SIZE': 10,  # default items per page
 
 }
+
+# JWT access tokens are short-lived and carry role and patient_id claims, so requests made with
+# them need no user lookup; refresh tokens rotate and the used ones are blacklisted
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'ROTATE_REFRESH_TOKENS': True,
+    'BLACKLIST_AFTER_ROTATION': True,
+    'UPDATE_LAST_LOGIN': False,
+    'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_OBTAIN_SERIALIZER': 'users.authentication.RoleTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.authentication.RoleTokenRefreshSerializer',
+}
 WSGI_APPLICATION = 'config.wsgi.application'
 
 # Custom user model
@@ -110,9 +130,56 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    # Read replica for analytics, exports and list pages (analytics/replica.py). Locally a copy of
+    # db.sqlite3 refreshed by `manage.py sync_replica`.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.replica.sqlite3',
+    },
+}
+
+DATABASE_ROUTERS = ['analytics.replica.ReplicaRouter']
+
+# Set to 'replica' to send summary, export and list reads there. Reads fall back to default while the
+# replica is more than REPLICA_MAX_LAG seconds behind, and for REPLICA_READ_YOUR_WRITES seconds after
+# a client writes. The pin is kept in the default cache, so use a shared cache with several workers.
+REPLICA_DATABASE = None
+REPLICA_MAX_LAG = 30  # seconds
+REPLICA_READ_YOUR_WRITES = 10  # seconds
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# The local-memory cache is per process; use a shared backend (Redis, Memcached or the
+# database cache) when running several workers so summary invalidation reaches all of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+# Analytics summaries are cached per scope and role, and dropped when the underlying records change
+SUMMARY_CACHE_ALIAS = 'default'
+SUMMARY_CACHE_TIMEOUT = 300  # seconds
+
+# Request metrics are kept per process; with several workers, point METRICS_DIR at a directory they
+# share (e.g. on a tmpfs) so /metrics/ reports all of them. Each worker rewrites its file at most
+# every METRICS_FLUSH_INTERVAL seconds.
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 10  # seconds
+
+# Pregnancies delivered more than ARCHIVE_AFTER_YEARS ago are moved by `manage.py archive_pregnancies` into
+# compressed segments under ARCHIVE_DIR (pregnancies/archive.py); back the directory up with the database.
+ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive')
+ARCHIVE_AFTER_YEARS = 10
+
+# On SQLite, `manage.py partition_visits` moves the visits of closed months into per-period tables
+# (visits/partitions.py). Each process re-reads the list of those tables every VISIT_PARTITION_REFRESH
+# seconds, and the command waits that long before moving visits into a new table or dropping one.
+VISIT_PARTITION_REFRESH = 30  # seconds
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -0,0 +1,41 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+
+class QueryBudgetMixin:
+    """
+    Query-count assertions for API tests.
+
+    Mix into a TestCase that has an authenticated `self.client`. List endpoints
+    must issue the same number of queries whether a page holds one row or a
+    full page; a count that grows with the rows is an N+1 regression.
+    """
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        return len(captured)
+
+    def assertQueryBudget(self, url, max_queries):
+        """Fail if a GET of `url` takes more than `max_queries` queries."""
+        queries = self.count_queries(url)
+        self.assertLessEqual(queries, max_queries, f'{url} took {queries} queries, budget is {max_queries}')
+
+    def assertListQueriesConstant(self, url, make_rows, sizes=(1, 10), max_queries=None):
+        """
+        Grow the data behind `url` to each page size in `sizes` and fail if the query count changes.
+
+        `make_rows(n)` must add `n` more rows to the list served at `url`.
+        """
+        counts = {}
+        created = 0
+        for size in sizes:
+            make_rows(size - created)
+            created = size
+            counts[size] = self.count_queries(url)
+
+        self.assertEqual(len(set(counts.values())), 1, f'{url} query count grows with page size: {counts}')
+        if max_queries is not None:
+            self.assertLessEqual(counts[sizes[-1]], max_queries, f'{url} took {counts[sizes[-1]]} queries, budget is {max_queries}')
@@ -17,6 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from users.views import csrf_free_logout
+from .metrics import MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -44,4 +45,10 @@ urlpatterns = [
     # Include URLs from the deliveries app
     path('api/', include('deliveries.urls')),
 
+    # Include URLs from the analytics app
+    path('api/', include('analytics.urls')),
+
+    # Per-route request metrics in the Prometheus text format (admins only)
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+
 ]
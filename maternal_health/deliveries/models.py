@@ -51,19 +51,18 @@ class Delivery(models.Model):
         indexes = [
             models.Index(fields=['delivery_mode']),
             models.Index(fields=['place_of_delivery']),
-            models.Index(fields=['delivery_date']), 
+            models.Index(fields=['delivery_date', 'id']),  # keyset pagination order
         ]
 
     # Enforce patient consistency with pregnancy
     def save(self, *args, **kwargs):
         # Always enforce patient consistency
         if self.pregnancy_id:
-            # Assign patient directly from pregnancy_id relation
-            from pregnancies.models import Pregnancy
-            pregnancy = Pregnancy.objects.get(pk=self.pregnancy_id)
-            self.patient = pregnancy.patient
+            # Take the patient from the pregnancy; reuse a loaded pregnancy instead of querying it again
+            if Delivery.pregnancy.is_cached(self) and self.pregnancy.pk == self.pregnancy_id:
+                self.patient_id = self.pregnancy.patient_id
+            else:
+                from pregnancies.models import Pregnancy
+                self.patient_id = Pregnancy.objects.values_list('patient_id', flat=True).get(pk=self.pregnancy_id)
 
-            if self.patient and pregnancy.patient != self.patient:
-                raise ValueError("Delivery patient must match pregnancy patient.")
-
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
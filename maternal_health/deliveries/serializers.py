@@ -20,4 +20,28 @@ class DeliverySerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Delivery patient must match Delivery patient")
         if pregnancy and not patient:
             data["patient"] = pregnancy.patient
-        return data
\ No newline at end of file
+        return data
+
+
+# Serializer for one row of a batch upload. Pregnancy and patient arrive as plain ids and are checked
+# against the pregnancies the view loaded in bulk (context['pregnancies']), so validating a row never queries.
+class DeliveryBatchItemSerializer(DeliverySerializer):
+    pregnancy = serializers.IntegerField(min_value=1)
+    patient = serializers.IntegerField(min_value=1, required=False)
+
+    class Meta(DeliverySerializer.Meta):
+        read_only_fields = ['delivery_date', 'created_by', 'updated_by', 'patient_id', 'pregnancy_id']
+
+    def validate(self, data):
+        pregnancy = self.context['pregnancies'].get(data['pregnancy'])
+        if pregnancy is None:
+            raise serializers.ValidationError({"pregnancy": "Pregnancy not found."})
+
+        # Both the row's patient and the patient in the URL (for nested routes) must own the pregnancy
+        for patient_id in (data.pop('patient', None), self.context.get('patient_pk')):
+            if patient_id is not None and int(patient_id) != pregnancy.patient_id:
+                raise serializers.ValidationError("Delivery patient must match pregnancy patient.")
+
+        data['pregnancy'] = pregnancy
+        data['patient_id'] = pregnancy.patient_id
+        return data
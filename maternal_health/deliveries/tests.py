@@ -2,6 +2,9 @@ from django.test import TestCase
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from config.testing import QueryBudgetMixin
 from patients.models import Patient
 from pregnancies.models import Pregnancy
 from .models import Delivery
@@ -276,3 +279,111 @@ class DeliverySummaryAuthorizationTests(TestCase):
         response = self.client.get(f'/api/patients/{self.patient_1.id}/analytics/deliveries/summary/')
         
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class DeliveryListQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Test that delivery list endpoints do not issue queries per delivery"""
+
+    def setUp(self):
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.pregnancy = Pregnancy.objects.create(patient=self.patient, gestational_age_weeks=38)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+    def _make_deliveries(self, count):
+        for _ in range(count):
+            Delivery.objects.create(
+                pregnancy=self.pregnancy, patient=self.patient, delivery_mode='vaginal',
+                birth_weight_g=3200, place_of_delivery='Hospital A', skilled_birth_attendant=True,
+                newborn_gender='Female', apgar_score_1min=8, apgar_score_5min=9,
+            )
+
+    def test_global_delivery_list(self):
+        """Delivery list should cost the same for one delivery or a full page"""
+        self.assertListQueriesConstant('/api/deliveries/', self._make_deliveries, max_queries=2)
+
+    def test_patient_delivery_list(self):
+        """Nested patient delivery list should cost the same for one delivery or a full page"""
+        url = f'/api/patients/{self.patient.id}/deliveries/'
+        self.assertListQueriesConstant(url, self._make_deliveries, max_queries=2)
+
+
+class DeliveryBatchIngestionTests(TestCase):
+    """Test the batch delivery ingestion endpoint"""
+
+    def setUp(self):
+        self.patient_user_1 = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient_1 = Patient.objects.get(user=self.patient_user_1)
+        self.patient_user_2 = User.objects.create_user(username='patient2', password='testpass123', role='patient')
+        self.patient_2 = Patient.objects.get(user=self.patient_user_2)
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.pregnancy_1 = Pregnancy.objects.create(patient=self.patient_1, gestational_age_weeks=39)
+        self.pregnancy_2 = Pregnancy.objects.create(patient=self.patient_2, gestational_age_weeks=40)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+    def _row(self, pregnancy, **kwargs):
+        row = {
+            'pregnancy': pregnancy.id,
+            'delivery_mode': 'vaginal',
+            'birth_weight_g': 3200,
+            'place_of_delivery': 'Hospital A',
+            'skilled_birth_attendant': True,
+            'newborn_gender': 'Female',
+            'apgar_score_1min': 8,
+            'apgar_score_5min': 9,
+        }
+        row.update(kwargs)
+        return row
+
+    def test_batch_reports_each_row(self):
+        """Valid rows should be created and invalid rows reported without blocking the rest"""
+        rows = [
+            self._row(self.pregnancy_1),
+            self._row(self.pregnancy_2, patient=self.patient_1.id),  # pregnancy belongs to patient 2
+            self._row(self.pregnancy_2),
+            dict(self._row(self.pregnancy_1), pregnancy=999999),
+            self._row(self.pregnancy_1, birth_weight_g=50),
+        ]
+        response = self.client.post('/api/deliveries/batch/', rows, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], ['created', 'error', 'created', 'error', 'error'])
+        self.assertIn('pregnancy', results[3]['errors'])
+        self.assertIn('birth_weight_g', results[4]['errors'])
+
+        created = Delivery.objects.get(pk=results[2]['id'])
+        self.assertEqual(created.patient_id, self.patient_2.id)
+        self.assertEqual(created.created_by, self.doctor_user)
+        self.assertEqual(Delivery.objects.count(), 2)
+
+    def test_nested_batch_rejects_other_patients_pregnancy(self):
+        """Batch under a patient route should reject pregnancies of other patients"""
+        rows = [self._row(self.pregnancy_1), self._row(self.pregnancy_2)]
+        response = self.client.post(f'/api/patients/{self.patient_1.id}/deliveries/batch/', rows, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([r['status'] for r in response.json()['results']], ['created', 'error'])
+
+    def test_batch_query_count_does_not_grow_with_rows(self):
+        """A batch of 50 deliveries should take as many queries as a batch of 2"""
+        counts = []
+        for size in (1, 2, 50):  # the first batch also creates the rollup buckets
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.post('/api/deliveries/batch/', [self._row(self.pregnancy_1)] * size, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            counts.append(len(captured))
+
+        self.assertEqual(counts[1], counts[2])
+        summary = self.client.get(f'/api/patients/{self.patient_1.id}/analytics/deliveries/summary/').json()
+        self.assertEqual(summary['total_deliveries'], 53)
+
+    def test_patient_cannot_use_batch(self):
+        """Patients should not be able to upload deliveries"""
+        self.client.force_authenticate(user=self.patient_user_1)
+        response = self.client.post('/api/deliveries/batch/', [self._row(self.pregnancy_1)], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -1,18 +1,34 @@
 from .models import Delivery
-from .serializers import DeliverySerializer
-from rest_framework import viewsets, filters
-from rest_framework.decorators import api_view, permission_classes
+from .serializers import DeliverySerializer, DeliveryBatchItemSerializer
+from pregnancies.archive import ArchiveReadThroughMixin
+from pregnancies.models import Pregnancy, sync_delivered
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from rest_framework import viewsets, filters, serializers
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
+from patients.identity import get_patient_id
 from patients.permissions import IsClinicianOrAdmin
-from django.http import HttpResponse
-import csv
-from django.db.models import Count, Avg
-from django.db.models.functions import TruncMonth
+from analytics.asyncapi import api_response, asummary_response, async_api_view, export_response, summary_patient_pk
+from analytics.rollups import DELIVERY_ROLLUP, apply_deltas, aread_rollup, collect_deltas
 from rest_framework.response import Response
 from rest_framework import status
 
-class DeliveryViewSet(viewsets.ModelViewSet):
+
+# Upper bound on rows accepted by one batch upload
+DELIVERY_BATCH_MAX_ROWS = 1000
+
+
+def _as_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class DeliveryViewSet(ArchiveReadThroughMixin, viewsets.ModelViewSet):
     queryset = Delivery.objects.all()
+    archived_model = Delivery  # archived deliveries are read back on the patient routes
     serializer_class = DeliverySerializer
     permission_classes = [IsAuthenticated, IsClinicianOrAdmin]
 
@@ -22,6 +38,7 @@ class DeliveryViewSet(viewsets.ModelViewSet):
     search_fields = ['delivery_type', 'notes', 'patient__first_name', 'patient__last_name']
     ordering_fields = ['delivery_date']
     ordering = ['delivery_date']
+    cursor_ordering = 'delivery_date'  # keyset order for ?pagination=cursor
 
 
     '''
@@ -38,56 +55,98 @@ class DeliveryViewSet(viewsets.ModelViewSet):
 
         user = self.request.user
         if hasattr(user, "role") and user.role == "patient":
-            queryset = queryset.filter(patient__user=user)
+            queryset = queryset.filter(patient_id=get_patient_id(user))
 
         return queryset
     
     def perform_create(self, serializer):
         serializer.save()
 
+    '''
+    Batch ingestion for back-entry of paper registers. Every referenced pregnancy is
+    loaded with one in_bulk query, rows are validated in memory, valid rows are inserted
+    with a single bulk_create in one transaction and each row gets its own result.
+    '''
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request, patient_pk=None):
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            return Response({'detail': 'Expected a non-empty list of deliveries.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > DELIVERY_BATCH_MAX_ROWS:
+            return Response({'detail': f'A batch may contain at most {DELIVERY_BATCH_MAX_ROWS} deliveries.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        pregnancy_ids = {_as_id(row.get('pregnancy')) for row in rows if isinstance(row, dict)} - {None}
+        pregnancies = Pregnancy.objects.only('id', 'patient_id').in_bulk(pregnancy_ids)
+
+        item_serializer = DeliveryBatchItemSerializer(context={
+            'request': request, 'pregnancies': pregnancies, 'patient_pk': patient_pk,
+        })
+        results = []
+        deliveries = []
+        for index, row in enumerate(rows):
+            try:
+                data = item_serializer.run_validation(row)
+            except serializers.ValidationError as exc:
+                results.append({'index': index, 'status': 'error', 'errors': exc.detail})
+                continue
+            deliveries.append(Delivery(**data, created_by=request.user, updated_by=request.user))
+            results.append({'index': index, 'status': 'created'})
+
+        # bulk_create skips Delivery.save() and signals; patients are already set, and rollups and
+        # the pregnancies' delivered flags are updated here
+        with transaction.atomic():
+            Delivery.objects.bulk_create(deliveries)
+            apply_deltas(DELIVERY_ROLLUP, collect_deltas(DELIVERY_ROLLUP, added=deliveries))
+            sync_delivered([delivery.pregnancy_id for delivery in deliveries])
+
+        created = iter(deliveries)
+        for result in results:
+            if result['status'] == 'created':
+                result['id'] = next(created).pk
+
+        if not deliveries:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif len(deliveries) < len(rows):
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response({'created': len(deliveries), 'failed': len(rows) - len(deliveries), 'results': results}, status=response_status)
+
 # Implement analytics endpoints for deliveries
-def _build_delivery_queryset(request, kwargs):
+def _build_delivery_queryset(user, kwargs):
     queryset = Delivery.objects.all()
     patient_id = kwargs.get('patient_pk')
     if patient_id:
         queryset = queryset.filter(patient_id=patient_id)
 
-    user = request.user
     if hasattr(user, 'role') and user.role == 'patient':
-        queryset = queryset.filter(patient__user=user)
+        queryset = queryset.filter(patient_id=get_patient_id(user))
 
     return queryset
 
 # Export deliveries to CSV for a patient, only accessible by that patient or clinicians/admins
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def export_deliveries_csv(request, patient_pk=None):
-    qs = _build_delivery_queryset(request, {'patient_pk': patient_pk})
-    rows = list(qs.values())
-    if not rows:
-        return Response({'detail': 'No deliveries found'}, status=404)
-
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="deliveries_export.csv"'
-
-    fieldnames = list(rows[0].keys())
-    writer = csv.DictWriter(response, fieldnames=fieldnames)
-    writer.writeheader()
-    for r in rows:
-        for k, v in r.items():
-            try:
-                if hasattr(v, 'isoformat'):
-                    r[k] = v.isoformat()
-            except Exception:
-                pass
-        writer.writerow(r)
-
-    return response
+@async_api_view
+async def export_deliveries_csv(request, patient_pk=None):
+    qs = await sync_to_async(_build_delivery_queryset)(request.user, {'patient_pk': patient_pk})
+    if not await qs.aexists():
+        return api_response({'detail': 'No deliveries found'}, status=404)
+
+    # Streamed as CSV, Parquet or Arrow; too large to stream within the request, it becomes a background job
+    return await export_response(request, 'deliveries', qs, {'patient_pk': patient_pk})
+
+# Summary payload for one scope's delivery rollup; shared with the batch summary endpoint in analytics.
+def delivery_summary_data(rollup):
+    return {
+        'total_deliveries': rollup.count(),
+        'by_mode': rollup.histogram('delivery_mode'),
+        'average_birth_weight_g': rollup.average('birth_weight_g'),
+        'alive_counts': rollup.histogram('alive'),
+        'monthly_deliveries': rollup.monthly(),
+    }
 
 # Summary analytics endpoint for deliveries, scoped to patient if patient_pk provided, otherwise global summary for clinicians/admins
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def deliveries_summary(request, patient_pk=None):
+@async_api_view
+async def deliveries_summary(request, patient_pk=None):
     '''
     Return basic summary statistics for deliveries as JSON.
 
@@ -98,53 +157,15 @@ def deliveries_summary(request, patient_pk=None):
     '''
     
     user = request.user
+    patient_pk, error = await summary_patient_pk(user, patient_pk)
+    if error:
+        return error
 
-    if getattr(user, 'role', None) == 'patient':
-        from patients.models import Patient as PatientModel
-        try:
-            patient_obj = PatientModel.objects.get(user=user)
-        except PatientModel.DoesNotExist:
-            return Response({'detail': 'Patient record not found.'}, status=status.HTTP_404_NOT_FOUND)
-        
-        # if a different patient_pk was requested, forbid
-        if patient_pk is not None and int(patient_pk) != patient_obj.id:
-            return Response({'detail': 'Forbidden.'}, status=status.HTTP_403_FORBIDDEN)
-        
-        # scope to the authenticated patient
-        patient_pk = patient_obj.id
-    
-    # For non-patient users, we allow any scope but still enforce role-based access control
-    elif getattr(user, 'role', None) not in ['doctor', 'nurse', 'admin']:
-        return Response({'detail': 'Forbidden.'}, status=status.HTTP_403_FORBIDDEN)
-
-    qs = _build_delivery_queryset(request, {'patient_pk': patient_pk})
-    total = qs.count()
-    by_mode = {item['delivery_mode']: item['count'] for item in qs.values('delivery_mode').annotate(count=Count('id'))}
-    avg_birth_weight = qs.aggregate(avg_bw=Avg('birth_weight_g'))['avg_bw']
-    alive_counts = qs.values('alive').annotate(count=Count('id'))
-    alive_summary = {item['alive']: item['count'] for item in alive_counts}
-
-    monthly_qs = qs.annotate(month=TruncMonth('delivery_date')).values('month').annotate(count=Count('id')).order_by('month')
-    monthly = []
-    for m in monthly_qs:
-        month_val = m.get('month')
-        if month_val is None:
-            month_str = None
-        elif hasattr(month_val, 'date'):
-            month_str = month_val.date().isoformat()
-        elif hasattr(month_val, 'isoformat'):
-            month_str = month_val.isoformat()
-        else:
-            month_str = str(month_val)
-        monthly.append({'month': month_str, 'count': m['count']})
-
-    data = {
-        'total_deliveries': total,
-        'by_mode': by_mode,
-        'average_birth_weight_g': avg_birth_weight,
-        'alive_counts': alive_summary,
-        'monthly_deliveries': monthly,
-    }
+    # Read the precomputed rollup buckets for this scope instead of scanning the deliveries table,
+    # cached per scope and role until a delivery in the scope changes
+    scope, scope_id = ('patient', int(patient_pk)) if patient_pk else ('global', 0)
 
-    return Response(data)
+    async def build():
+        return delivery_summary_data(await aread_rollup(DELIVERY_ROLLUP, scope, scope_id))
 
+    return await asummary_response(DELIVERY_ROLLUP.metric, scope, scope_id, user.role, build)
@@ -0,0 +1,44 @@
+from asgiref.sync import sync_to_async
+
+from .models import Patient
+
+
+'''
+
+The caller's own patient id, which role-scoped querysets and object
+permissions compare against instead of joining through patients_patient
+to the user. It is resolved at most once per request and kept on
+request.user: JWT access tokens carry it as a claim, token
+authentication loads the Patient along with the user, and otherwise
+(session logins, background jobs) it is looked up on first use.
+
+'''
+
+# The reverse one-to-one from a user to its Patient (user.patient)
+_USER_PATIENT = Patient._meta.get_field('user').remote_field
+
+
+def get_patient_id(user):
+    """
+    Id of the Patient record of a patient user, or None for other roles and for patients without one.
+
+    Every queryset a patient may read is scoped with filter(patient_id=get_patient_id(user)).
+    """
+    if getattr(user, 'role', None) != 'patient':
+        return None
+    if 'patient_id' in user.__dict__:  # a JWT claim, or resolved earlier in this request
+        return user.patient_id
+
+    if _USER_PATIENT.is_cached(user):
+        patient = _USER_PATIENT.get_cached_value(user)
+        patient_id = patient.pk if patient is not None else None
+    else:
+        patient_id = Patient.objects.filter(user_id=user.pk).values_list('id', flat=True).first()
+    user.patient_id = patient_id
+    return patient_id
+
+
+async def aget_patient_id(user):
+    if getattr(user, 'role', None) != 'patient' or 'patient_id' in user.__dict__ or _USER_PATIENT.is_cached(user):
+        return get_patient_id(user)
+    return await sync_to_async(get_patient_id)(user)
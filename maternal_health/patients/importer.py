@@ -0,0 +1,172 @@
+import csv
+import json
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.db import transaction
+from django.utils.text import slugify
+from rest_framework import serializers
+
+from users.provisioning import insert_patients, insert_users
+from .models import Patient
+from .serializers import PatientProfileSerializer
+
+User = get_user_model()
+
+
+'''
+
+Bulk import of existing patient registers. Rows are read one at a time
+from a CSV (with a header row) or NDJSON stream and validated in chunks
+of `batch_size` with PatientProfileSerializer's rules. Rows whose
+medical record number or national id is already registered (or appeared
+earlier in the file) are skipped. Each chunk's users and patients are
+inserted with bulk_create in one transaction, after which the
+checkpoint callback gets the number of the last row handled. A stopped
+import restarts from there, and re-importing rows that made it in
+only skips them as duplicates. Imported users get unusable passwords
+(no password hashing per row) and set one through a password reset.
+
+'''
+
+IMPORT_BATCH_SIZE = 1000
+
+# File extension -> format
+IMPORT_FORMATS = {'csv': 'csv', 'ndjson': 'ndjson', 'jsonl': 'ndjson'}
+
+# Row errors kept in the import summary; the rest are only counted
+IMPORT_MAX_ERRORS = 100
+
+# Values per IN (...) lookup, below SQLite's bound parameter limit
+_LOOKUP_CHUNK = 500
+
+# Patient columns a register may leave empty
+_OPTIONAL_TEXT_FIELDS = ('address', 'marital_status', 'educational_level', 'occupation', 'communication_language', 'phone_number')
+
+
+# PatientProfileSerializer with the user's username and email writable. The unique validators on
+# medical_record_number and national_id are dropped: they query once per row, and the importer checks both
+# against the keys it loaded up front instead.
+class PatientImportSerializer(PatientProfileSerializer):
+    username = serializers.CharField(max_length=150, required=False, validators=[UnicodeUsernameValidator()])
+    email = serializers.EmailField(required=False, allow_blank=True, default='')
+
+    class Meta(PatientProfileSerializer.Meta):
+        fields = [name for name in PatientProfileSerializer.Meta.fields if name not in ('id', 'role', 'age')]
+        read_only_fields = []
+        extra_kwargs = {
+            'medical_record_number': {'validators': []},
+            'national_id': {'validators': []},
+            **{name: {'required': False, 'allow_blank': True, 'default': ''} for name in _OPTIONAL_TEXT_FIELDS},
+        }
+
+
+def import_format(filename):
+    """The import format of a file by its extension, or None if it is not CSV or NDJSON."""
+    return IMPORT_FORMATS.get(filename.rsplit('.', 1)[-1].lower()) if '.' in filename else None
+
+
+def read_rows(stream, file_format):
+    """
+    Yield the rows of a text stream in `file_format` as dicts, one line at a time.
+
+    Empty CSV cells are left out, so optional columns may be blank. An NDJSON line that is not
+    a JSON object is yielded as is and fails validation.
+    """
+    if file_format == 'csv':
+        for row in csv.DictReader(stream):
+            yield {name: value for name, value in row.items() if value not in ('', None)}
+        return
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield line
+
+
+def _existing_keys():
+    """Medical record numbers and national ids already registered, loaded once per import."""
+    keys = {'medical_record_number': set(), 'national_id': set()}
+    for mrn, national_id in Patient.objects.values_list('medical_record_number', 'national_id').iterator(chunk_size=10000):
+        keys['medical_record_number'].add(mrn)
+        keys['national_id'].add(national_id)
+    return keys
+
+
+def _taken_usernames(usernames):
+    taken = set()
+    usernames = list(usernames)
+    for start in range(0, len(usernames), _LOOKUP_CHUNK):
+        taken.update(User.objects.filter(username__in=usernames[start:start + _LOOKUP_CHUNK]).values_list('username', flat=True))
+    return taken
+
+
+def import_patients(rows, batch_size=IMPORT_BATCH_SIZE, start=0, checkpoint=None):
+    """
+    Import `rows` (from read_rows()) as patient users with their Patient profiles.
+
+    Rows are numbered from 1; the first `start` rows are skipped, as when resuming. After each chunk
+    is committed, `checkpoint(row)` is called with the number of the last row handled. Returns a summary:
+    {'rows', 'imported', 'skipped', 'failed', 'errors': [{'row', 'errors'}, ...], 'last_row'}.
+    """
+    keys = _existing_keys()
+    summary = {'rows': 0, 'imported': 0, 'skipped': 0, 'failed': 0, 'errors': [], 'last_row': start}
+    item_serializer = PatientImportSerializer()
+
+    numbered = islice(enumerate(rows, start=1), start, None)
+    while True:
+        chunk = list(islice(numbered, batch_size))
+        if not chunk:
+            break
+        _import_chunk(chunk, item_serializer, keys, summary)
+        summary['last_row'] = chunk[-1][0]
+        if checkpoint is not None:
+            checkpoint(summary['last_row'])
+    return summary
+
+
+def _fail(summary, number, errors):
+    summary['failed'] += 1
+    if len(summary['errors']) < IMPORT_MAX_ERRORS:
+        summary['errors'].append({'row': number, 'errors': errors})
+
+
+def _import_chunk(chunk, item_serializer, keys, summary):
+    valid = []
+    for number, row in chunk:
+        summary['rows'] += 1
+        try:
+            data = item_serializer.run_validation(row)
+        except serializers.ValidationError as exc:
+            _fail(summary, number, exc.detail)
+            continue
+        data.setdefault('username', f"mrn-{slugify(data['medical_record_number'])}")
+        valid.append((number, data))
+
+    taken = _taken_usernames({data['username'] for _, data in valid})
+    users, patients = [], []
+    for number, data in valid:
+        if data['medical_record_number'] in keys['medical_record_number'] or data['national_id'] in keys['national_id']:
+            summary['skipped'] += 1  # already registered, or a duplicate within the file
+            continue
+        if data['username'] in taken:
+            _fail(summary, number, {'username': ['Username is already taken.']})
+            continue
+        keys['medical_record_number'].add(data['medical_record_number'])
+        keys['national_id'].add(data['national_id'])
+        taken.add(data['username'])
+
+        user = User(
+            username=data.pop('username'), email=data.pop('email'), role='patient',
+            first_name=data['first_name'], last_name=data['last_name'], password=make_password(None),
+        )
+        users.append(user)
+        patients.append(Patient(user=user, **data))
+
+    with transaction.atomic():
+        insert_users(users)
+        insert_patients(patients)
+    summary['imported'] += len(users)
@@ -0,0 +1,55 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from patients.importer import IMPORT_BATCH_SIZE, IMPORT_FORMATS, import_format, import_patients, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Import an existing patient register from a CSV (header row) or NDJSON file. Progress is checkpointed '
+        'after every batch, so an interrupted import picks up where it stopped when run again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(set(IMPORT_FORMATS.values())), help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: <path>.checkpoint).')
+        parser.add_argument('--restart', action='store_true', help='Ignore any checkpoint and start from the first row.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or import_format(path)
+        if file_format is None:
+            raise CommandError('Cannot tell the format from the file name; pass --format csv or --format ndjson.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        start = 0
+        if not options['restart'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as stream:
+                start = int(stream.read().strip() or 0)
+            self.stdout.write(f'Resuming after row {start}')
+
+        def checkpoint(row):
+            partial = f'{checkpoint_path}.part'
+            with open(partial, 'w') as stream:
+                stream.write(str(row))
+            os.replace(partial, checkpoint_path)
+            self.stdout.write(f'  rows 1-{row} done')
+
+        try:
+            with open(path, newline='', encoding='utf-8-sig') as stream:
+                summary = import_patients(read_rows(stream, file_format), batch_size=options['batch_size'], start=start, checkpoint=checkpoint)
+        except OSError as exc:
+            raise CommandError(f'Cannot read {path}: {exc}')
+
+        for error in summary['errors']:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['imported']} patients, skipped {summary['skipped']} already registered, {summary['failed']} rows failed"
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from patients.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Re-index every patient in the patient search index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(options['database'])
+        if backend is None:
+            raise CommandError('No patient search index is available for this database; search uses icontains.')
+        indexed = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} patients'))
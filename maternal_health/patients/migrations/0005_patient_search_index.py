@@ -0,0 +1,45 @@
+from django.db import migrations
+
+
+# The FTS5 search index only exists on SQLite builds that include FTS5; other databases
+# use the backend configured in PATIENT_SEARCH_BACKEND or fall back to icontains search.
+# The DDL and the initial fill are spelled out here rather than taken from patients.search,
+# so this migration keeps doing the same thing whatever that module later becomes.
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        if not any(option == 'ENABLE_FTS5' for (option,) in cursor.fetchall()):
+            return
+
+    Patient = apps.get_model('patients', 'Patient')
+    patients = Patient._meta.db_table
+    users = Patient._meta.get_field('user').related_model._meta.db_table
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS patients_patient_fts USING '
+        "fts5(first_name, last_name, national_id, phone_number, email, tokenize='unicode61', prefix='2 3')"
+    )
+    schema_editor.execute(
+        'INSERT INTO patients_patient_fts (rowid, first_name, last_name, national_id, phone_number, email) '
+        f'SELECT p.id, p.first_name, p.last_name, p.national_id, p.phone_number, u.email '
+        f'FROM {patients} p JOIN {users} u ON u.id = p.user_id'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS patients_patient_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0004_alter_patient_medical_record_number_and_more'),
+        ('users', '0003_remove_customuser_address_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,5 +1,7 @@
 from rest_framework import permissions
 
+from .identity import get_patient_id
+
 
 # Custom permissions for patient profiles and clinician/admin access to sensitive data, ensuring that patients can only view their own profiles while clinicians and admins have broader access for care management and oversight.
 class PatientProfilePermission(permissions.BasePermission):
@@ -16,7 +18,7 @@ class PatientProfilePermission(permissions.BasePermission):
 
         if user.role == 'patient':
             if request.method in permissions.SAFE_METHODS:  # GET, HEAD, OPTIONS
-                return obj.user == user
+                return obj.pk == get_patient_id(user)
             return False  # block create, update, delete
 
         if user.role in ['doctor', 'nurse', 'admin']:
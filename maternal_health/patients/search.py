@@ -0,0 +1,163 @@
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, IntegerField, When
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+from .models import Patient
+
+
+# Fields copied into the search index, in index column order. email lives on the linked user.
+PATIENT_SEARCH_FIELDS = ['first_name', 'last_name', 'national_id', 'phone_number']
+USER_SEARCH_FIELDS = ['email']
+
+# Reception lookups only need the best matches; more specific terms narrow the list
+PATIENT_SEARCH_LIMIT = 500
+
+
+def search_tokens(term):
+    return re.findall(r'\w+', term.lower())
+
+
+class PatientSearchBackend:
+    """
+    Interface for patient search indexes.
+
+    Set PATIENT_SEARCH_BACKEND to the dotted path of a subclass to plug in another engine.
+    """
+
+    def __init__(self, using='default'):
+        self.using = using
+
+    def index(self, patient_ids):
+        """Copy the current values of these patients into the index."""
+        raise NotImplementedError
+
+    def remove(self, patient_ids):
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Re-index every patient. Returns the number of patients indexed."""
+        raise NotImplementedError
+
+    def search(self, term, limit=PATIENT_SEARCH_LIMIT):
+        """Ids of the patients matching every token of `term` as a prefix, best match first."""
+        raise NotImplementedError
+
+
+class SQLiteFTSBackend(PatientSearchBackend):
+    """
+    FTS5 shadow table keyed by patient id.
+
+    Every token of the search term must match the start of a token in one of the
+    indexed columns; results are ranked with bm25, weighting identifiers above names.
+    """
+
+    table = 'patients_patient_fts'
+    # bm25 column weights: first_name, last_name, national_id, phone_number, email
+    weights = (2.0, 3.0, 5.0, 5.0, 1.0)
+
+    @classmethod
+    def create_table_sql(cls):
+        columns = ', '.join(PATIENT_SEARCH_FIELDS + USER_SEARCH_FIELDS)
+        return f"CREATE VIRTUAL TABLE IF NOT EXISTS {cls.table} USING fts5({columns}, tokenize='unicode61', prefix='2 3')"
+
+    @classmethod
+    def drop_table_sql(cls):
+        return f'DROP TABLE IF EXISTS {cls.table}'
+
+    def _source_sql(self, where=''):
+        patients = Patient._meta.db_table
+        users = Patient._meta.get_field('user').related_model._meta.db_table
+        columns = ', '.join([f'p.{name}' for name in PATIENT_SEARCH_FIELDS] + [f'u.{name}' for name in USER_SEARCH_FIELDS])
+        return f'SELECT p.id, {columns} FROM {patients} p JOIN {users} u ON u.id = p.user_id {where}'
+
+    def _insert_sql(self):
+        columns = ', '.join(PATIENT_SEARCH_FIELDS + USER_SEARCH_FIELDS)
+        return f'INSERT INTO {self.table} (rowid, {columns}) '
+
+    def index(self, patient_ids):
+        patient_ids = list(patient_ids)
+        if not patient_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(patient_ids))
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', patient_ids)
+            cursor.execute(self._insert_sql() + self._source_sql(f'WHERE p.id IN ({placeholders})'), patient_ids)
+
+    def remove(self, patient_ids):
+        patient_ids = list(patient_ids)
+        if not patient_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(patient_ids))
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', patient_ids)
+
+    def rebuild(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(self._insert_sql() + self._source_sql())
+            cursor.execute(f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')")
+            cursor.execute(f'SELECT count(*) FROM {self.table}')
+            return cursor.fetchone()[0]
+
+    def search(self, term, limit=PATIENT_SEARCH_LIMIT):
+        tokens = search_tokens(term)
+        if not tokens:
+            return []
+        query = ' '.join(f'"{token}"*' for token in tokens)
+        weights = ', '.join(str(weight) for weight in self.weights)
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+                f'ORDER BY bm25({self.table}, {weights}), rowid LIMIT %s',
+                [query, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+# FTS5 support is a property of the SQLite library, so it is checked once per connection alias
+_fts5_support = {}
+
+
+def fts5_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    if connection.alias not in _fts5_support:
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            _fts5_support[connection.alias] = any(option == 'ENABLE_FTS5' for (option,) in cursor.fetchall())
+    return _fts5_support[connection.alias]
+
+
+def get_search_backend(using='default'):
+    """The configured search backend, or None when patient search should fall back to icontains."""
+    path = getattr(settings, 'PATIENT_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)(using=using)
+    if fts5_available(connections[using]):
+        return SQLiteFTSBackend(using=using)
+    return None
+
+
+class PatientSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter that looks patients up in the search index instead of OR-ing icontains
+    over search_fields. Results are ranked best match first unless the client asks for an
+    explicit ordering, so this filter must run after OrderingFilter.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '')
+        backend = get_search_backend(queryset.db) if term.strip() else None
+        if backend is None:
+            return super().filter_queryset(request, queryset, view)
+
+        ids = backend.search(term)
+        queryset = queryset.filter(pk__in=ids)
+        if request.query_params.get(filters.OrderingFilter.ordering_param):
+            return queryset
+        rank = Case(*[When(pk=pk, then=position) for position, pk in enumerate(ids)], output_field=IntegerField())
+        return queryset.order_by(rank) if ids else queryset
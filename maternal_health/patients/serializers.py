@@ -1,6 +1,9 @@
 from rest_framework import serializers
 from .models import Patient
 from datetime import date
+from deliveries.serializers import DeliverySerializer
+from pregnancies.serializers import PregnancySerializer
+from visits.serializers import PostnatalVisitSerializer, PrenatalVisitSerializer, VisitSerializer
 
 
 # Serializer for Patient model, including all fields and read-only audit fields to ensure data integrity and proper tracking of changes.
@@ -44,3 +47,22 @@ class PatientProfileSerializer(serializers.ModelSerializer):
             if data['parity'] > data['gravidity']:
                 raise serializers.ValidationError("Parity cannot exceed gravidity.")
         return data
+
+
+# Read-only serializers for the patient timeline: the whole obstetric history of one patient in one response.
+# They read the lists that PatientProfileViewSet prefetches into the timeline_* attributes.
+class TimelineDeliverySerializer(DeliverySerializer):
+    visits = PostnatalVisitSerializer(source='timeline_visits', many=True, read_only=True)
+
+
+class TimelinePregnancySerializer(PregnancySerializer):
+    visits = PrenatalVisitSerializer(source='timeline_visits', many=True, read_only=True)
+    deliveries = TimelineDeliverySerializer(source='timeline_deliveries', many=True, read_only=True)
+
+
+class PatientTimelineSerializer(PatientProfileSerializer):
+    pregnancies = TimelinePregnancySerializer(source='timeline_pregnancies', many=True, read_only=True)
+    general_visits = VisitSerializer(source='timeline_general_visits', many=True, read_only=True)
+
+    class Meta(PatientProfileSerializer.Meta):
+        fields = PatientProfileSerializer.Meta.fields + ['pregnancies', 'general_visits']
@@ -1,8 +1,9 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
 from uuid import uuid4
 from .models import Patient
+from .search import PATIENT_SEARCH_FIELDS, USER_SEARCH_FIELDS, get_search_backend
 
 '''
 
@@ -11,37 +12,100 @@ role 'patient' is created or updated. This ensures that every patient
 user has a corresponding Patient profile, even if the user data is 
 sparse at creation time. It also handles the case where a user's role 
 changes to or from 'patient' to maintain data integrity in the patient 
-list.
+list. Saves that leave the role as it was (profile edits, the
+last_login update on every login) do not touch Patient.
 
 '''
+
+# Role of a user whose stored role is not known, e.g. when `role` was deferred
+_UNKNOWN_ROLE = object()
+
+
+def patient_defaults(user, **fields):
+    """
+    Field values for a new Patient of `user`, with generated unique identifiers.
+
+    The medical record number and national id are generated so the profile can be created
+    even if upstream user data is sparse; `fields` override any of the values.
+    """
+    suffix = uuid4().hex
+    defaults = {
+        'first_name': getattr(user, 'first_name', '') or '',
+        'last_name': getattr(user, 'last_name', '') or '',
+        'medical_record_number': f"MRN-{user.username}-{suffix[:8]}",
+        'national_id': f"MHS-{user.username}-{suffix[8:16]}",
+        'phone_number': getattr(user, 'phone_number', '') or '',
+        'date_of_birth': getattr(user, 'date_of_birth', None),
+        'address': '',
+        'marital_status': '',
+        'educational_level': '',
+        'occupation': '',
+        'gravidity': 0,
+        'parity': 0,
+        'communication_language': '',
+    }
+    defaults.update(fields)
+    return defaults
+
+
+# Remember the role each user was loaded with, so the signal below can tell whether a save changed it
+@receiver(post_init, sender=settings.AUTH_USER_MODEL)
+def remember_saved_role(sender, instance, **kwargs):
+    instance._saved_role = instance.__dict__.get('role', _UNKNOWN_ROLE)
+
+
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
-def create_patient_for_new_user(sender, instance, created,  **kwargs):
+def create_patient_for_new_user(sender, instance, created, update_fields=None, **kwargs):
     """
-    Auto-create a Patient profile when a new user with role 'patient' is created .
+    Create the Patient profile of a new patient user, and create or remove it when a user's role changes.
 
-    We use get_or_create with generated unique identifiers for required unique
-    fields so the profile can be created even if upstream user data is sparse.
+    Users created in bulk (users.provisioning) get their profiles there, as bulk_create sends no signals.
     """
+    if update_fields is not None and 'role' not in update_fields:
+        return
     role = getattr(instance, 'role', None)
-    if role == 'patient':
-        defaults = {
-            'first_name': getattr(instance, 'first_name', '') or '',
-            'last_name': getattr(instance, 'last_name', '') or '',
-            'medical_record_number': f"MRN-{instance.username}-{uuid4().hex[:8]}",
-            'national_id': f"MHS-{instance.username}-{uuid4().hex[:8]}",
-            'phone_number': getattr(instance, 'phone_number', '') or '',
-            'date_of_birth': getattr(instance, 'date_of_birth', None),
-            'address': '',
-            'marital_status': '',
-            'educational_level': '',
-            'occupation': '',
-            'gravidity': 0,
-            'parity': 0,
-            'communication_language': '',
-        }
-
-        Patient.objects.get_or_create(user=instance, defaults=defaults)
+    previous, instance._saved_role = getattr(instance, '_saved_role', _UNKNOWN_ROLE), role
+
+    if created:
+        if role == 'patient':
+            Patient.objects.create(user=instance, **patient_defaults(instance))
+    elif role == previous:
+        return
+    elif role == 'patient':
+        Patient.objects.get_or_create(user=instance, defaults=patient_defaults(instance))
     else:
         # If the user's role is not 'patient', remove any existing Patient profile
         # so the patient list stays accurate when roles are changed.
         Patient.objects.filter(user=instance).delete()
+
+
+# Keep the patient search index in step with the columns it copies from Patient and CustomUser.
+# Saves limited to update_fields outside the indexed columns (e.g. last_login) are skipped.
+def _touches(update_fields, indexed):
+    return update_fields is None or not indexed.isdisjoint(update_fields)
+
+
+@receiver(post_save, sender=Patient)
+def index_patient_for_search(sender, instance, update_fields=None, **kwargs):
+    if not _touches(update_fields, set(PATIENT_SEARCH_FIELDS)):
+        return
+    backend = get_search_backend(kwargs.get('using') or 'default')
+    if backend is not None:
+        backend.index([instance.pk])
+
+
+@receiver(post_delete, sender=Patient)
+def remove_patient_from_search(sender, instance, **kwargs):
+    backend = get_search_backend(kwargs.get('using') or 'default')
+    if backend is not None:
+        backend.remove([instance.pk])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def reindex_patient_user_for_search(sender, instance, created, update_fields=None, **kwargs):
+    # A new user's patient profile is indexed by its own save
+    if created or getattr(instance, 'role', None) != 'patient' or not _touches(update_fields, set(USER_SEARCH_FIELDS)):
+        return
+    backend = get_search_backend(kwargs.get('using') or 'default')
+    if backend is not None:
+        backend.index(Patient.objects.filter(user=instance).values_list('pk', flat=True))
@@ -1,3 +1,351 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import date
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from config.testing import QueryBudgetMixin
+from deliveries.models import Delivery
+from pregnancies.models import Pregnancy
+from visits.models import Visit
+from .identity import get_patient_id
+from .models import Patient
+
+User = get_user_model()
+
+
+class PatientListQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Test that the patient list does not issue queries per patient"""
+
+    def setUp(self):
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+        self.created = 0
+
+    def _make_patients(self, count):
+        # Patient records are created by the user signal
+        for _ in range(count):
+            self.created += 1
+            User.objects.create_user(username=f'patient{self.created}', password='testpass123', role='patient')
+
+    def test_patient_list(self):
+        """Patient list should cost the same for one patient or a full page"""
+        self.assertListQueriesConstant('/api/patients/', self._make_patients, max_queries=2)
+
+
+class PatientSearchTests(TestCase):
+    """Test patient search through the full-text search index"""
+
+    def setUp(self):
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+        self.alice = self._make_patient('alice', 'Alice', 'Uwase', 'NID-1000-77', '+250788000111')
+        self.grace = self._make_patient('grace', 'Grace', 'Uwamahoro', 'NID-2000-88', '+250788000222')
+        self.claudine = self._make_patient('claudine', 'Claudine', 'Mukamana', 'NID-3000-99', '+250722555333')
+
+    def _make_patient(self, username, first_name, last_name, national_id, phone_number):
+        user = User.objects.create_user(username=username, password='testpass123', role='patient', email=f'{username}@clinic.rw')
+        patient = Patient.objects.get(user=user)
+        patient.first_name = first_name
+        patient.last_name = last_name
+        patient.national_id = national_id
+        patient.phone_number = phone_number
+        patient.save()
+        return patient
+
+    def _search(self, term, **params):
+        response = self.client.get('/api/patients/', {'search': term, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_prefix_and_token_matching(self):
+        """Every token should match the start of a word in any indexed column"""
+        self.assertEqual(set(self._search('uwa')), {self.alice.id, self.grace.id})
+        self.assertEqual(self._search('alice uwa'), [self.alice.id])
+        self.assertEqual(self._search('250722'), [self.claudine.id])
+        self.assertEqual(self._search('3000'), [self.claudine.id])
+        self.assertEqual(self._search('nobody'), [])
+
+    def test_identifier_match_ranks_first(self):
+        """A national id match should rank above a weaker name match unless an ordering is requested"""
+        self.grace.first_name = 'Mukamana'
+        self.grace.save()
+
+        self.assertEqual(self._search('mukamana'), [self.claudine.id, self.grace.id])
+        self.assertEqual(self._search('mukamana', ordering='first_name'), [self.claudine.id, self.grace.id])
+        self.assertEqual(self._search('mukamana', ordering='-first_name'), [self.grace.id, self.claudine.id])
+
+    def test_index_follows_user_and_patient_changes(self):
+        """Email changes, profile edits and deletions should be reflected in search results"""
+        user = self.alice.user
+        user.email = 'a.uwase@district.rw'
+        user.save()
+        self.assertEqual(self._search('district'), [self.alice.id])
+        self.assertEqual(self._search('alice@clinic'), [])
+
+        self.grace.last_name = 'Ingabire'
+        self.grace.save(update_fields=['last_name'])
+        self.assertEqual(self._search('ingabire'), [self.grace.id])
+
+        self.claudine.delete()
+        self.assertEqual(self._search('claudine'), [])
+
+    def test_patient_only_finds_own_profile(self):
+        """Search should not let a patient see other patients"""
+        self.client.force_authenticate(user=self.alice.user)
+        self.assertEqual(self._search('uwa'), [self.alice.id])
+
+
+class PatientTimelineTests(TestCase):
+    """Test the patient timeline endpoint"""
+
+    def setUp(self):
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+        self.url = f'/api/patients/{self.patient.id}/timeline/'
+
+    def _add_pregnancy(self, lmp):
+        pregnancy = Pregnancy.objects.create(patient=self.patient, gestational_age_weeks=38, last_menstrual_period=lmp)
+        self._add_visit(pregnancy=pregnancy, visit_type='Antenatal')
+        delivery = Delivery.objects.create(
+            pregnancy=pregnancy, delivery_mode='vaginal', birth_weight_g=3200, place_of_delivery='Kigali',
+            skilled_birth_attendant=True, newborn_gender='Female', apgar_score_1min=8, apgar_score_5min=9,
+        )
+        self._add_visit(delivery=delivery, visit_type='Postnatal')
+        return pregnancy
+
+    def _add_visit(self, **kwargs):
+        return Visit.objects.create(
+            patient=self.patient, provider=self.doctor_user, blood_pressure='120/80', heart_rate=80, **kwargs,
+        )
+
+    def test_timeline_nests_history_in_time_order(self):
+        """Pregnancies should come oldest first with their visits and deliveries nested"""
+        later = self._add_pregnancy(date(2024, 1, 1))
+        earlier = self._add_pregnancy(date(2021, 5, 1))
+        general = self._add_visit(visit_type='General')
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual([pregnancy['id'] for pregnancy in data['pregnancies']], [earlier.id, later.id])
+        first = data['pregnancies'][0]
+        self.assertEqual([visit['visit_type'] for visit in first['visits']], ['Antenatal'])
+        self.assertEqual(len(first['deliveries']), 1)
+        self.assertEqual([visit['visit_type'] for visit in first['deliveries'][0]['visits']], ['Postnatal'])
+        self.assertEqual([visit['id'] for visit in data['general_visits']], [general.id])
+
+    def test_timeline_query_count_does_not_grow_with_history(self):
+        """Every level of the history should be loaded by one prefetch query"""
+        self._add_pregnancy(date(2021, 5, 1))
+        self._add_visit(visit_type='General')
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url)
+
+        for year in (2022, 2023, 2024):
+            self._add_pregnancy(date(year, 1, 1))
+            self._add_visit(visit_type='General')
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(self.url)
+
+        self.assertEqual(len(small), len(large))
+        self.assertLessEqual(len(large), 6)
+
+    def test_conditional_get(self):
+        """A matching If-None-Match should give 304 until the history changes"""
+        self._add_pregnancy(date(2024, 1, 1))
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        self._add_visit(visit_type='General')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_patients_only_see_their_own_timeline(self):
+        """A patient should get their own timeline and 404 for anyone else's"""
+        other_user = User.objects.create_user(username='patient2', password='testpass123', role='patient')
+        other = Patient.objects.get(user=other_user)
+        self.client.force_authenticate(user=self.patient_user)
+
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(f'/api/patients/{other.id}/timeline/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PatientIdentityTests(TestCase):
+    """Test that patient-scoped endpoints resolve the caller's patient id without joining to the user"""
+
+    def setUp(self):
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        self.pregnancy = Pregnancy.objects.create(patient=self.patient, gestational_age_weeks=20)
+        other_user = User.objects.create_user(username='patient2', password='testpass123', role='patient')
+        Pregnancy.objects.create(patient=Patient.objects.get(user=other_user), gestational_age_weeks=30)
+        self.client = APIClient()
+
+    def test_get_patient_id(self):
+        """get_patient_id should look the record up once and return None for clinicians"""
+        user = User.objects.get(pk=self.patient_user.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_patient_id(user), self.patient.pk)
+            self.assertEqual(get_patient_id(user), self.patient.pk)
+        doctor = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_patient_id(doctor))
+
+    def test_token_authentication_loads_patient(self):
+        """Token authentication should load the patient with the token and scope by patient_id"""
+        token = Token.objects.create(user=self.patient_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/pregnancies/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['results']], [self.pregnancy.id])
+        self.assertEqual(len(queries), 3)  # token with user and patient, count, page
+        for query in queries[1:]:
+            self.assertIn(f'"pregnancies_pregnancy"."patient_id" = {self.patient.pk}', query['sql'])
+            self.assertNotIn('patients_patient', query['sql'])
+
+
+class PatientProfileSignalTests(TestCase):
+    """Test that user saves only touch the Patient profile when the role changes"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+
+    def test_login_does_not_touch_patient(self):
+        """Logging in saves last_login and should not query the patient table"""
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.client.login(username='patient1', password='testpass123'))
+        self.assertFalse([query['sql'] for query in queries if 'patients_patient' in query['sql']])
+
+    def test_save_without_role_change_does_not_touch_patient(self):
+        """Profile edits of a loaded user should leave Patient alone"""
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = 'Alice'
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        # The search index may be refreshed, but the profile is neither loaded, created nor deleted
+        profile_queries = [
+            query['sql'] for query in queries
+            if '"patients_patient"."medical_record_number"' in query['sql'] or query['sql'].startswith(('INSERT INTO "patients_patient"', 'DELETE FROM "patients_patient"'))
+        ]
+        self.assertFalse(profile_queries)
+
+    def test_role_change_creates_and_removes_patient(self):
+        """Changing the role away from and back to patient should remove and recreate the profile"""
+        user = User.objects.get(pk=self.user.pk)
+        user.role = 'nurse'
+        user.save()
+        self.assertFalse(Patient.objects.filter(user=user).exists())
+
+        user = User.objects.get(pk=self.user.pk)
+        user.role = 'patient'
+        user.save(update_fields=['role'])
+        self.assertTrue(Patient.objects.filter(user=user).exists())
+
+
+class PatientImportTests(TestCase):
+    """Test bulk patient import from CSV and NDJSON registers"""
+
+    HEADER = 'first_name,last_name,medical_record_number,national_id,date_of_birth,gravidity,parity,phone_number\n'
+
+    def setUp(self):
+        existing = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.existing = Patient.objects.get(user=existing)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as stream:
+            stream.write(content)
+        return path
+
+    def register(self):
+        return self.write('register.csv', self.HEADER + (
+            'Alice,Uwase,MRN-001,NID-001,1995-04-02,2,1,+250788000001\n'
+            'Grace,Mutesi,MRN-002,NID-002,,,,\n'
+            f'Odette,Uwera,MRN-003,{self.existing.national_id},,,,\n'  # already registered
+            'Jeanne,Umutoni,MRN-004,NID-004,,1,3,\n'  # parity above gravidity
+            'Diane,Akimana,MRN-005,NID-005,,,,\n'
+            'Diane,Akimana,MRN-005,NID-005,,,,\n'  # repeated in the file
+        ))
+
+    def test_import_command(self):
+        """Valid rows should be imported in batches and duplicates and invalid rows reported"""
+        path = self.register()
+        stdout, stderr = StringIO(), StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_patients', path, batch_size=2, stdout=stdout, stderr=stderr)
+
+        self.assertIn('Imported 3 patients, skipped 2 already registered, 1 rows failed', stdout.getvalue())
+        self.assertIn('Row 4', stderr.getvalue())
+        alice = Patient.objects.select_related('user').get(medical_record_number='MRN-001')
+        self.assertEqual((alice.first_name, alice.gravidity, alice.phone_number), ('Alice', 2, '+250788000001'))
+        self.assertEqual((alice.user.username, alice.user.role), ('mrn-mrn-001', 'patient'))
+        self.assertFalse(alice.user.has_usable_password())
+        self.assertEqual(Patient.objects.filter(medical_record_number='MRN-005').count(), 1)
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+        # One user insert per batch of two rows, not one per row; the batch of rows 3-4 adds nobody
+        inserts = [query['sql'] for query in queries if query['sql'].startswith('INSERT INTO "users_customuser"')]
+        self.assertEqual(len(inserts), 2)
+
+        # Imported patients are searchable like any other
+        doctor = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        client = APIClient()
+        client.force_authenticate(user=doctor)
+        response = client.get('/api/patients/?search=akimana')
+        self.assertEqual([item['medical_record_number'] for item in response.data['results']], ['MRN-005'])
+
+    def test_import_resumes_from_checkpoint(self):
+        """An interrupted import should continue after the row in its checkpoint"""
+        path = self.register()
+        self.write('register.csv.checkpoint', '2')
+        stdout = StringIO()
+        call_command('import_patients', path, batch_size=2, stdout=stdout, stderr=StringIO())
+
+        self.assertIn('Resuming after row 2', stdout.getvalue())
+        self.assertFalse(Patient.objects.filter(medical_record_number__in=['MRN-001', 'MRN-002']).exists())
+        self.assertTrue(Patient.objects.filter(medical_record_number='MRN-005').exists())
+
+    def test_upload_endpoint(self):
+        """Admins should be able to upload an NDJSON register; other roles may not"""
+        rows = [
+            {'first_name': 'Alice', 'last_name': 'Uwase', 'medical_record_number': 'MRN-001', 'national_id': 'NID-001', 'username': 'alice'},
+            {'first_name': 'Grace', 'last_name': 'Mutesi', 'medical_record_number': 'MRN-002'},
+        ]
+        content = '\n'.join(json.dumps(row) for row in rows).encode()
+        client = APIClient()
+
+        client.force_authenticate(user=User.objects.create_user(username='doctor1', password='testpass123', role='doctor'))
+        response = client.post('/api/patients/import/', {'file': SimpleUploadedFile('register.ndjson', content)}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
-# Create your tests here.
+        client.force_authenticate(user=User.objects.create_user(username='admin1', password='testpass123', role='admin'))
+        response = client.post('/api/patients/import/', {'file': SimpleUploadedFile('register.ndjson', content)}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual((response.data['imported'], response.data['failed'], response.data['last_row']), (1, 1, 2))
+        self.assertEqual(response.data['errors'][0]['row'], 2)
+        self.assertIn('national_id', response.data['errors'][0]['errors'])
+        self.assertTrue(Patient.objects.filter(user__username='alice', national_id='NID-001').exists())
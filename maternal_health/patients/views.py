@@ -1,10 +1,44 @@
+import io
+from datetime import date
+from hashlib import md5
+
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
+from django.db.models import Exists, OuterRef, Prefetch
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from .identity import get_patient_id
+from .importer import import_format, import_patients, read_rows
 from .models import Patient
-from .serializers import PatientProfileSerializer
-from rest_framework import permissions, viewsets, filters
+from .serializers import PatientProfileSerializer, PatientTimelineSerializer
+from rest_framework import permissions, status, viewsets, filters
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from .permissions import PatientProfilePermission
+from .search import PatientSearchFilter
 from rest_framework.response import Response
+from deliveries.models import Delivery
+from users.permissions import IsAdminRole
+from pregnancies.archive import timeline_pregnancies
+from pregnancies.models import ArchivedPregnancy, Pregnancy
+from visits.models import Visit
+
+
+# Prefetches behind the timeline: one query each for pregnancies, their visits, their deliveries,
+# the deliveries' visits and the visits outside any pregnancy, however long the history is.
+def timeline_prefetches():
+    visits = Visit.objects.select_related('patient__user').order_by('visit_date', 'id')
+    deliveries = Delivery.objects.order_by('delivery_date', 'id').prefetch_related(
+        Prefetch('visit_set', queryset=visits, to_attr='timeline_visits'),
+    )
+    pregnancies = Pregnancy.objects.select_related('created_by', 'updated_by').order_by('expected_delivery_date', 'id').prefetch_related(
+        Prefetch('visit_set', queryset=visits.filter(delivery__isnull=True), to_attr='timeline_visits'),
+        Prefetch('delivery_set', queryset=deliveries, to_attr='timeline_deliveries'),
+    )
+    return [
+        Prefetch('pregnancy_set', queryset=pregnancies, to_attr='timeline_pregnancies'),
+        Prefetch('visit_set', queryset=visits.filter(pregnancy__isnull=True, delivery__isnull=True), to_attr='timeline_general_visits'),
+    ]
 
 
 # PatientProfileViewSet with role-based access control, filtering/searching, and automatic setting of audit fields to ensure data integrity and proper tracking of changes.
@@ -13,12 +47,13 @@ class PatientProfileViewSet(viewsets.ModelViewSet):
     serializer_class = PatientProfileSerializer
     permission_classes = [permissions.IsAuthenticated, PatientProfilePermission]
 
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    # Search runs after ordering so it can rank matches when no ordering is requested
+    filter_backends = [filters.OrderingFilter, PatientSearchFilter]
 
     # Exact filters (must be real model fields)
     filterset_fields = ['date_of_birth']
 
-    # Search across text fields
+    # Search across text fields (through the search index when one is available)
     search_fields = ['first_name', 'last_name', 'national_id', 'phone_number', 'user__email']
 
     # Ordering
@@ -28,9 +63,16 @@ class PatientProfileViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        # username, email and role are read from the linked user, so join it instead of loading it per row
+        queryset = Patient.objects.select_related('user')
+        if self.action == 'timeline':
+            # Whether cold storage has to be read is answered by the patient query itself
+            queryset = queryset.prefetch_related(*timeline_prefetches()).annotate(
+                has_archived=Exists(ArchivedPregnancy.objects.filter(patient=OuterRef('pk'))),
+            )
         if user.role == 'patient':
-            return Patient.objects.filter(user=user)  # Patients can only see their own profile
-        return Patient.objects.all()  # Doctors, nurses, and admins can see all profiles
+            return queryset.filter(pk=get_patient_id(user))  # Patients can only see their own profile
+        return queryset  # Doctors, nurses, and admins can see all profiles
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)  # Associate the patient profile with the logged-in user
@@ -41,4 +83,50 @@ class PatientProfileViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'Patients cannot create the profile.'}, status=403)
         return super().create(request, *args, **kwargs)
 
+    # Whole obstetric history in one response: pregnancies with their antenatal visits and deliveries
+    # (each with its postnatal visits), plus general visits, all oldest first.
+    @action(detail=True, methods=['get'])
+    def timeline(self, request, pk=None):
+        patient = self.get_object()
+        if patient.has_archived:
+            # Archived pregnancies are read back from cold storage and take their place in the history
+            patient.timeline_pregnancies = sorted(
+                patient.timeline_pregnancies + timeline_pregnancies(patient),
+                key=lambda pregnancy: (pregnancy.expected_delivery_date is not None, pregnancy.expected_delivery_date or date.min, pregnancy.pk),
+            )
+        data = PatientTimelineSerializer(patient, context=self.get_serializer_context()).data
+
+        # The ETag is a hash of the body, so an unchanged chart is answered with 304 and no payload
+        etag = quote_etag(md5(JSONRenderer().render(data), usedforsecurity=False).hexdigest())
+        response = Response(data, headers={'ETag': etag})
+        patch_cache_control(response, private=True, no_cache=True)
+        return get_conditional_response(request, etag=etag, response=response)
+
+    # Bulk import of an existing register (admins only): a CSV or NDJSON upload in the `file` field, read and
+    # inserted in chunks. Each chunk is committed on its own; pass `start` (a previous response's last_row) to
+    # resume an interrupted import, and rows already imported are skipped as duplicates anyway.
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser],
+            permission_classes=[permissions.IsAuthenticated, IsAdminRole])
+    def import_register(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'detail': 'Upload the register as `file`.'}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = import_format(upload.name)
+        if file_format is None:
+            return Response({'detail': 'The file must be .csv, .ndjson or .jsonl.'}, status=status.HTTP_400_BAD_REQUEST)
+        start = str(request.data.get('start', '0'))
+        if not start.isdigit():
+            return Response({'detail': 'start must be a row number.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            summary = import_patients(read_rows(io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline=''), file_format), start=int(start))
+        except UnicodeDecodeError:
+            return Response({'detail': 'The file must be UTF-8 text.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        if summary['imported'] == summary['rows']:
+            response_status = status.HTTP_201_CREATED
+        elif not summary['imported'] and summary['failed']:
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_207_MULTI_STATUS
+        return Response(summary, status=response_status)
@@ -1,5 +1,9 @@
 from django.apps import AppConfig
 
 
+# PregnanciesConfig with ready() method to import the signal handlers that keep risk scores current.
 class PregnanciesConfig(AppConfig):
     name = 'pregnancies'
+
+    def ready(self):
+        import pregnancies.signals  # noqa: F401
@@ -0,0 +1,273 @@
+import gzip
+import json
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Q, prefetch_related_objects
+from django.http import Http404
+from django.utils import timezone
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+from deliveries.models import Delivery
+from patients.identity import get_patient_id
+from visits.models import Visit
+from .models import ArchivedPregnancy, Pregnancy
+
+
+'''
+
+Cold storage for closed pregnancies. archive_pregnancies moves each
+pregnancy delivered more than ARCHIVE_AFTER_YEARS ago, with its
+deliveries and visits, out of the hot tables into a gzip-compressed
+NDJSON segment per delivery year under ARCHIVE_DIR. Each pregnancy is
+one line compressed as its own gzip member, so it can be read back
+alone: ArchivedPregnancy keeps its segment and byte range.
+
+The nested patient routes and the patient timeline read archived
+records back when they are asked for (read-only), and restore_pregnancy
+moves one back into the hot tables. Archived records leave the summaries
+and exports, like deleted ones; the segments should be backed up with
+the database. Deleting rows only frees pages inside the database file,
+so the archive command then runs vacuum_database to shrink it.
+
+'''
+
+ARCHIVE_AFTER_YEARS = 10
+
+# Pregnancies archived per transaction
+ARCHIVE_BATCH_SIZE = 200
+
+
+def archive_dir():
+    return getattr(settings, 'ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive'))
+
+
+def _encode(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _dump(instance):
+    return {field.attname: _encode(field.value_from_object(instance)) for field in instance._meta.concrete_fields}
+
+
+def _load(model, data):
+    instance = model(**{field.attname: field.to_python(data[field.attname]) for field in model._meta.concrete_fields if field.attname in data})
+    instance._state.adding = False
+    return instance
+
+
+class ArchivedBundle:
+    """An archived pregnancy with its deliveries and visits, as unsaved model instances."""
+
+    def __init__(self, record):
+        self.pregnancy = _load(Pregnancy, record['pregnancy'])
+        self.deliveries = [_load(Delivery, data) for data in record['deliveries']]
+        self.visits = [_load(Visit, data) for data in record['visits']]
+
+    def records(self, model):
+        return {Pregnancy: [self.pregnancy], Delivery: self.deliveries, Visit: self.visits}[model]
+
+
+def archive_cutoff(years=ARCHIVE_AFTER_YEARS, now=None):
+    now = now or timezone.now()
+    try:
+        return now.replace(year=now.year - years)
+    except ValueError:  # 29 February
+        return now.replace(year=now.year - years, day=28)
+
+
+def archive_pregnancies(years=ARCHIVE_AFTER_YEARS, batch_size=ARCHIVE_BATCH_SIZE, now=None):
+    """
+    Archive the pregnancies whose latest delivery is more than `years` years old. Returns the number archived.
+
+    A batch's records are appended to their segments and flushed to disk before the transaction that
+    deletes them from the hot tables commits, so a crash in between leaves only unreferenced bytes
+    behind. Run one archiver at a time, as each appends to the segments unlocked.
+    """
+    candidates = (
+        Pregnancy.objects.filter(is_delivered=True)
+        .annotate(delivered_at=Max('delivery__delivery_date'))
+        .filter(delivered_at__lt=archive_cutoff(years, now))
+        .order_by('pk').values_list('pk', 'delivered_at')
+    )
+    archived = 0
+    last_pk = 0
+    while True:
+        batch = dict(candidates.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return archived
+        last_pk = max(batch)
+        archived += _archive_batch(batch)
+
+
+def _archive_batch(delivered_at):
+    pregnancies = Pregnancy.objects.in_bulk(list(delivered_at))
+    ids = list(pregnancies)
+    deliveries = defaultdict(list)
+    for delivery in Delivery.objects.filter(pregnancy_id__in=ids).order_by('pk'):
+        deliveries[delivery.pregnancy_id].append(delivery)
+    pregnancy_of_delivery = {delivery.pk: pregnancy_id for pregnancy_id, group in deliveries.items() for delivery in group}
+    visits = defaultdict(list)
+    for visit in Visit.objects.filter(Q(pregnancy_id__in=ids) | Q(delivery_id__in=list(pregnancy_of_delivery))).order_by('pk'):
+        visits[visit.pregnancy_id if visit.pregnancy_id in pregnancies else pregnancy_of_delivery[visit.delivery_id]].append(visit)
+
+    # One gzip member per pregnancy, appended to the segment of its delivery year
+    index = []
+    by_segment = defaultdict(list)
+    for pk, pregnancy in pregnancies.items():
+        record = {
+            'pregnancy': _dump(pregnancy),
+            'deliveries': [_dump(delivery) for delivery in deliveries[pk]],
+            'visits': [_dump(visit) for visit in visits[pk]],
+        }
+        by_segment[f'pregnancies-{timezone.localtime(delivered_at[pk]):%Y}.ndjson.gz'].append(
+            (pregnancy, gzip.compress((json.dumps(record, separators=(',', ':')) + '\n').encode()))
+        )
+    os.makedirs(archive_dir(), exist_ok=True)
+    for segment, members in by_segment.items():
+        with open(os.path.join(archive_dir(), segment), 'ab') as stream:
+            for pregnancy, member in members:
+                index.append(ArchivedPregnancy(
+                    pregnancy_id=pregnancy.pk, patient_id=pregnancy.patient_id, segment=segment,
+                    offset=stream.tell(), length=len(member), delivered_at=delivered_at[pregnancy.pk],
+                    delivery_ids=[delivery.pk for delivery in deliveries[pregnancy.pk]],
+                ))
+                stream.write(member)
+            stream.flush()
+            os.fsync(stream.fileno())
+
+    # Deleted through the ORM so the rollups, delivered flags and risk scores follow as for any deletion
+    with transaction.atomic():
+        ArchivedPregnancy.objects.bulk_create(index)
+        Visit.objects.filter(pk__in=[visit.pk for group in visits.values() for visit in group]).delete()
+        Pregnancy.objects.filter(pk__in=ids).delete()
+    return len(pregnancies)
+
+
+def vacuum_database():
+    """
+    Give back the space the archived rows took. On SQLite, VACUUM rewrites the database file without
+    its free pages, holding an exclusive lock while it runs; on PostgreSQL, VACUUM makes the space in
+    the archived tables reusable (only VACUUM FULL, which locks them, would shrink the files).
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('VACUUM')
+        else:
+            tables = ', '.join(connection.ops.quote_name(model._meta.db_table) for model in (Visit, Delivery, Pregnancy))
+            cursor.execute(f'VACUUM (ANALYZE) {tables}')
+
+
+def read_archived(entries):
+    """ArchivedBundle of each ArchivedPregnancy in `entries`, in order, opening each segment once."""
+    entries = list(entries)
+    records = {}
+    by_segment = defaultdict(list)
+    for entry in entries:
+        by_segment[entry.segment].append(entry)
+    for segment, group in by_segment.items():
+        with open(os.path.join(archive_dir(), segment), 'rb') as stream:
+            for entry in sorted(group, key=lambda entry: entry.offset):
+                stream.seek(entry.offset)
+                records[entry.pk] = ArchivedBundle(json.loads(gzip.decompress(stream.read(entry.length))))
+    bundles = [records[entry.pk] for entry in entries]
+
+    # The records point at hot users and patients; load them once for all the serializers read
+    prefetch_related_objects([bundle.pregnancy for bundle in bundles], 'created_by', 'updated_by')
+    prefetch_related_objects([visit for bundle in bundles for visit in bundle.visits], 'patient__user')
+    return bundles
+
+
+def restore_pregnancy(pregnancy_id):
+    """Move an archived pregnancy back into the hot tables. Its bytes stay in the segment, unreferenced."""
+    entry = ArchivedPregnancy.objects.get(pk=pregnancy_id)
+    bundle, = read_archived([entry])
+    with transaction.atomic():
+        # Raw saves keep the stored dates instead of auto_now_add ones, and still send the signals
+        # that update the rollups and delivered flags
+        for instance in [bundle.pregnancy, *bundle.deliveries, *bundle.visits]:
+            instance._state.adding = True
+            instance.save_base(raw=True, force_insert=True)
+        entry.delete()
+    return bundle.pregnancy
+
+
+def timeline_pregnancies(patient):
+    """
+    Archived pregnancies of `patient` shaped like the timeline prefetches: visits outside deliveries
+    in timeline_visits and deliveries, each with its visits, in timeline_deliveries.
+    """
+    pregnancies = []
+    for bundle in read_archived(patient.archived_pregnancies.order_by('pk')):
+        pregnancy = bundle.pregnancy
+        pregnancy.timeline_visits = _ordered([visit for visit in bundle.visits if visit.delivery_id is None], 'visit_date')
+        pregnancy.timeline_deliveries = _ordered(bundle.deliveries, 'delivery_date')
+        for delivery in pregnancy.timeline_deliveries:
+            delivery.timeline_visits = _ordered([visit for visit in bundle.visits if visit.delivery_id == delivery.pk], 'visit_date')
+        pregnancies.append(pregnancy)
+    return pregnancies
+
+
+def _ordered(records, field):
+    # Oldest first with records lacking the value first, like the hot lists on SQLite
+    return sorted(records, key=lambda record: (getattr(record, field) is not None, getattr(record, field) or 0, record.pk))
+
+
+class ArchiveReadThroughMixin:
+    """
+    Read-only access to archived records on the nested patient routes of a viewset serving
+    `archived_model`. Hot records are looked up as before; the archive is only read when
+    a detail request finds nothing, a list under a pregnancy or delivery comes back empty,
+    or the client asks for ?archived=true.
+    """
+
+    archived_model = None
+
+    def _archived_records(self):
+        patient_pk = self.kwargs.get('patient_pk')
+        user = self.request.user
+        if not str(patient_pk or '').isdigit() or (user.role == 'patient' and get_patient_id(user) != int(patient_pk)):
+            return []
+        entries = ArchivedPregnancy.objects.filter(patient_id=patient_pk)
+        pregnancy_pk = self.kwargs.get('pregnancy_pk')
+        delivery_pk = self.kwargs.get('delivery_pk')
+        if pregnancy_pk:
+            entries = entries.filter(pregnancy_id=pregnancy_pk)
+        entries = [entry for entry in entries if not delivery_pk or int(delivery_pk) in entry.delivery_ids]
+
+        records = [record for bundle in read_archived(entries) for record in bundle.records(self.archived_model)]
+        if delivery_pk and self.archived_model is Visit:
+            records = [record for record in records if record.delivery_id == int(delivery_pk)]
+        elif pregnancy_pk and self.archived_model is Visit:
+            records = [record for record in records if record.pregnancy_id == int(pregnancy_pk)]
+        return _ordered(records, self.cursor_ordering)
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('archived') != 'true':
+            response = super().list(request, *args, **kwargs)
+            nested = self.kwargs.get('pregnancy_pk') or self.kwargs.get('delivery_pk')
+            if not nested or response.data.get('results') or not self.kwargs.get('patient_pk'):
+                return response
+        # Archived lists are short, so they are paged by page number even when a cursor is asked for
+        paginator = PageNumberPagination()
+        page = paginator.paginate_queryset(self._archived_records(), request, view=self)
+        return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            pk = str(self.kwargs.get(self.lookup_field, ''))
+            for record in self._archived_records():
+                if str(record.pk) == pk:
+                    return Response(self.get_serializer(record).data)
+            raise
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pregnancies.archive import (
+    ARCHIVE_AFTER_YEARS, ARCHIVE_BATCH_SIZE, archive_pregnancies, restore_pregnancy, vacuum_database,
+)
+from pregnancies.models import ArchivedPregnancy
+
+
+class Command(BaseCommand):
+    help = (
+        'Move pregnancies delivered more than ARCHIVE_AFTER_YEARS ago, with their deliveries and visits, into '
+        'compressed yearly segments under ARCHIVE_DIR. Run it from a nightly cron job, one at a time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=getattr(settings, 'ARCHIVE_AFTER_YEARS', ARCHIVE_AFTER_YEARS))
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--no-vacuum', action='store_true', help='Skip the VACUUM that returns the freed space afterwards.')
+        parser.add_argument('--restore', type=int, metavar='PREGNANCY_ID', help='Move an archived pregnancy back instead.')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            try:
+                pregnancy = restore_pregnancy(options['restore'])
+            except ArchivedPregnancy.DoesNotExist:
+                raise CommandError(f'Pregnancy {options["restore"]} is not archived.')
+            self.stdout.write(self.style.SUCCESS(f'Restored pregnancy {pregnancy.pk}'))
+            return
+        if options['years'] < 1:
+            raise CommandError('--years must be at least 1.')
+        archived = archive_pregnancies(years=options['years'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} pregnancies delivered more than {options["years"]} years ago'))
+        if archived and not options['no_vacuum']:
+            vacuum_database()
+            self.stdout.write(self.style.SUCCESS('Vacuumed the database'))
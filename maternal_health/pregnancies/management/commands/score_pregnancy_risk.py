@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from pregnancies.risk import RISK_CHUNK_SIZE, RISK_MODEL_VERSION, score_pregnancies
+
+
+class Command(BaseCommand):
+    help = (
+        'Score active pregnancies for risk in NumPy batches. Only pregnancies whose visits or risk factors '
+        'changed since the last run, or that were scored by another model version, are recomputed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rescore every active pregnancy.')
+        parser.add_argument('--chunk-size', type=int, default=RISK_CHUNK_SIZE)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        counts = score_pregnancies(
+            rescore_all=options['all'], chunk_size=options['chunk_size'], using=options['database'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Scored {counts["scored"]} of {counts["active"]} active pregnancies with risk model v{RISK_MODEL_VERSION}; '
+            f'{counts["high"]} high risk, {counts["removed"]} inactive scores removed'
+        ))
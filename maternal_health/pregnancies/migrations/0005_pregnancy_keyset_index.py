@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pregnancies', '0004_pregnancy_created_by_pregnancy_updated_by'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='pregnancy',
+            name='pregnancies_expecte_3f4650_idx',
+        ),
+        migrations.AddIndex(
+            model_name='pregnancy',
+            index=models.Index(fields=['expected_delivery_date', 'id'], name='pregnancies_expecte_5f20b5_idx'),
+        ),
+    ]
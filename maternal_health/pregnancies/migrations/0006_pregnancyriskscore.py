@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pregnancies', '0005_pregnancy_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PregnancyRiskScore',
+            fields=[
+                ('pregnancy', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='risk_score', serialize=False, to='pregnancies.pregnancy')),
+                ('score', models.PositiveSmallIntegerField()),
+                ('level', models.CharField(choices=[('low', 'Low'), ('moderate', 'Moderate'), ('high', 'High')], max_length=10)),
+                ('factors', models.JSONField(default=list)),
+                ('version', models.CharField(max_length=20)),
+                ('visit_count', models.PositiveIntegerField(default=0)),
+                ('visits_updated_at', models.DateTimeField(blank=True, null=True)),
+                ('stale', models.BooleanField(default=False)),
+                ('scored_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-score', 'pregnancy'], name='pregnancies_score_b7d496_idx')],
+            },
+        ),
+    ]
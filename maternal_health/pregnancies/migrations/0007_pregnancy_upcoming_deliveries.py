@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:06
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+# Fill edd_week with one update per distinct expected delivery date, and is_delivered with one update overall.
+def backfill_calendar_fields(apps, schema_editor):
+    Pregnancy = apps.get_model('pregnancies', 'Pregnancy')
+    Delivery = apps.get_model('deliveries', 'Delivery')
+    pregnancies = Pregnancy.objects.using(schema_editor.connection.alias)
+
+    dates = pregnancies.exclude(expected_delivery_date=None).values_list('expected_delivery_date', flat=True).distinct()
+    for day in list(dates):
+        pregnancies.filter(expected_delivery_date=day).update(edd_week=day - timedelta(days=day.weekday()))
+    pregnancies.update(is_delivered=models.Exists(Delivery.objects.filter(pregnancy=models.OuterRef('pk'))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pregnancies', '0006_pregnancyriskscore'),
+        ('deliveries', '0005_delivery_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pregnancy',
+            name='edd_week',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='pregnancy',
+            name='is_delivered',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='pregnancy',
+            name='planned_place_of_delivery',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='pregnancy',
+            index=models.Index(condition=models.Q(('is_delivered', False)), fields=['edd_week', 'planned_place_of_delivery'], name='pregnancy_upcoming_edd_idx'),
+        ),
+        migrations.RunPython(backfill_calendar_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0005_patient_search_index'),
+        ('pregnancies', '0007_pregnancy_upcoming_deliveries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPregnancy',
+            fields=[
+                ('pregnancy_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('delivery_ids', models.JSONField(default=list)),
+                ('segment', models.CharField(max_length=100)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('delivered_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_pregnancies', to='patients.patient')),
+            ],
+        ),
+    ]
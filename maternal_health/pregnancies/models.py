@@ -25,6 +25,12 @@ class Pregnancy(models.Model):
     diabetes_status = models.BooleanField(default=False)
     hypertension_status = models.BooleanField(default=False) 
     multiple_pregnancy = models.BooleanField(default=False) 
+
+    # Labour-ward planning: where the delivery is planned, the Monday of the EDD's week, and whether
+    # a delivery has been recorded. edd_week is kept by save() and is_delivered by the delivery signals.
+    planned_place_of_delivery = models.CharField(max_length=100, blank=True, null=True)
+    edd_week = models.DateField(null=True, blank=True, editable=False)
+    is_delivered = models.BooleanField(default=False, editable=False)
     created_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.SET_NULL,
@@ -41,7 +47,12 @@ class Pregnancy(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['patient', 'last_menstrual_period']),
-            models.Index(fields=['expected_delivery_date']), 
+            models.Index(fields=['expected_delivery_date', 'id']),  # keyset pagination order
+            # Upcoming-deliveries calendar; delivered pregnancies are left out of the index entirely
+            models.Index(
+                fields=['edd_week', 'planned_place_of_delivery'], name='pregnancy_upcoming_edd_idx',
+                condition=models.Q(is_delivered=False),
+            ),
         ]
 
     def __str__(self):
@@ -57,4 +68,66 @@ class Pregnancy(models.Model):
     def save(self, *args, **kwargs):
         if self.last_menstrual_period and not self.expected_delivery_date:
             self.expected_delivery_date = self.last_menstrual_period + timedelta(days=280)
+        self.edd_week = week_start(self.expected_delivery_date)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'last_menstrual_period', 'expected_delivery_date'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'expected_delivery_date', 'edd_week'}
         super().save(*args, **kwargs)
+
+
+# Monday of the week a date falls in; the bucket used by the upcoming-deliveries calendar
+def week_start(day):
+    return None if day is None else day - timedelta(days=day.weekday())
+
+
+# Recompute is_delivered for the given pregnancies in one statement; called by the delivery signals
+# and by bulk delivery paths that skip them.
+def sync_delivered(pregnancy_ids, using='default'):
+    from deliveries.models import Delivery
+    delivered = models.Exists(Delivery.objects.using(using).filter(pregnancy=models.OuterRef('pk')))
+    Pregnancy.objects.using(using).filter(pk__in=set(pregnancy_ids)).update(is_delivered=delivered)
+
+
+# Latest risk stratification of an active pregnancy, written by the batch risk engine (pregnancies.risk).
+# visit_count and visits_updated_at record the visits the score was computed from, so a run can skip
+# pregnancies whose visits have not changed; stale is set when the pregnancy's own risk factors change.
+class PregnancyRiskScore(models.Model):
+    RISK_LEVELS = [
+        ('low', 'Low'),
+        ('moderate', 'Moderate'),
+        ('high', 'High'),
+    ]
+    pregnancy = models.OneToOneField(Pregnancy, on_delete=models.CASCADE, primary_key=True, related_name='risk_score')
+    score = models.PositiveSmallIntegerField()  # 0-100
+    level = models.CharField(max_length=10, choices=RISK_LEVELS)
+    factors = models.JSONField(default=list)  # names of the risk factors present
+    version = models.CharField(max_length=20)  # risk model version that produced the score
+    visit_count = models.PositiveIntegerField(default=0)
+    visits_updated_at = models.DateTimeField(null=True, blank=True)
+    stale = models.BooleanField(default=False)
+    scored_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score', 'pregnancy']),  # high-risk list order
+        ]
+
+    def __str__(self):
+        return f"Risk {self.score} ({self.level}) for pregnancy {self.pregnancy_id}"
+
+
+# A delivered pregnancy moved to cold storage (pregnancies.archive) with its deliveries and visits: the
+# archive segment holding them and the byte range of their record in it. pregnancy_id and delivery_ids
+# are the ids the records had, which nested routes still use to read them back.
+class ArchivedPregnancy(models.Model):
+    pregnancy_id = models.BigIntegerField(primary_key=True)
+    patient = models.ForeignKey('patients.Patient', on_delete=models.CASCADE, related_name='archived_pregnancies')
+    delivery_ids = models.JSONField(default=list)
+    segment = models.CharField(max_length=100)  # file name under ARCHIVE_DIR
+    offset = models.BigIntegerField()
+    length = models.PositiveIntegerField()
+    delivered_at = models.DateTimeField()  # latest delivery
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived pregnancy {self.pregnancy_id} in {self.segment}"
@@ -0,0 +1,184 @@
+from datetime import timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, IntegerField, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from visits.models import Visit
+from .models import Pregnancy, PregnancyRiskScore
+
+
+# Bump whenever factors, weights or thresholds change; scores from another version are recomputed
+RISK_MODEL_VERSION = '1'
+
+# Risk factors in feature-matrix column order, with the points each adds to the score (capped at 100)
+RISK_FACTORS = [
+    ('hiv', 15),
+    ('diabetes', 15),
+    ('chronic_hypertension', 20),
+    ('multiple_pregnancy', 15),
+    ('severe_anaemia', 25),  # lowest hemoglobin below 7 g/dL
+    ('anaemia', 10),  # lowest hemoglobin 7 to 11 g/dL
+    ('severe_hypertension', 30),  # a reading at or above 160/110
+    ('gestational_hypertension', 15),  # a reading at or above 140/90, below severe
+    ('abnormal_fetal_heart_rate', 15),  # a fetal heart rate outside 110-160 bpm
+]
+RISK_WEIGHTS = np.array([weight for _, weight in RISK_FACTORS])
+
+# Pregnancy columns feeding the first four factors
+RISK_FLAG_FIELDS = {'hiv_status', 'diabetes_status', 'hypertension_status', 'multiple_pregnancy'}
+
+HIGH_RISK_SCORE = 40
+MODERATE_RISK_SCORE = 20
+
+# Pregnancies without a delivery stay active this long past their expected delivery date
+ACTIVE_GRACE_DAYS = 28
+
+RISK_CHUNK_SIZE = 2000
+
+
+def active_pregnancies(prefix='', today=None):
+    """Q for undelivered pregnancies that are not long past due; `prefix` applies it through a relation."""
+    cutoff = (today or timezone.localdate()) - timedelta(days=ACTIVE_GRACE_DAYS)
+    return Q(**{f'{prefix}delivery__isnull': True}) & (
+        Q(**{f'{prefix}expected_delivery_date__isnull': True}) | Q(**{f'{prefix}expected_delivery_date__gte': cutoff})
+    )
+
+
+def risk_level(score):
+    if score >= HIGH_RISK_SCORE:
+        return 'high'
+    if score >= MODERATE_RISK_SCORE:
+        return 'moderate'
+    return 'low'
+
+
+def score_features(features):
+    """Scores (0-100) for a boolean feature matrix with one row per pregnancy and one column per RISK_FACTORS entry."""
+    return np.minimum(features.astype(np.int64) @ RISK_WEIGHTS, 100)
+
+
+def extract_features(flags, visits):
+    """
+    Build the feature matrix for one batch of pregnancies.
+
+    `flags` is an (n, 5) array of pregnancy id, hiv, diabetes, hypertension and multiple pregnancy,
+    sorted by id. `visits` is an (m, 5) float array of pregnancy id, hemoglobin, systolic, diastolic
+    and fetal heart rate, with NaN for missing readings.
+    """
+    count = len(flags)
+    hemoglobin = np.full(count, np.nan)
+    systolic = np.full(count, np.nan)
+    diastolic = np.full(count, np.nan)
+    abnormal_fhr = np.zeros(count, dtype=bool)
+
+    if len(visits):
+        rows = np.searchsorted(flags[:, 0], visits[:, 0].astype(np.int64))
+        # fmin/fmax ignore NaN, so visits without a reading do not mask the ones that have one
+        np.fmin.at(hemoglobin, rows, visits[:, 1])
+        np.fmax.at(systolic, rows, visits[:, 2])
+        np.fmax.at(diastolic, rows, visits[:, 3])
+        fhr = visits[:, 4]
+        with np.errstate(invalid='ignore'):
+            np.logical_or.at(abnormal_fhr, rows, (fhr < 110) | (fhr > 160))
+
+    with np.errstate(invalid='ignore'):
+        severe_hypertension = (systolic >= 160) | (diastolic >= 110)
+        hypertension = (systolic >= 140) | (diastolic >= 90)
+        severe_anaemia = hemoglobin < 7
+        anaemia = (hemoglobin >= 7) & (hemoglobin < 11)
+
+    return np.column_stack([
+        flags[:, 1].astype(bool), flags[:, 2].astype(bool), flags[:, 3].astype(bool), flags[:, 4].astype(bool),
+        severe_anaemia, anaemia, severe_hypertension, hypertension & ~severe_hypertension, abnormal_fhr,
+    ])
+
+
+def _needs_scoring(row, rescore_all):
+    _, version, stale, scored_count, scored_updated_at, visit_count, visits_updated_at = row[:7]
+    return (
+        rescore_all or version != RISK_MODEL_VERSION or stale
+        or scored_count != visit_count or scored_updated_at != visits_updated_at
+    )
+
+
+def _score_batch(rows, using, now):
+    flags = np.array([(row[0], *row[7:]) for row in rows], dtype=np.int64)
+    visits = np.array(
+        list(
+            Visit.objects.using(using).filter(pregnancy_id__in=flags[:, 0].tolist()).values_list(
+                'pregnancy_id', 'hemoglobin_level', 'systolic', 'diastolic', 'fetal_heart_rate',
+            )
+        ),
+        dtype=float,  # None becomes NaN
+    ).reshape(-1, 5)
+
+    features = extract_features(flags, visits)
+    scores = score_features(features)
+    names = [name for name, _ in RISK_FACTORS]
+
+    records = [
+        PregnancyRiskScore(
+            pregnancy_id=row[0], score=int(score), level=risk_level(score),
+            factors=[name for name, present in zip(names, present_factors) if present],
+            version=RISK_MODEL_VERSION, visit_count=row[5], visits_updated_at=row[6], stale=False, scored_at=now,
+        )
+        for row, score, present_factors in zip(rows, scores, features)
+    ]
+    PregnancyRiskScore.objects.using(using).bulk_create(
+        records, update_conflicts=True, unique_fields=['pregnancy'],
+        update_fields=['score', 'level', 'factors', 'version', 'visit_count', 'visits_updated_at', 'stale', 'scored_at'],
+    )
+    return records
+
+
+def score_pregnancies(rescore_all=False, chunk_size=RISK_CHUNK_SIZE, using='default', today=None):
+    """
+    Score every active pregnancy whose visits or risk factors changed since it was last scored.
+
+    Pregnancies are read in primary-key chunks: one grouped query per chunk finds the ones to
+    rescore along with their risk-factor columns, one query extracts their visit readings, and
+    NumPy scores the whole chunk at once. Scores of pregnancies that are no longer active are
+    removed. Returns the number of active, rescored, removed and (in total) high-risk pregnancies.
+    """
+    now = timezone.now()
+    # Visit subqueries rather than a join, so visits moved to partition tables are counted (visits/routing.py)
+    visits = Visit.objects.filter(pregnancy=OuterRef('pk')).order_by().values('pregnancy')
+    pregnancies = (
+        Pregnancy.objects.using(using)
+        .filter(active_pregnancies(today=today))
+        .annotate(
+            visit_total=Coalesce(Subquery(visits.annotate(total=Count('pk')).values('total')), Value(0), output_field=IntegerField()),
+            last_visit_update=Subquery(visits.annotate(latest=Max('updated_at')).values('latest')),
+        )
+        .order_by('pk')
+    )
+    counts = {'active': 0, 'scored': 0, 'high': 0, 'removed': 0}
+
+    last_pk = 0
+    while True:
+        rows = list(
+            pregnancies.filter(pk__gt=last_pk).values_list(
+                'pk', 'risk_score__version', 'risk_score__stale', 'risk_score__visit_count',
+                'risk_score__visits_updated_at', 'visit_total', 'last_visit_update',
+                'hiv_status', 'diabetes_status', 'hypertension_status', 'multiple_pregnancy',
+            )[:chunk_size]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        counts['active'] += len(rows)
+
+        pending = [row for row in rows if _needs_scoring(row, rescore_all)]
+        if pending:
+            with transaction.atomic(using=using):
+                records = _score_batch(pending, using, now)
+            counts['scored'] += len(records)
+
+    counts['removed'], _ = PregnancyRiskScore.objects.using(using).exclude(
+        active_pregnancies('pregnancy__', today=today),
+    ).delete()
+    counts['high'] = PregnancyRiskScore.objects.using(using).filter(level='high').count()
+    return counts
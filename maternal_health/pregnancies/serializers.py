@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Pregnancy
+from .models import Pregnancy, PregnancyRiskScore
 
 
 # Serializer for Pregnancy model, including all fields and read-only audit fields to ensure data integrity and proper tracking of changes.
@@ -11,3 +11,20 @@ class PregnancySerializer(serializers.ModelSerializer):
         model = Pregnancy
         fields = '__all__'
         read_only_fields = ['patient', 'created_by', 'updated_by', 'expected_delivery_date']
+
+
+# Serializer for a stored risk score, as produced by the batch risk engine.
+class PregnancyRiskScoreSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PregnancyRiskScore
+        fields = ['score', 'level', 'factors', 'version', 'scored_at']
+        read_only_fields = fields
+
+
+# Serializer for the high-risk pregnancy list: the pregnancy, whose patient it is, and its risk score.
+class HighRiskPregnancySerializer(PregnancySerializer):
+    patient_name = serializers.SerializerMethodField()
+    risk = PregnancyRiskScoreSerializer(source='risk_score', read_only=True)
+
+    def get_patient_name(self, obj):
+        return f"{obj.patient.first_name} {obj.patient.last_name}".strip()
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from deliveries.models import Delivery
+from .models import Pregnancy, PregnancyRiskScore, sync_delivered
+from .risk import RISK_FLAG_FIELDS
+
+
+# Pregnancies have no updated_at for the risk engine to compare, so edits to their risk factors
+# mark the stored score stale and the next run recomputes it.
+@receiver(post_save, sender=Pregnancy)
+def mark_risk_score_stale(sender, instance, created, using, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not RISK_FLAG_FIELDS.intersection(update_fields)):
+        return
+    PregnancyRiskScore.objects.using(using).filter(pregnancy=instance).update(stale=True)
+
+
+# Recording or removing a delivery moves its pregnancy in or out of the upcoming-deliveries calendar.
+@receiver(post_save, sender=Delivery)
+@receiver(post_delete, sender=Delivery)
+def update_pregnancy_delivered(sender, instance, using, **kwargs):
+    if instance.pregnancy_id:
+        sync_delivered([instance.pregnancy_id], using=using)
@@ -1,3 +1,399 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from io import StringIO
+from datetime import date, timedelta
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from config.testing import QueryBudgetMixin
+from deliveries.models import Delivery
+from patients.models import Patient
+from visits.models import Visit
+from .archive import archive_pregnancies, restore_pregnancy
+from .models import ArchivedPregnancy, Pregnancy, PregnancyRiskScore
+from .risk import RISK_MODEL_VERSION, score_pregnancies
+
+User = get_user_model()
+
+
+class PregnancyListQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Test that pregnancy list endpoints do not issue queries per pregnancy"""
+
+    def setUp(self):
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+    def _make_pregnancies(self, count):
+        for _ in range(count):
+            Pregnancy.objects.create(
+                patient=self.patient, gestational_age_weeks=12,
+                created_by=self.doctor_user, updated_by=self.doctor_user,
+            )
+
+    def test_global_pregnancy_list(self):
+        """Pregnancy list should cost the same for one pregnancy or a full page"""
+        self.assertListQueriesConstant('/api/pregnancies/', self._make_pregnancies, max_queries=2)
+
+    def test_patient_pregnancy_list(self):
+        """Nested patient pregnancy list should cost the same for one pregnancy or a full page"""
+        url = f'/api/patients/{self.patient.id}/pregnancies/'
+        self.assertListQueriesConstant(url, self._make_pregnancies, max_queries=2)
+
+
+class PregnancyCursorPaginationTests(TestCase):
+    """Test keyset pagination of the pregnancy list, whose ordering field can be empty"""
+
+    def setUp(self):
+        patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        patient = Patient.objects.get(user=patient_user)
+        doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.client = APIClient()
+        self.client.force_authenticate(user=doctor_user)
+
+        # Pregnancies without a last menstrual period have no expected delivery date
+        for index in range(24):
+            lmp = None if index % 2 == 0 else date(2024, 1, 1) + timedelta(days=index % 5)
+            Pregnancy.objects.create(patient=patient, gestational_age_weeks=12, last_menstrual_period=lmp)
+
+    def test_cursor_pages_include_pregnancies_without_due_date(self):
+        """Following next links should return every pregnancy once, undated ones first"""
+        ids = []
+        url = '/api/pregnancies/?pagination=cursor'
+        while url:
+            body = self.client.get(url).json()
+            ids.extend(row['id'] for row in body['results'])
+            previous, url = body['previous'], body['next']
+
+        undated = list(Pregnancy.objects.filter(expected_delivery_date__isnull=True).order_by('pk').values_list('pk', flat=True))
+        dated = list(Pregnancy.objects.filter(expected_delivery_date__isnull=False).order_by('expected_delivery_date', 'pk').values_list('pk', flat=True))
+        self.assertEqual(ids, undated + dated)
+
+        # Walking back crosses from the dated pregnancies to the undated ones the same way
+        back = []
+        while previous:
+            body = self.client.get(previous).json()
+            back[:0] = [row['id'] for row in body['results']]
+            previous = body['previous']
+        self.assertEqual(back, ids[:20])
+
+
+class PregnancyRiskScoringTests(TestCase):
+    """Test the batch risk engine and the high-risk pregnancy list"""
+
+    def setUp(self):
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+        self.today = date.today()
+
+    def _pregnancy(self, **kwargs):
+        return Pregnancy.objects.create(
+            patient=self.patient, gestational_age_weeks=24, expected_delivery_date=self.today + timedelta(weeks=16), **kwargs,
+        )
+
+    def _visit(self, pregnancy, blood_pressure='118/76', hemoglobin_level=12.0, fetal_heart_rate=140):
+        return Visit.objects.create(
+            patient=self.patient, pregnancy=pregnancy, provider=self.doctor_user, visit_type='Antenatal',
+            blood_pressure=blood_pressure, heart_rate=80, hemoglobin_level=hemoglobin_level, fetal_heart_rate=fetal_heart_rate,
+        )
+
+    def test_scores_combine_pregnancy_and_visit_factors(self):
+        """Risk factors from the pregnancy and its worst visit readings should add up"""
+        low = self._pregnancy()
+        self._visit(low)
+        high = self._pregnancy(diabetes_status=True)
+        self._visit(high, blood_pressure='150/95', hemoglobin_level=9.5)
+        self._visit(high, blood_pressure='120/80', hemoglobin_level=None, fetal_heart_rate=95)
+
+        counts = score_pregnancies()
+
+        self.assertEqual(counts['scored'], 2)
+        self.assertEqual(PregnancyRiskScore.objects.get(pregnancy=low).score, 0)
+        score = PregnancyRiskScore.objects.get(pregnancy=high)
+        self.assertEqual(score.factors, ['diabetes', 'anaemia', 'gestational_hypertension', 'abnormal_fetal_heart_rate'])
+        self.assertEqual(score.score, 55)
+        self.assertEqual(score.level, 'high')
+        self.assertEqual(score.version, RISK_MODEL_VERSION)
+
+    def test_only_changed_pregnancies_are_rescored(self):
+        """A rerun should skip unchanged pregnancies and pick up new visits and edited risk factors"""
+        first = self._pregnancy()
+        second = self._pregnancy()
+        self._visit(first)
+        self._visit(second)
+        score_pregnancies()
+        self.assertEqual(score_pregnancies()['scored'], 0)
+
+        self._visit(first, blood_pressure='165/112')
+        self.assertEqual(score_pregnancies()['scored'], 1)
+        self.assertIn('severe_hypertension', PregnancyRiskScore.objects.get(pregnancy=first).factors)
+
+        second.hiv_status = True
+        second.save()
+        self.assertEqual(score_pregnancies()['scored'], 1)
+        self.assertEqual(PregnancyRiskScore.objects.get(pregnancy=second).factors, ['hiv'])
+
+    def test_delivered_pregnancies_drop_out(self):
+        """Scores of delivered pregnancies should be removed on the next run"""
+        pregnancy = self._pregnancy(hypertension_status=True, multiple_pregnancy=True)
+        score_pregnancies()
+        Delivery.objects.create(
+            pregnancy=pregnancy, delivery_mode='vaginal', birth_weight_g=3100, place_of_delivery='Kigali',
+            skilled_birth_attendant=True, newborn_gender='Male', apgar_score_1min=8, apgar_score_5min=9,
+        )
+
+        self.assertEqual(self.client.get('/api/pregnancies/high-risk/').json()['count'], 0)
+        self.assertEqual(score_pregnancies()['removed'], 1)
+        self.assertFalse(PregnancyRiskScore.objects.exists())
+
+    def test_high_risk_list_is_sorted_by_score(self):
+        """The list should hold pregnancies above the threshold, highest score first, for clinicians only"""
+        moderate = self._pregnancy(diabetes_status=True, hiv_status=True)
+        severe = self._pregnancy(diabetes_status=True, hypertension_status=True, multiple_pregnancy=True)
+        self._pregnancy(hiv_status=True)
+        score_pregnancies()
+
+        response = self.client.get('/api/pregnancies/high-risk/', {'min_score': 30})
+        self.assertEqual([row['id'] for row in response.json()['results']], [severe.id, moderate.id])
+        self.assertEqual(response.json()['results'][0]['risk']['score'], 50)
+
+        response = self.client.get(f'/api/patients/{self.patient.id}/pregnancies/high-risk/')
+        self.assertEqual([row['id'] for row in response.json()['results']], [severe.id])
+
+        self.client.force_authenticate(user=self.patient_user)
+        self.assertEqual(self.client.get('/api/pregnancies/high-risk/').status_code, 403)
+
+
+class UpcomingDeliveriesCalendarTests(TestCase):
+    """Test the upcoming-deliveries calendar and the fields behind it"""
+
+    def setUp(self):
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+        self.monday = date(2026, 3, 2)
+
+    def _pregnancy(self, edd, place='Kigali District Hospital'):
+        return Pregnancy.objects.create(
+            patient=self.patient, gestational_age_weeks=36, expected_delivery_date=edd, planned_place_of_delivery=place,
+        )
+
+    def _deliver(self, pregnancy):
+        return Delivery.objects.create(
+            pregnancy=pregnancy, delivery_mode='vaginal', birth_weight_g=3100, place_of_delivery='Kigali',
+            skilled_birth_attendant=True, newborn_gender='Male', apgar_score_1min=8, apgar_score_5min=9,
+        )
+
+    def _calendar(self, **params):
+        response = self.client.get('/api/pregnancies/calendar/', {'start': self.monday.isoformat(), **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_edd_week_follows_save(self):
+        """edd_week should be the Monday of the EDD week, including an EDD derived from the LMP"""
+        pregnancy = Pregnancy.objects.create(
+            patient=self.patient, gestational_age_weeks=10, last_menstrual_period=date(2025, 5, 29),
+        )
+        self.assertEqual(pregnancy.expected_delivery_date, date(2026, 3, 5))
+        self.assertEqual(pregnancy.edd_week, self.monday)
+
+        pregnancy.expected_delivery_date = date(2026, 3, 12)
+        pregnancy.save(update_fields=['expected_delivery_date'])
+        pregnancy.refresh_from_db()
+        self.assertEqual(pregnancy.edd_week, self.monday + timedelta(weeks=1))
+
+    def test_calendar_counts_undelivered_pregnancies_per_week_and_facility(self):
+        """Pregnancies should be bucketed by EDD week and facility, and leave once delivered"""
+        self._pregnancy(self.monday + timedelta(days=1))
+        self._pregnancy(self.monday + timedelta(days=6), place='Muhima Health Centre')
+        delivered = self._pregnancy(self.monday + timedelta(days=3))
+        self._pregnancy(self.monday + timedelta(days=9))
+        self._pregnancy(self.monday + timedelta(weeks=3))
+        self._deliver(delivered)
+
+        data = self._calendar(weeks=2)
+        self.assertEqual(data['total'], 3)
+        first, second = data['calendar']
+        self.assertEqual(first['week_start'], '2026-03-02')
+        self.assertEqual(first['week_end'], '2026-03-08')
+        self.assertEqual(first['by_facility'], {'Kigali District Hospital': 1, 'Muhima Health Centre': 1})
+        self.assertEqual(second['total'], 1)
+
+        self.assertEqual(self._calendar(weeks=2, facility='Muhima Health Centre')['total'], 1)
+
+        Delivery.objects.filter(pregnancy=delivered).delete()
+        self.assertEqual(self._calendar(weeks=2)['total'], 4)
+
+    def test_batch_deliveries_mark_pregnancies_delivered(self):
+        """Deliveries uploaded in a batch should also drop out of the calendar"""
+        pregnancy = self._pregnancy(self.monday)
+        row = {
+            'pregnancy': pregnancy.id, 'delivery_mode': 'vaginal', 'birth_weight_g': 3000, 'place_of_delivery': 'Kigali',
+            'skilled_birth_attendant': True, 'newborn_gender': 'Female', 'apgar_score_1min': 8, 'apgar_score_5min': 9,
+        }
+        self.client.post('/api/deliveries/batch/', [row], format='json')
+
+        pregnancy.refresh_from_db()
+        self.assertTrue(pregnancy.is_delivered)
+        self.assertEqual(self._calendar()['total'], 0)
+
+    def test_calendar_validates_input_and_role(self):
+        """Bad parameters should return 400 and patients should be forbidden"""
+        self.assertEqual(self.client.get('/api/pregnancies/calendar/', {'weeks': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/api/pregnancies/calendar/', {'start': 'soon'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/pregnancies/calendar/', {'start': '2024-02-30'}).status_code, 400)
+        self.client.force_authenticate(user=self.patient_user)
+        self.assertEqual(self.client.get('/api/pregnancies/calendar/').status_code, 403)
+
+
+class PregnancyArchiveTests(TestCase):
+    """Test archiving closed pregnancies to cold storage and reading them back"""
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        settings_override = override_settings(ARCHIVE_DIR=self.archive_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+        self.old = self._delivered_pregnancy(date(2010, 1, 1), years_ago=12)
+        self.recent = self._delivered_pregnancy(date(2023, 1, 1), years_ago=2)
+
+    def _delivered_pregnancy(self, lmp, years_ago):
+        pregnancy = Pregnancy.objects.create(
+            patient=self.patient, gestational_age_weeks=38, last_menstrual_period=lmp,
+            created_by=self.doctor_user, updated_by=self.doctor_user,
+        )
+        Visit.objects.create(
+            patient=self.patient, pregnancy=pregnancy, provider=self.doctor_user, visit_type='Antenatal',
+            blood_pressure='120/80', heart_rate=80,
+        )
+        delivery = Delivery.objects.create(
+            pregnancy=pregnancy, delivery_mode='vaginal', birth_weight_g=3200, place_of_delivery='Kigali',
+            skilled_birth_attendant=True, newborn_gender='Female', apgar_score_1min=8, apgar_score_5min=9,
+        )
+        Visit.objects.create(
+            patient=self.patient, delivery=delivery, provider=self.doctor_user, visit_type='Postnatal',
+            blood_pressure='118/76', heart_rate=78,
+        )
+        delivered_at = timezone.now() - timedelta(days=365 * years_ago)
+        Delivery.objects.filter(pk=delivery.pk).update(delivery_date=delivered_at, created_at=delivered_at)
+        return pregnancy
+
+    def test_archive_moves_old_pregnancies_out_of_the_hot_tables(self):
+        """Only pregnancies delivered more than ten years ago should be archived, with their records"""
+        self.assertEqual(archive_pregnancies(), 1)
+        self.assertEqual(archive_pregnancies(), 0)
+
+        self.assertEqual(list(Pregnancy.objects.values_list('pk', flat=True)), [self.recent.pk])
+        self.assertEqual(Delivery.objects.count(), 1)
+        self.assertEqual(Visit.objects.count(), 2)
+        entry = ArchivedPregnancy.objects.get()
+        self.assertEqual(entry.pk, self.old.pk)
+        self.assertEqual(entry.segment, f'pregnancies-{entry.delivered_at.year}.ndjson.gz')
+
+    def test_nested_routes_and_timeline_read_through(self):
+        """Archived records should still be served on the patient routes and in the timeline"""
+        delivery_id = Delivery.objects.get(pregnancy=self.old).pk
+        archive_pregnancies()
+        base = f'/api/patients/{self.patient.id}'
+
+        response = self.client.get(f'{base}/pregnancies/{self.old.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created_by'], 'doctor1')
+
+        visits = self.client.get(f'{base}/pregnancies/{self.old.pk}/visits/').json()['results']
+        self.assertEqual([visit['visit_type'] for visit in visits], ['Antenatal'])
+        self.assertEqual(visits[0]['patient_name'], 'patient1')
+        visits = self.client.get(f'{base}/deliveries/{delivery_id}/visits/').json()['results']
+        self.assertEqual([visit['visit_type'] for visit in visits], ['Postnatal'])
+
+        hot = self.client.get(f'{base}/pregnancies/').json()['results']
+        self.assertEqual([pregnancy['id'] for pregnancy in hot], [self.recent.pk])
+        archived = self.client.get(f'{base}/pregnancies/', {'archived': 'true'}).json()['results']
+        self.assertEqual([pregnancy['id'] for pregnancy in archived], [self.old.pk])
+
+        timeline = self.client.get(f'/api/patients/{self.patient.id}/timeline/').json()
+        self.assertEqual([pregnancy['id'] for pregnancy in timeline['pregnancies']], [self.old.pk, self.recent.pk])
+        self.assertEqual(len(timeline['pregnancies'][0]['deliveries'][0]['visits']), 1)
+
+        # Other patients cannot read them
+        other_user = User.objects.create_user(username='patient2', password='testpass123', role='patient')
+        self.client.force_authenticate(user=other_user)
+        self.assertEqual(self.client.get(f'{base}/pregnancies/{self.old.pk}/').status_code, 404)
+
+    def test_restore_keeps_the_original_records(self):
+        """A restored pregnancy should come back with its ids and dates"""
+        delivery = Delivery.objects.get(pregnancy=self.old)
+        archive_pregnancies()
+
+        restored = restore_pregnancy(self.old.pk)
+        self.assertEqual(restored.pk, self.old.pk)
+        self.assertFalse(ArchivedPregnancy.objects.exists())
+        self.assertTrue(Pregnancy.objects.get(pk=self.old.pk).is_delivered)
+        self.assertEqual(Delivery.objects.get(pk=delivery.pk).delivery_date, delivery.delivery_date)
+        self.assertEqual(Visit.objects.filter(pregnancy=self.old).count(), 1)
+        self.assertEqual(Visit.objects.filter(delivery=delivery).count(), 1)
+
+
+class PregnancyArchiveVacuumTests(TransactionTestCase):
+    """Test that the archive command shrinks the database (VACUUM cannot run inside a test transaction)"""
+
+    def setUp(self):
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        settings_override = override_settings(ARCHIVE_DIR=archive_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        patient = Patient.objects.get(user=User.objects.create_user(username='patient1', password='testpass123', role='patient'))
+        for _ in range(40):
+            pregnancy = Pregnancy.objects.create(patient=patient, gestational_age_weeks=38)
+            Delivery.objects.create(
+                pregnancy=pregnancy, delivery_mode='vaginal', birth_weight_g=3200, place_of_delivery='Kigali',
+                skilled_birth_attendant=True, newborn_gender='Female', apgar_score_1min=8, apgar_score_5min=9,
+                complications='x' * 8000,
+            )
+        Delivery.objects.update(delivery_date=timezone.now() - timedelta(days=365 * 12))
+
+    def _pragma(self, name):
+        if connection.vendor != 'sqlite':
+            self.skipTest('page counts are read with SQLite pragmas')
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_archive_run_vacuums(self):
+        """Archiving should return the pages the archived rows took"""
+        pages = self._pragma('page_count')
+        call_command('archive_pregnancies', stdout=StringIO())
+
+        self.assertEqual(ArchivedPregnancy.objects.count(), 40)
+        self.assertLess(self._pragma('page_count'), pages)
+        self.assertEqual(self._pragma('freelist_count'), 0)
+
+    def test_no_vacuum_leaves_the_pages_free(self):
+        """With --no-vacuum the freed pages stay in the file, for reuse"""
+        pages = self._pragma('page_count')
+        call_command('archive_pregnancies', no_vacuum=True, stdout=StringIO())
+
+        self.assertEqual(self._pragma('page_count'), pages)
+        self.assertGreater(self._pragma('freelist_count'), 0)
@@ -1,19 +1,33 @@
-from .models import Pregnancy
-from .serializers import PregnancySerializer
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .archive import ArchiveReadThroughMixin
+from .models import Pregnancy, week_start
+from .risk import HIGH_RISK_SCORE, active_pregnancies
+from .serializers import HighRiskPregnancySerializer, PregnancySerializer
 from rest_framework import permissions, viewsets, filters, status
 from django.shortcuts import get_object_or_404
+from patients.identity import get_patient_id
 from patients.models import Patient
+from patients.permissions import IsClinicianOrAdmin
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
-from django.http import HttpResponse
-from django.db.models import Count, Avg
-from django.db.models.functions import TruncMonth
-import csv
+from analytics.asyncapi import api_response, asummary_response, async_api_view, export_response, summary_patient_pk
+from analytics.rollups import PREGNANCY_ROLLUP, aread_rollup
+
+
+# Default and largest number of weeks shown by the upcoming-deliveries calendar
+CALENDAR_DEFAULT_WEEKS = 4
+CALENDAR_MAX_WEEKS = 52
 
 
 # PregnancyViewSet with role-based access control, filtering/searching, and automatic setting of audit fields to ensure data integrity and proper tracking of changes.
-class PregnancyViewSet(viewsets.ModelViewSet):
+class PregnancyViewSet(ArchiveReadThroughMixin, viewsets.ModelViewSet):
+    archived_model = Pregnancy  # archived pregnancies are read back on the patient routes
     serializer_class = PregnancySerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -24,18 +38,20 @@ class PregnancyViewSet(viewsets.ModelViewSet):
     search_fields = ['status', 'notes', 'patient__first_name', 'patient__last_name']
     ordering_fields = ['last_menstrual_period', 'expected_delivery_date']
     ordering = ['expected_delivery_date']
+    cursor_ordering = 'expected_delivery_date'  # keyset order for ?pagination=cursor
 
 
     # Override get_queryset to ensure patients only see their own pregnancies, while clinicians/admins can see all pregnancies to protect patients data.
     def get_queryset(self):
         patient_id = self.kwargs.get("patient_pk")
-        queryset = Pregnancy.objects.all()
+        # created_by/updated_by are rendered as usernames, so join the audit users up front
+        queryset = Pregnancy.objects.select_related('created_by', 'updated_by')
         if patient_id:
             queryset = queryset.filter(patient_id=patient_id)
 
         user = self.request.user
         if hasattr(user, "role") and user.role == "patient":
-            queryset = queryset.filter(patient__user=user)
+            queryset = queryset.filter(patient_id=get_patient_id(user))
 
         return queryset
 
@@ -55,50 +71,115 @@ class PregnancyViewSet(viewsets.ModelViewSet):
             return Response({"error": "Patients cannot create pregnancies."}, status=403)
         return super().create(request, *args, **kwargs)
 
+    # Active pregnancies with a stored risk score of at least ?min_score= (default: high risk), highest first.
+    # The order is served by the score index, so the list never scores or sorts pregnancies itself;
+    # it is paged by page number, since keyset pages follow expected_delivery_date rather than the score.
+    @action(
+        detail=False, methods=['get'], url_path='high-risk',
+        permission_classes=[IsAuthenticated, IsClinicianOrAdmin], cursor_ordering=None,
+    )
+    def high_risk(self, request, patient_pk=None):
+        try:
+            min_score = int(request.query_params.get('min_score', HIGH_RISK_SCORE))
+        except ValueError:
+            return Response({'detail': 'min_score must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = (
+            self.get_queryset()
+            .filter(active_pregnancies(), risk_score__score__gte=min_score)
+            .select_related('patient', 'risk_score')
+            .order_by('-risk_score__score', 'risk_score__pregnancy')
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = HighRiskPregnancySerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    # Upcoming-deliveries calendar for labour-ward planning: undelivered pregnancies per EDD week and
+    # planned facility, for ?weeks= weeks (default 4) from the week of ?start= (default today).
+    # One grouped query over the partial (edd_week, facility) index, which holds no delivered pregnancies.
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsClinicianOrAdmin])
+    def calendar(self, request, patient_pk=None):
+        start = request.query_params.get('start')
+        try:
+            start_date = parse_date(start) if start else timezone.localdate()
+        except ValueError:  # well formed but not a real date, e.g. 2024-02-30
+            start_date = None
+        try:
+            weeks = int(request.query_params.get('weeks', CALENDAR_DEFAULT_WEEKS))
+        except ValueError:
+            weeks = None
+        if start_date is None or weeks is None or not 1 <= weeks <= CALENDAR_MAX_WEEKS:
+            return Response(
+                {'detail': f'start must be a YYYY-MM-DD date and weeks a number from 1 to {CALENDAR_MAX_WEEKS}.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        first_week = week_start(start_date)
+        queryset = self.get_queryset().filter(
+            is_delivered=False, edd_week__gte=first_week, edd_week__lt=first_week + timedelta(weeks=weeks),
+        )
+        facility = request.query_params.get('facility')
+        if facility:
+            queryset = queryset.filter(planned_place_of_delivery=facility)
+        rows = (
+            queryset.order_by()
+            .values_list('edd_week', 'planned_place_of_delivery')
+            .annotate(count=Count('pk'))
+        )
+
+        calendar = {
+            first_week + timedelta(weeks=offset): {'total': 0, 'by_facility': {}}
+            for offset in range(weeks)
+        }
+        for week, place, count in rows:
+            calendar[week]['total'] += count
+            calendar[week]['by_facility'][place] = count
+        return Response({
+            'start': first_week,
+            'weeks': weeks,
+            'facility': facility,
+            'total': sum(week['total'] for week in calendar.values()),
+            'calendar': [
+                {'week_start': week, 'week_end': week + timedelta(days=6), **counts}
+                for week, counts in calendar.items()
+            ],
+        })
+
 
 # Implement analytics endpoints for pregnancies
-def _build_pregnancy_queryset(request, kwargs):
+def _build_pregnancy_queryset(user, kwargs):
     queryset = Pregnancy.objects.all()
     patient_id = kwargs.get('patient_pk')
     if patient_id:
         queryset = queryset.filter(patient_id=patient_id)
 
-    user = request.user
     if hasattr(user, 'role') and user.role == 'patient':
-        queryset = queryset.filter(patient__user=user)
+        queryset = queryset.filter(patient_id=get_patient_id(user))
 
     return queryset
 
 # export pregnancies to CSV for a patient, only accessible by that patient or clinicians/admins
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def export_pregnancies_csv(request, patient_pk=None):
-    qs = _build_pregnancy_queryset(request, {'patient_pk': patient_pk})
-    rows = list(qs.values())
-    if not rows:
-        return Response({'detail': 'No pregnancies found'}, status=status.HTTP_404_NOT_FOUND)
-
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="pregnancies_export.csv"'
-
-    fieldnames = list(rows[0].keys())
-    writer = csv.DictWriter(response, fieldnames=fieldnames)
-    writer.writeheader()
-    for r in rows:
-        for k, v in r.items():
-            try:
-                if hasattr(v, 'isoformat'):
-                    r[k] = v.isoformat()
-            except Exception:
-                pass
-        writer.writerow(r)
-
-    return response
+@async_api_view
+async def export_pregnancies_csv(request, patient_pk=None):
+    qs = await sync_to_async(_build_pregnancy_queryset)(request.user, {'patient_pk': patient_pk})
+    if not await qs.aexists():
+        return api_response({'detail': 'No pregnancies found'}, status=status.HTTP_404_NOT_FOUND)
+
+    # Streamed as CSV, Parquet or Arrow; too large to stream within the request, it becomes a background job
+    return await export_response(request, 'pregnancies', qs, {'patient_pk': patient_pk})
+
+# Summary payload for one scope's pregnancy rollup; shared with the batch summary endpoint in analytics.
+def pregnancy_summary_data(rollup):
+    return {
+        'total_pregnancies': rollup.count(),
+        'by_blood_type': rollup.histogram('blood_type'),
+        'average_gestational_age_weeks': rollup.average('gestational_age_weeks'),
+        'monthly_expected_deliveries': rollup.monthly(),
+    }
 
 # Summary analytics endpoint for pregnancies, scoped to patient if patient_pk provided, otherwise global summary for clinicians/admins
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def pregnancies_summary(request, patient_pk=None):
+@async_api_view
+async def pregnancies_summary(request, patient_pk=None):
     """
     Return basic summary statistics for pregnancies as JSON.
 
@@ -107,48 +188,15 @@ def pregnancies_summary(request, patient_pk=None):
     we automatically scope to the authenticated patient's record.
     """
     user = request.user
-    if getattr(user, 'role', None) == 'patient':
-        try:
-            patient_obj = Patient.objects.get(user=user)
-        except Patient.DoesNotExist:
-            return Response({'detail': 'Patient record not found.'}, status=status.HTTP_404_NOT_FOUND)
-        
-        # if a different patient_pk was requested, forbid
-        if patient_pk is not None and int(patient_pk) != patient_obj.id:
-            return Response({'detail': 'Forbidden.'}, status=status.HTTP_403_FORBIDDEN)
-        
-        # scope to the authenticated patient
-        patient_pk = patient_obj.id
-    
-    # For non-patient users, we allow any scope but still enforce role-based access control
-    elif getattr(user, 'role', None) not in ['doctor', 'nurse', 'admin']:
-        return Response({'detail': 'Forbidden.'}, status=status.HTTP_403_FORBIDDEN)
-
-    qs = _build_pregnancy_queryset(request, {'patient_pk': patient_pk})
-    total = qs.count()
-    by_blood = {item['blood_type']: item['count'] for item in qs.values('blood_type').annotate(count=Count('id'))}
-    avg_ga = qs.aggregate(avg_ga=Avg('gestational_age_weeks'))['avg_ga']
-
-    monthly_qs = qs.annotate(month=TruncMonth('expected_delivery_date')).values('month').annotate(count=Count('id')).order_by('month')
-    monthly = []
-    for m in monthly_qs:
-        month_val = m.get('month')
-        if month_val is None:
-            month_str = None
-        elif hasattr(month_val, 'date'):
-            month_str = month_val.date().isoformat()
-        elif hasattr(month_val, 'isoformat'):
-            month_str = month_val.isoformat()
-        else:
-            month_str = str(month_val)
-        monthly.append({'month': month_str, 'count': m['count']})
-
-    data = {
-        'total_pregnancies': total,
-        'by_blood_type': by_blood,
-        'average_gestational_age_weeks': avg_ga,
-        'monthly_expected_deliveries': monthly,
-    }
+    patient_pk, error = await summary_patient_pk(user, patient_pk)
+    if error:
+        return error
+
+    # Read the precomputed rollup buckets for this scope instead of scanning the pregnancies table,
+    # cached per scope and role until a pregnancy in the scope changes
+    scope, scope_id = ('patient', int(patient_pk)) if patient_pk else ('global', 0)
 
-    return Response(data)
+    async def build():
+        return pregnancy_summary_data(await aread_rollup(PREGNANCY_ROLLUP, scope, scope_id))
 
+    return await asummary_response(PREGNANCY_ROLLUP.metric, scope, scope_id, user.role, build)
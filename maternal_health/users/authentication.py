@@ -0,0 +1,111 @@
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from patients.identity import get_patient_id
+
+
+'''
+
+JWT authentication without a user lookup. Access tokens carry the
+user's role and, for patients, their Patient id as claims; the
+authentication class turns them into a CustomUser instance with only
+`id` and `role` loaded, so role checks and role-scoped querysets run
+without reading the user row. Any other field is loaded on first access
+like any deferred field. Claims are re-read from the database whenever
+a refresh token is used, which also rejects deactivated users.
+
+'''
+
+ROLE_CLAIM = 'role'
+PATIENT_ID_CLAIM = 'patient_id'
+
+
+def stamp_claims(token, user):
+    """Set the role and patient id claims of `token` from `user`."""
+    token[ROLE_CLAIM] = user.role
+    token[PATIENT_ID_CLAIM] = get_patient_id(user)
+    return token
+
+
+def tokens_for_user(user):
+    """A fresh refresh/access pair for `user`, e.g. right after registration."""
+    refresh = stamp_claims(RefreshToken.for_user(user), user)
+    return {'refresh': str(refresh), 'access': str(refresh.access_token)}
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    Authenticate `Authorization: Bearer <access token>` from the token's claims alone.
+
+    request.user is a CustomUser with `id` and `role` loaded from the token and
+    `patient_id` set to the caller's Patient id (None for clinicians and admins).
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+            role = validated_token[ROLE_CLAIM]
+        except KeyError as exc:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from exc
+
+        user_model = get_user_model()
+        # Fields are given in model order, as from_db() expects; the rest stay deferred
+        user = user_model.from_db(DEFAULT_DB_ALIAS, [user_model._meta.pk.attname, 'role'], [user_id, role])
+        user.patient_id = validated_token.get(PATIENT_ID_CLAIM)
+        return user
+
+
+class PatientTokenAuthentication(TokenAuthentication):
+    """
+    DRF token authentication that loads the user's Patient record in the same query as the token,
+    so get_patient_id() needs no further lookup.
+    """
+
+    def authenticate_credentials(self, key):
+        model = self.get_model()
+        try:
+            token = model.objects.select_related('user', 'user__patient').get(key=key)
+        except model.DoesNotExist:
+            raise AuthenticationFailed(_('Invalid token.'))
+
+        if not token.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return (token.user, token)
+
+
+# Login for JWT clients: the usual access/refresh pair, with role and patient id claims
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return stamp_claims(super().get_token(user), user)
+
+
+# Refresh with rotation: the old refresh token is blacklisted and the claims are re-read, so role changes
+# reach the next access token
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+
+        user = get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: refresh.get(api_settings.USER_ID_CLAIM)}).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        stamp_claims(refresh, user)
+
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data['refresh'] = str(refresh)
+        return data
@@ -0,0 +1,37 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.provisioning import PROVISION_BATCH_SIZE, provision_users
+
+
+class Command(BaseCommand):
+    help = (
+        'Create users, and the patient profiles of patient users, in bulk from a CSV file with a header row '
+        '(username, email, password, role, first_name, last_name, phone_number, date_of_birth) or a JSON list.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or .json file of users; only username is required.')
+        parser.add_argument('--batch-size', type=int, default=PROVISION_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            with open(path, newline='', encoding='utf-8') as stream:
+                if path.endswith('.json'):
+                    rows = json.load(stream)
+                else:
+                    # Empty cells mean "not given", so optional columns may be left blank
+                    rows = [{name: value for name, value in row.items() if value not in ('', None)} for row in csv.DictReader(stream)]
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Cannot read {path}: {exc}')
+        if not isinstance(rows, list):
+            raise CommandError('Expected a list of users.')
+
+        results = provision_users(rows, batch_size=options['batch_size'])
+        failed = [result for result in results if result['status'] == 'error']
+        for result in failed:
+            self.stderr.write(f"Row {result['index'] + 1}: {json.dumps(result['errors'])}")
+        self.stdout.write(self.style.SUCCESS(f'Created {len(results) - len(failed)} users, {len(failed)} rows failed'))
@@ -0,0 +1,162 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import password_validation
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from rest_framework import serializers
+
+from patients.models import Patient
+from patients.search import get_search_backend
+from patients.signals import patient_defaults
+from .models import CustomUser
+
+
+'''
+
+Bulk user provisioning, for onboarding a facility's register in one go.
+Rows are validated in memory against the usernames and emails already
+taken (looked up in a few IN queries for the whole submission), then
+users and the Patient profiles of patient users are inserted with
+bulk_create, `batch_size` users at a time, instead of one save and one
+signal round trip per user. Password hashing is deliberately slow and
+dominates the run time, so it runs in a thread pool; rows without a
+password get an unusable one and the user sets it through a reset.
+
+'''
+
+# Users inserted per bulk_create
+PROVISION_BATCH_SIZE = 500
+
+# Upper bound on users accepted by one API submission; the command has no limit
+PROVISION_MAX_ROWS = 5000
+
+# Values per IN (...) lookup, below SQLite's bound parameter limit
+_LOOKUP_CHUNK = 500
+
+
+# Serializer for one provisioned user. Uniqueness is checked against context['taken'], the usernames
+# and emails already in use, which every accepted row is added to so duplicates in a submission are caught too.
+class ProvisionUserSerializer(serializers.Serializer):
+    username = serializers.CharField(max_length=150, validators=[UnicodeUsernameValidator()])
+    email = serializers.EmailField(required=False, allow_blank=True, default='')
+    password = serializers.CharField(write_only=True, required=False, allow_blank=True, default='')
+    role = serializers.ChoiceField(choices=CustomUser.ROLE_CHOICES, default='patient')
+    first_name = serializers.CharField(max_length=150, required=False, allow_blank=True, default='')
+    last_name = serializers.CharField(max_length=150, required=False, allow_blank=True, default='')
+
+    # Copied to the Patient profile of patient users
+    phone_number = serializers.CharField(max_length=20, required=False, allow_blank=True, default='')
+    date_of_birth = serializers.DateField(required=False, allow_null=True, default=None)
+
+    def validate_phone_number(self, value):
+        if value and not re.match(r'^\+?1?\d{9,15}$', value):
+            raise serializers.ValidationError("Invalid phone number format.")
+        return value
+
+    def validate(self, data):
+        taken = self.context['taken']
+        if data['username'] in taken['username']:
+            raise serializers.ValidationError({"username": "Username is already taken."})
+        if data['email'] and data['email'] in taken['email']:
+            raise serializers.ValidationError({"email": "Email is already registered."})
+        if data['password']:
+            try:
+                password_validation.validate_password(data['password'], user=CustomUser(username=data['username'], email=data['email']))
+            except ValidationError as exc:
+                raise serializers.ValidationError({"password": list(exc.messages)})
+
+        taken['username'].add(data['username'])
+        if data['email']:
+            taken['email'].add(data['email'])
+        return data
+
+
+def _taken(rows):
+    """Usernames and emails of `rows` that already belong to a user."""
+    taken = {'username': set(), 'email': set()}
+    for field in taken:
+        values = list({row.get(field) for row in rows if isinstance(row, dict) and isinstance(row.get(field), str) and row.get(field)})
+        for start in range(0, len(values), _LOOKUP_CHUNK):
+            lookup = {f'{field}__in': values[start:start + _LOOKUP_CHUNK]}
+            taken[field].update(CustomUser.objects.filter(**lookup).values_list(field, flat=True))
+    return taken
+
+
+def _hash_passwords(passwords):
+    # The PBKDF2 hashers release the GIL, so threads hash on every core; blank passwords become unusable ones
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+        return list(pool.map(make_password, [password or None for password in passwords]))
+
+
+def provision_users(rows, batch_size=PROVISION_BATCH_SIZE):
+    """
+    Validate `rows` (dicts of ProvisionUserSerializer fields) and create the valid ones with their Patient profiles.
+
+    Returns one result per row, like the visit batch endpoint: {'index', 'status': 'created', 'id'}
+    or {'index', 'status': 'error', 'errors'}. Valid rows are created in one transaction.
+    """
+    item_serializer = ProvisionUserSerializer(context={'taken': _taken(rows)})
+    results = []
+    accepted = []
+    for index, row in enumerate(rows):
+        try:
+            data = item_serializer.run_validation(row)
+        except serializers.ValidationError as exc:
+            results.append({'index': index, 'status': 'error', 'errors': exc.detail})
+            continue
+        accepted.append(data)
+        results.append({'index': index, 'status': 'created'})
+
+    passwords = _hash_passwords([data['password'] for data in accepted])
+    users = []
+    with transaction.atomic():
+        for start in range(0, len(accepted), batch_size):
+            users += _create_batch(accepted[start:start + batch_size], passwords[start:start + batch_size])
+
+    created = iter(users)
+    for result in results:
+        if result['status'] == 'created':
+            result['id'] = next(created).pk
+    return results
+
+
+def _create_batch(rows, passwords):
+    users = insert_users([
+        CustomUser(
+            username=data['username'], email=data['email'], password=password, role=data['role'],
+            first_name=data['first_name'], last_name=data['last_name'],
+        )
+        for data, password in zip(rows, passwords)
+    ])
+    # bulk_create sends no post_save, so the profiles the signal would create are inserted here
+    insert_patients([
+        Patient(user=user, **patient_defaults(user, phone_number=data['phone_number'], date_of_birth=data['date_of_birth']))
+        for user, data in zip(users, rows) if user.role == 'patient'
+    ])
+    return users
+
+
+def insert_users(users):
+    """bulk_create `users` and make sure each has its id set. Sends no signals."""
+    CustomUser.objects.bulk_create(users)
+    if any(user.pk is None for user in users):
+        # Backends that cannot return ids from a bulk insert
+        ids = dict(CustomUser.objects.filter(username__in=[user.username for user in users]).values_list('username', 'id'))
+        for user in users:
+            user.pk = ids[user.username]
+    return users
+
+
+def insert_patients(patients):
+    """bulk_create `patients` and add them to the patient search index, which their post_save would have done."""
+    Patient.objects.bulk_create(patients)
+    backend = get_search_backend()
+    if backend is not None and patients:
+        if any(patient.pk is None for patient in patients):
+            patients = list(Patient.objects.filter(user__in=[patient.user_id for patient in patients]).only('id'))
+        backend.index([patient.pk for patient in patients])
+    return patients
@@ -1,6 +1,16 @@
+import os
+import tempfile
+from io import StringIO
+
 from rest_framework.test import APITestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+from patients.models import Patient
+from pregnancies.models import Pregnancy
 from .models import CustomUser
 
 # Test case for user registration
@@ -19,4 +29,120 @@ class RegistrationTest(APITestCase):
 		response = self.client.post(url, payload, format='json')
 		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 		self.assertIn('token', response.data)
+		self.assertEqual(AccessToken(response.data['access'])['role'], 'patient')
 		self.assertTrue(CustomUser.objects.filter(username='testpatient').exists())
+
+
+# Test case for JWT login, claims, rotation and logout
+class JWTAuthenticationTest(APITestCase):
+	def setUp(self):
+		self.patient_user = CustomUser.objects.create_user(username='patient1', password='testpass123', role='patient')
+		self.patient = Patient.objects.get(user=self.patient_user)
+		other = Patient.objects.get(user=CustomUser.objects.create_user(username='patient2', password='testpass123', role='patient'))
+		self.pregnancy = Pregnancy.objects.create(patient=self.patient, gestational_age_weeks=20)
+		Pregnancy.objects.create(patient=other, gestational_age_weeks=30)
+		CustomUser.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+
+	def _login(self, username):
+		response = self.client.post(reverse('token_obtain_pair'), {'username': username, 'password': 'testpass123'}, format='json')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		return response.data
+
+	def test_access_token_carries_role_and_patient_claims(self):
+		access = AccessToken(self._login('patient1')['access'])
+		self.assertEqual((access['role'], access['patient_id']), ('patient', self.patient.id))
+
+		access = AccessToken(self._login('doctor1')['access'])
+		self.assertEqual((access['role'], access['patient_id']), ('doctor', None))
+
+	def test_requests_do_not_load_the_user_row(self):
+		self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self._login('patient1')['access']}")
+		with CaptureQueriesContext(connection) as captured:
+			response = self.client.get('/api/pregnancies/')
+
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual([row['id'] for row in response.data['results']], [self.pregnancy.id])
+		self.assertFalse([query['sql'] for query in captured if 'FROM "users_customuser"' in query['sql']])
+
+	def test_refresh_rotates_and_updates_claims(self):
+		tokens = self._login('patient1')
+		CustomUser.objects.filter(pk=self.patient_user.pk).update(role='nurse')
+
+		response = self.client.post(reverse('token_refresh'), {'refresh': tokens['refresh']}, format='json')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertNotEqual(response.data['refresh'], tokens['refresh'])
+		self.assertEqual(AccessToken(response.data['access'])['role'], 'nurse')
+
+		# The rotated-out refresh token is blacklisted
+		response = self.client.post(reverse('token_refresh'), {'refresh': tokens['refresh']}, format='json')
+		self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+	def test_logout_blacklists_the_refresh_token(self):
+		tokens = self._login('doctor1')
+		response = self.client.post(reverse('token_blacklist'), {'refresh': tokens['refresh']}, format='json')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+		response = self.client.post(reverse('token_refresh'), {'refresh': tokens['refresh']}, format='json')
+		self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+	def test_invalid_bearer_token_is_rejected(self):
+		self.client.credentials(HTTP_AUTHORIZATION='Bearer not-a-token')
+		response = self.client.get('/api/pregnancies/')
+		self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+		self.assertIn('Bearer', response['WWW-Authenticate'])
+
+
+# Test case for bulk user provisioning
+class ProvisioningTest(APITestCase):
+	def setUp(self):
+		self.admin = CustomUser.objects.create_user(username='admin1', password='testpass123', role='admin')
+		CustomUser.objects.create_user(username='taken', email='taken@clinic.rw', password='testpass123', role='doctor')
+
+	def test_provision_users_in_bulk(self):
+		rows = [
+			{'username': 'mother1', 'first_name': 'Alice', 'phone_number': '+250788000001', 'date_of_birth': '1995-04-02'},
+			{'username': 'mother2', 'email': 'mother2@clinic.rw'},
+			{'username': 'nurse1', 'role': 'nurse', 'password': 'StrongPass123!'},
+			{'username': 'mother1'},
+			{'username': 'other', 'email': 'taken@clinic.rw'},
+			{'username': 'bad name!'},
+		]
+		self.client.force_authenticate(user=self.admin)
+		with CaptureQueriesContext(connection) as captured:
+			response = self.client.post(reverse('provision_users'), rows, format='json')
+
+		self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+		self.assertEqual((response.data['created'], response.data['failed']), (3, 3))
+		self.assertEqual([result['status'] for result in response.data['results']], ['created'] * 3 + ['error'] * 3)
+		self.assertIn('username', response.data['results'][3]['errors'])
+		self.assertIn('email', response.data['results'][4]['errors'])
+
+		patient = Patient.objects.get(user__username='mother1')
+		self.assertEqual((patient.first_name, patient.phone_number, str(patient.date_of_birth)), ('Alice', '+250788000001', '1995-04-02'))
+		self.assertTrue(patient.medical_record_number.startswith('MRN-mother1-'))
+		self.assertTrue(Patient.objects.filter(user__username='mother2').exists())
+		self.assertFalse(Patient.objects.filter(user__username='nurse1').exists())
+		self.assertTrue(CustomUser.objects.get(username='nurse1').check_password('StrongPass123!'))
+		self.assertFalse(CustomUser.objects.get(username='mother2').has_usable_password())
+
+		# One insert per table, whatever the number of users
+		inserts = [query['sql'] for query in captured if query['sql'].startswith('INSERT INTO "users_customuser"')]
+		self.assertEqual(len(inserts), 1)
+
+	def test_provisioning_is_for_admins(self):
+		self.client.force_authenticate(user=CustomUser.objects.get(username='taken'))
+		response = self.client.post(reverse('provision_users'), [{'username': 'mother1'}], format='json')
+		self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+	def test_provision_users_command(self):
+		handle, path = tempfile.mkstemp(suffix='.csv')
+		with os.fdopen(handle, 'w') as stream:
+			stream.write('username,email,role,date_of_birth\nmother1,,patient,\nmidwife1,midwife1@clinic.rw,nurse,\ntaken,,patient,\n')
+		self.addCleanup(os.remove, path)
+
+		stdout, stderr = StringIO(), StringIO()
+		call_command('provision_users', path, batch_size=1, stdout=stdout, stderr=stderr)
+		self.assertIn('Created 2 users, 1 rows failed', stdout.getvalue())
+		self.assertIn('Row 3', stderr.getvalue())
+		self.assertTrue(Patient.objects.filter(user__username='mother1').exists())
+		self.assertEqual(CustomUser.objects.get(username='midwife1').role, 'nurse')
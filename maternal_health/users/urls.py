@@ -1,5 +1,6 @@
 from django.urls import path
-from .views import profile, admin_dashboard, login_view, logout_view, RegisterView
+from rest_framework_simplejwt.views import TokenBlacklistView, TokenObtainPairView, TokenRefreshView
+from .views import profile, admin_dashboard, login_view, logout_view, RegisterView, ProvisionUsersView
 
 
 urlpatterns = [
@@ -7,9 +8,17 @@ urlpatterns = [
     path('login/', login_view, name='login'),
     path('logout/', logout_view, name='logout'),
 
+    # JWT: obtain an access/refresh pair, rotate the refresh token, and revoke it on logout
+    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/blacklist/', TokenBlacklistView.as_view(), name='token_blacklist'),
+
     # User registration and profile routes
     path('register/', RegisterView.as_view(), name='register'),
 
+    # Bulk user provisioning (admins only)
+    path('users/provision/', ProvisionUsersView.as_view(), name='provision_users'),
+
     # User profile and admin dashboard routes
     path('profile/', profile, name='profile'),  
     path('admin-dashboard/', admin_dashboard, name='admin_dashboard'), 
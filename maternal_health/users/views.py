@@ -6,8 +6,11 @@ from django.contrib.auth import authenticate, login
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from .authentication import tokens_for_user
+from .permissions import IsAdminRole
+from .provisioning import PROVISION_MAX_ROWS, provision_users
 from .serializer import RegistrationSerializer
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.contrib.auth import logout as django_logout
@@ -34,7 +37,8 @@ class RegisterView(APIView):
                 user, token = serializer.save()  # make sure serializer returns both
                 return Response({
                     'message': f'{user.role.capitalize()} - {user.username.capitalize()} registered successfully',
-                    'token': token.key
+                    'token': token.key,
+                    **tokens_for_user(user),  # JWT access/refresh pair
                 }, status=status.HTTP_201_CREATED)
             except Exception as e:
                 return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -42,6 +46,29 @@ class RegisterView(APIView):
 
 
 
+# Bulk user provisioning for admins: a JSON list of users, created with their patient profiles in bulk.
+# Each row gets its own result; valid rows are created even if others fail (207 Multi-Status).
+class ProvisionUsersView(APIView):
+    permission_classes = [IsAuthenticated, IsAdminRole]
+
+    def post(self, request):
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            return Response({'detail': 'Expected a non-empty list of users.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > PROVISION_MAX_ROWS:
+            return Response({'detail': f'A submission may contain at most {PROVISION_MAX_ROWS} users.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = provision_users(rows)
+        created = sum(result['status'] == 'created' for result in results)
+        if not created:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif created < len(rows):
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response({'created': created, 'failed': len(rows) - created, 'results': results}, status=response_status)
+
+
 # Login view - plain Django view to bypass CSRF
 @csrf_exempt
 def login_view(request):
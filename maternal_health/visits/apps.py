@@ -1,5 +1,9 @@
 from django.apps import AppConfig
 
 
+# VisitsConfig with ready() method to import the signal handler that deletes partitioned visits.
 class VisitsConfig(AppConfig):
     name = 'visits'
+
+    def ready(self):
+        import visits.signals  # noqa: F401
@@ -0,0 +1,54 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from analytics.rollups import VISIT_ROLLUP, rebuild_rollups
+from visits.models import Visit, parse_blood_pressure
+
+
+class Command(BaseCommand):
+    help = 'Fill Visit.systolic/diastolic from blood_pressure in primary-key chunks, then rebuild the visit rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--all', action='store_true', help='Re-parse visits that already have numeric values.')
+        parser.add_argument('--skip-rollups', action='store_true', help='Do not rebuild the visit rollups afterwards.')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        chunk_size = options['chunk_size']
+        visits = Visit.objects.using(using)
+        if not options['all']:
+            visits = visits.filter(systolic__isnull=True)
+
+        last_pk = 0
+        scanned = updated = 0
+        while True:
+            # Walk the primary key so each chunk is an index range scan, however far in we are
+            rows = list(visits.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'blood_pressure')[:chunk_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            scanned += len(rows)
+
+            # Readings repeat a lot ("120/80"), so update each distinct reading with one statement
+            by_reading = defaultdict(list)
+            for pk, reading in rows:
+                parsed = parse_blood_pressure(reading)
+                if parsed != (None, None) or options['all']:
+                    by_reading[parsed].append(pk)
+
+            with transaction.atomic(using=using):
+                for (systolic, diastolic), pks in by_reading.items():
+                    updated += Visit.objects.using(using).filter(pk__in=pks).update(systolic=systolic, diastolic=diastolic)
+
+            self.stdout.write(f'Scanned {scanned} visits, updated {updated}')
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled blood pressure on {updated} of {scanned} visits'))
+
+        # update() bypasses the rollup signals
+        if updated and not options['skip_rollups']:
+            buckets = rebuild_rollups(VISIT_ROLLUP, using=using)
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt visits rollups: {buckets} buckets'))
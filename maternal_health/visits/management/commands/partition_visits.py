@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from visits.partitions import (
+    PARTITION_PERIODS, PARTITIONS_AHEAD, add_partitions, is_partitioned, merge_partitions, partition_visits,
+    vacuum_partitions,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Partition the visits table by visit_date. On PostgreSQL the first run rebuilds the table with one '
+        'partition per period and later runs, e.g. from a monthly cron job, add the partitions ahead. On SQLite '
+        'each run moves the visits of closed periods into per-period tables.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', choices=PARTITION_PERIODS, default='month', help='Partition size for the first run.')
+        parser.add_argument('--ahead', type=int, default=PARTITIONS_AHEAD, help='Periods to create after the current one (PostgreSQL).')
+        parser.add_argument('--vacuum', type=int, default=0, metavar='N', help='Then VACUUM ANALYZE (SQLite: ANALYZE) the N latest partitions.')
+        parser.add_argument('--merge', action='store_true', help='Turn the partitioned table back into a single table.')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        try:
+            if options['merge']:
+                merge_partitions(connection)
+                self.stdout.write(self.style.SUCCESS('Merged the visit partitions into one table'))
+                return
+            if is_partitioned(connection):
+                created = add_partitions(options['ahead'], connection)
+            else:
+                created = partition_visits(options['period'], options['ahead'], connection)
+            self.stdout.write(self.style.SUCCESS(f'Created {len(created)} visit partitions: {", ".join(created) or "none"}'))
+            if options['vacuum']:
+                vacuumed = vacuum_partitions(options['vacuum'], connection)
+                self.stdout.write(self.style.SUCCESS(f'Vacuumed {", ".join(vacuumed)}'))
+        except ValueError as exc:
+            raise CommandError(str(exc))
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0001_generalvisit_postnatalvisit_prenatalvisit'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='visit',
+            name='visits_visi_visit_d_61b894_idx',
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['visit_date', 'id'], name='visits_visi_visit_d_4f1092_idx'),
+        ),
+    ]
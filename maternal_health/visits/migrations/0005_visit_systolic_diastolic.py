@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0004_visit_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visit',
+            name='diastolic',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='visit',
+            name='systolic',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['systolic', 'diastolic'], name='visits_visi_systoli_d6ccb6_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:01
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0005_visit_systolic_diastolic'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='visit',
+            options={'base_manager_name': 'objects'},
+        ),
+    ]
@@ -1,6 +1,21 @@
+import re
+
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+from .routing import VisitQuerySet
+
+
+BLOOD_PRESSURE_PATTERN = re.compile(r'^\s*(\d{2,3})\s*/\s*(\d{2,3})\s*$')
+
+
+# Split a "systolic/diastolic" reading such as "120/80" into integers; unreadable values give (None, None)
+def parse_blood_pressure(value):
+    match = BLOOD_PRESSURE_PATTERN.match(value or '')
+    if not match:
+        return None, None
+    return int(match.group(1)), int(match.group(2))
+
 
 # Base Visit model with common fields for both prenatal and postnatal visits
 class Visit(models.Model):
@@ -17,6 +32,9 @@ class Visit(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     visit_type = models.CharField(max_length=100, choices=VISIT_TYPES, db_index=True)
     blood_pressure = models.CharField(max_length=7)
+    # Numeric copies of blood_pressure so readings can be filtered and aggregated in the database
+    systolic = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
+    diastolic = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
     heart_rate = models.PositiveSmallIntegerField(validators=[MinValueValidator(30), MaxValueValidator(220)])
     hemoglobin_level = models.DecimalField(max_digits=4, decimal_places=1, validators=[MinValueValidator(0)], null=True, blank=True)
     weight_kg = models.DecimalField(max_digits=5, decimal_places=2, validators=[MinValueValidator(0)], null=True, blank=True)
@@ -41,13 +59,29 @@ class Visit(models.Model):
     created_by = models.ForeignKey('users.CustomUser', related_name='visit_created_by', on_delete=models.SET_NULL, null=True)
     updated_by = models.ForeignKey('users.CustomUser', related_name='visit_updated_by', on_delete=models.SET_NULL, null=True)
 
+    # Reads and updates also reach the visits moved to per-period tables on SQLite (routing.py)
+    objects = VisitQuerySet.as_manager()
+
     class Meta:
+        base_manager_name = 'objects'  # so cascades and Model.save() find partitioned visits too
         indexes = [
             models.Index(fields=['patient']),
             models.Index(fields=['provider']),
-            models.Index(fields=['visit_date']),
+            models.Index(fields=['visit_date', 'id']),  # keyset pagination order
+            models.Index(fields=['systolic', 'diastolic']),
         ]
 
+    # Keep systolic/diastolic in step with blood_pressure; bulk paths call this before bulk_create
+    def sync_blood_pressure(self):
+        self.systolic, self.diastolic = parse_blood_pressure(self.blood_pressure)
+
+    def save(self, *args, **kwargs):
+        self.sync_blood_pressure()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'blood_pressure' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'systolic', 'diastolic'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Visit {self.id} - Patient {self.patient} "
 
@@ -0,0 +1,299 @@
+import time
+from datetime import timedelta
+
+from django.db import connection as default_connection, models, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import Visit
+from .routing import (
+    forget_partitions, move_visits, next_period, parse_partition, partition_bound, period_start, refresh_interval,
+    sqlite_partition_names,
+)
+
+
+'''
+
+Time partitioning of the visits table, the fastest-growing one. On
+PostgreSQL the partition_visits command rebuilds visits_visit as a table
+partitioned by RANGE (visit_date), with one partition per month or year
+and a DEFAULT partition for visits outside them, and later adds the
+partitions for the coming periods. The model and every query stay the
+same: queries that bound visit_date (the ?from=/?to= parameters of the
+visit list and summary, keyset pages) only read the partitions in range,
+inserts and index updates land in the small current partition, and
+VACUUM can be run on the recent partitions alone.
+
+SQLite has no table partitioning. There the command moves the visits of
+each closed month or year out of visits_visit into a table of its own,
+with the same columns and indexes, and Visit's queryset (routing.py)
+reads the tables in a query's date range. New visits and edits to
+recent ones stay in the small visits_visit table.
+
+'''
+
+PARTITION_PERIODS = ('month', 'year')
+
+# Partitions created ahead of the current period (PostgreSQL)
+PARTITIONS_AHEAD = 3
+
+DEFAULT_PARTITION_SUFFIX = 'pdefault'
+
+
+def partition_name(start, period, table=Visit._meta.db_table):
+    return f'{table}_p{start:%Y}' if period == 'year' else f'{table}_p{start:%Y_%m}'
+
+
+def partition_ranges(first, last, period):
+    """(name, start, end) of the partitions covering the days `first` to `last`; `end` is exclusive."""
+    ranges = []
+    start = period_start(first, period)
+    while start <= last:
+        end = next_period(start, period)
+        ranges.append((partition_name(start, period), start, end))
+        start = end
+    return ranges
+
+
+def _quote(name):
+    return default_connection.ops.quote_name(name)
+
+
+def partition_statements(table, ranges):
+    """
+    SQL adding the partitions in `ranges` to the partitioned `table`, each moving the rows of its
+    range out of the DEFAULT partition first (PostgreSQL refuses to add a partition whose rows are
+    still in the default one). Returns a list of (sql, params).
+    """
+    default = _quote(f'{table}_{DEFAULT_PARTITION_SUFFIX}')
+    statements = []
+    for name, start, end in ranges:
+        params = [partition_bound(start), partition_bound(end)]
+        statements += [
+            (f'CREATE TABLE {_quote(name)} (LIKE {_quote(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', []),
+            (
+                f'WITH moved AS (DELETE FROM {default} WHERE visit_date >= %s AND visit_date < %s RETURNING *) '
+                f'INSERT INTO {_quote(name)} SELECT * FROM moved',
+                params,
+            ),
+            (f'ALTER TABLE {_quote(table)} ATTACH PARTITION {_quote(name)} FOR VALUES FROM (%s) TO (%s)', params),
+        ]
+    return statements
+
+
+def _check_vendor(connection):
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        raise ValueError(f'Visit partitioning supports PostgreSQL and SQLite, not {connection.vendor}.')
+
+
+def is_partitioned(connection=default_connection):
+    if connection.vendor == 'sqlite':
+        return bool(sqlite_partition_names(connection, Visit._meta.db_table))
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [Visit._meta.db_table])
+        return cursor.fetchone() is not None
+
+
+def partitions(connection=default_connection):
+    """{name: (start, period)} of the visit partitions, without the default one."""
+    table = Visit._meta.db_table
+    if connection.vendor == 'sqlite':
+        names = sqlite_partition_names(connection, table)
+    elif is_partitioned(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                'WHERE pg_inherits.inhparent = to_regclass(%s)',
+                [table],
+            )
+            names = [name for name, in cursor.fetchall()]
+    else:
+        names = []
+    return {name: parse_partition(name, table) for name in names if parse_partition(name, table)}
+
+
+def _table_ddl(cursor, table):
+    # Index (other than the primary key) and foreign key definitions, to recreate on the rebuilt table
+    cursor.execute(
+        'SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s AND indexname NOT IN '
+        "(SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p')",
+        [table, table],
+    )
+    indexes = [definition for definition, in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+        [table],
+    )
+    foreign_keys = [f'ALTER TABLE {_quote(table)} ADD CONSTRAINT {_quote(name)} {definition}' for name, definition in cursor.fetchall()]
+    return indexes, foreign_keys
+
+
+def _rebuild(connection, partition_by, primary_key, ranges=()):
+    # Copy the visits into a new table with the same columns, then restore the sequence, indexes and
+    # foreign keys; the old table and its index names go before they are recreated
+    table = Visit._meta.db_table
+    old = f'{table}_old'
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {_quote(table)} IN ACCESS EXCLUSIVE MODE')
+        indexes, foreign_keys = _table_ddl(cursor, table)
+        cursor.execute(f'ALTER TABLE {_quote(table)} RENAME TO {_quote(old)}')
+        cursor.execute(
+            f'CREATE TABLE {_quote(table)} (LIKE {_quote(old)} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS)'
+            + (f' PARTITION BY {partition_by}' if partition_by else '')
+        )
+        if partition_by:
+            cursor.execute(f'CREATE TABLE {_quote(f"{table}_{DEFAULT_PARTITION_SUFFIX}")} PARTITION OF {_quote(table)} DEFAULT')
+            for sql, params in partition_statements(table, ranges):
+                cursor.execute(sql, params)
+        cursor.execute(f'INSERT INTO {_quote(table)} SELECT * FROM {_quote(old)}')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE((SELECT MAX(id) FROM {_quote(table)}), 0) + 1, false)",
+            [table],
+        )
+        cursor.execute(f'DROP TABLE {_quote(old)}')
+        cursor.execute(f'ALTER TABLE {_quote(table)} ADD PRIMARY KEY ({primary_key})')
+        for sql in indexes + foreign_keys:
+            cursor.execute(sql)
+
+
+def _create_sqlite_partition(cursor, table, name):
+    # The table's own DDL from sqlite_master, so the partition has the same columns, constraints and
+    # indexes; the indexes are renamed after the partition
+    cursor.execute("SELECT type, name, sql FROM sqlite_master WHERE tbl_name = %s AND sql IS NOT NULL ORDER BY type = 'index'", [table])
+    for kind, object_name, sql in cursor.fetchall():
+        sql = sql.replace(_quote(table), _quote(name))
+        if kind == 'index':
+            sql = sql.replace(_quote(object_name), _quote(f'{name}_{object_name}'), 1)
+        cursor.execute(sql)
+
+
+def _publish(connection):
+    # Other processes keep using their list of partition tables for up to VISIT_PARTITION_REFRESH seconds
+    forget_partitions(connection.alias)
+    time.sleep(refresh_interval())
+
+
+def _close_periods(connection, period):
+    """
+    Move the visits of the periods before the current one out of visits_visit into their partition
+    tables, creating the missing ones first. Returns the names of the tables created.
+    """
+    table = Visit._meta.db_table
+    current = period_start(timezone.localdate(), period)
+    # A plain queryset reads visits_visit alone
+    oldest = models.QuerySet(Visit).using(connection.alias).filter(
+        visit_date__lt=partition_bound(current),
+    ).aggregate(oldest=Min('visit_date'))['oldest']
+    if oldest is None:
+        return []
+    ranges = partition_ranges(timezone.localdate(oldest), current - timedelta(days=1), period)
+    existing = partitions(connection)
+    missing = [name for name, _, _ in ranges if name not in existing]
+    if missing:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            for name in missing:
+                _create_sqlite_partition(cursor, table, name)
+        # Readers must know a table before visits move into it
+        _publish(connection)
+    for name, start, end in ranges:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            move_visits(
+                cursor, Visit, table, name, 'visit_date >= %s AND visit_date < %s',
+                [connection.ops.adapt_datetimefield_value(partition_bound(bound)) for bound in (start, end)],
+            )
+    return missing
+
+
+def _merge_sqlite(connection):
+    names = list(partitions(connection))
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for name in names:
+            move_visits(cursor, Visit, name, Visit._meta.db_table)
+    # Readers that still list the emptied tables must stop using them before they are dropped
+    _publish(connection)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for name in names:
+            cursor.execute(f'DROP TABLE {_quote(name)}')
+    forget_partitions(connection.alias)
+
+
+def partition_visits(period='month', ahead=PARTITIONS_AHEAD, connection=default_connection):
+    """
+    Rebuild the visits table partitioned by visit_date, with partitions from the oldest visit's
+    period to `ahead` periods after the current one. Returns the names of the partitions created.
+
+    The table is locked while the rows are copied. The primary key becomes (id, visit_date), as
+    PostgreSQL requires of partitioned tables; ids still come from the same sequence.
+
+    On SQLite, the visits of every period before the current one move to their own tables, and
+    `ahead` does not apply: new visits always go to visits_visit.
+    """
+    _check_vendor(connection)
+    if period not in PARTITION_PERIODS:
+        raise ValueError(f'period must be one of {", ".join(PARTITION_PERIODS)}')
+    if is_partitioned(connection):
+        raise ValueError(f'{Visit._meta.db_table} is already partitioned.')
+    if connection.vendor == 'sqlite':
+        return _close_periods(connection, period)
+    oldest = Visit.objects.using(connection.alias).order_by('visit_date').values_list('visit_date', flat=True).first()
+    ranges = _ranges_ahead(period, ahead, timezone.localdate(oldest) if oldest else None)
+    _rebuild(connection, 'RANGE (visit_date)', 'id, visit_date', ranges)
+    return [name for name, _, _ in ranges]
+
+
+def merge_partitions(connection=default_connection):
+    """Rebuild the partitioned visits table as a single table again, e.g. before a migration that needs one."""
+    _check_vendor(connection)
+    if not is_partitioned(connection):
+        raise ValueError(f'{Visit._meta.db_table} is not partitioned.')
+    if connection.vendor == 'sqlite':
+        _merge_sqlite(connection)
+    else:
+        _rebuild(connection, None, 'id')
+
+
+def _ranges_ahead(period, ahead, first=None):
+    today = timezone.localdate()
+    last = period_start(today, period)
+    for _ in range(ahead):
+        last = next_period(last, period)
+    return partition_ranges(first or today, last, period)
+
+
+def add_partitions(ahead=PARTITIONS_AHEAD, connection=default_connection):
+    """
+    Add the missing partitions up to `ahead` periods after the current one. Returns their names.
+    On SQLite, move the visits of the periods closed since the last run instead.
+    """
+    existing = partitions(connection)
+    if not existing:
+        raise ValueError(f'{Visit._meta.db_table} is not partitioned; run partition_visits first.')
+    period = next(iter(existing.values()))[1]
+    if connection.vendor == 'sqlite':
+        return _close_periods(connection, period)
+    latest = max(start for start, _ in existing.values())
+    missing = [partition for partition in _ranges_ahead(period, ahead, latest) if partition[0] not in existing]
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for sql, params in partition_statements(Visit._meta.db_table, missing):
+            cursor.execute(sql, params)
+    return [name for name, _, _ in missing]
+
+
+def vacuum_partitions(recent, connection=default_connection):
+    """
+    VACUUM ANALYZE the `recent` latest partitions up to the current period and the default one. SQLite
+    can only VACUUM the whole file, so there they and visits_visit are analyzed.
+    """
+    current = timezone.localdate()
+    started = sorted((start, name) for name, (start, _) in partitions(connection).items() if start <= current)
+    names = [name for _, name in started[-recent:]] if recent > 0 else []
+    if connection.vendor == 'sqlite':
+        names.append(Visit._meta.db_table)
+    else:
+        names.append(f'{Visit._meta.db_table}_{DEFAULT_PARTITION_SUFFIX}')
+    with connection.cursor() as cursor:
+        for name in names:
+            cursor.execute(f'{"ANALYZE" if connection.vendor == "sqlite" else "VACUUM (ANALYZE)"} {_quote(name)}')
+    return names
@@ -1,5 +1,7 @@
 from rest_framework import permissions
 
+from patients.identity import get_patient_id
+
 
 # Custom permission class for visits to enforce role-based access control
 class VisitPermission(permissions.BasePermission):
@@ -17,8 +19,8 @@ class VisitPermission(permissions.BasePermission):
 
         if user.role == 'patient':
             if request.method in permissions.SAFE_METHODS:  # GET, HEAD, OPTIONS
-                # Visits link to patient → patient.user is the actual CustomUser
-                return obj.patient.user == user
+                # Compare ids so neither the patient nor its user is loaded
+                return obj.patient_id == get_patient_id(user)
             return False  # block create, update, delete for patients
 
         if user.role in ['doctor', 'nurse', 'admin']:
@@ -0,0 +1,250 @@
+import re
+import time
+from datetime import date, datetime, time as clock, timedelta
+
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.models.expressions import Col
+from django.db.models.lookups import Exact, GreaterThan, GreaterThanOrEqual, LessThan, LessThanOrEqual, Lookup, Range
+from django.db.models.sql import Query
+from django.db.models.sql.datastructures import BaseTable
+from django.db.models.sql.where import AND, WhereNode
+from django.utils import timezone
+
+
+'''
+
+Visits across the per-period tables of a partitioned SQLite database
+(see partitions.py). New visits always go to visits_visit; the
+partition_visits command moves the visits of closed months or years
+into tables named visits_visit_pYYYY_MM or visits_visit_pYYYY, and a
+query on Visit reads visits_visit together with the partition tables
+whose period overlaps the visit_date bounds of its filters. A query for
+a date range (the ?from=/?to= parameters, cursor pages) therefore reads
+only the tables of that range. Updates run on the same tables, and the
+post_delete handler in signals.py follows deletes into the partitions.
+
+Only queries that start from Visit see the partitions: a join into the
+visits from another model (Pregnancy.objects.filter(visit__...) or
+Count('visit')) reads visits_visit alone, so such queries go through a
+Visit subquery instead; VisitReverseJoinTests fails on those lookups in
+the project's code. On PostgreSQL the table itself is partitioned and
+none of this applies.
+
+'''
+
+PARTITION_FIELD = 'visit_date'
+
+# How long a process trusts its list of partition tables before reading it again. partition_visits
+# waits this long between creating tables and moving visits into them, and before dropping them.
+VISIT_PARTITION_REFRESH = 30  # seconds
+
+PARTITION_NAME = re.compile(r'_p(\d{4})(?:_(\d{2}))?$')
+
+# (alias, table) -> (monotonic time read, [(partition, start, end)] in period order)
+_catalogs = {}
+
+
+def period_start(value, period):
+    """First day of the month or year containing `value`."""
+    return value.replace(month=1, day=1) if period == 'year' else value.replace(day=1)
+
+
+def next_period(start, period):
+    if period == 'year':
+        return start.replace(year=start.year + 1)
+    return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+
+
+def partition_bound(day):
+    # Partition bounds are midnight in the project's time zone, like the ?from=/?to= filters
+    return timezone.make_aware(datetime.combine(day, clock.min), timezone.get_default_timezone())
+
+
+def parse_partition(name, table):
+    """(start, period) of the partition table `name` of `table`, or None if it is not one."""
+    match = PARTITION_NAME.search(name)
+    if not match or name != f'{table}{match.group(0)}':
+        return None
+    year, month = match.groups()
+    return date(int(year), int(month or 1), 1), 'month' if month else 'year'
+
+
+def sqlite_partition_names(connection, table):
+    # Read on the raw connection, so refreshing the list does not show up among a request's queries
+    connection.ensure_connection()
+    rows = connection.connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?", [f'{table}_p%'],
+    ).fetchall()
+    return [name for name, in rows if parse_partition(name, table)]
+
+
+def refresh_interval():
+    return getattr(settings, 'VISIT_PARTITION_REFRESH', VISIT_PARTITION_REFRESH)
+
+
+def forget_partitions(alias=None):
+    """Read the partition tables again on next use, for the database `alias` or all of them."""
+    for key in [key for key in _catalogs if alias is None or key[0] == alias]:
+        del _catalogs[key]
+
+
+def partition_catalog(connection, table):
+    """[(partition, start, end)] of the SQLite partition tables of `table`; `end` is exclusive."""
+    if connection.vendor != 'sqlite':
+        return []
+    key = (connection.alias, table)
+    checked = _catalogs.get(key)
+    if checked is None or time.monotonic() - checked[0] >= refresh_interval():
+        catalog = []
+        for name in sqlite_partition_names(connection, table):
+            start, period = parse_partition(name, table)
+            catalog.append((name, partition_bound(start), partition_bound(next_period(start, period))))
+        checked = _catalogs[key] = (time.monotonic(), sorted(catalog, key=lambda partition: partition[1]))
+    return checked[1]
+
+
+def partition_tables(connection, table, lower=None, upper=None):
+    """The partitions of `table` that can hold visits dated from `lower` to `upper` (None: unbounded)."""
+    return [
+        (name, start, end) for name, start, end in partition_catalog(connection, table)
+        if (lower is None or end > lower) and (upper is None or start <= upper)
+    ]
+
+
+def _lookup_bounds(lookup):
+    values = tuple(lookup.rhs) if isinstance(lookup, Range) else (lookup.rhs, lookup.rhs)
+    if not all(isinstance(value, datetime) and timezone.is_aware(value) for value in values):
+        return None, None
+    if isinstance(lookup, (GreaterThan, GreaterThanOrEqual)):
+        return values[0], None
+    if isinstance(lookup, LessThan):
+        return None, values[1] - timedelta(microseconds=1)  # the finest step datetimes are stored in
+    if isinstance(lookup, LessThanOrEqual):
+        return None, values[1]
+    if isinstance(lookup, (Exact, Range)):
+        return values
+    return None, None
+
+
+def visit_date_bounds(where, alias):
+    """
+    (lower, upper) of the visit_date values that can match `where`, for the visits table joined as
+    `alias`; either is None when unbounded. Only conditions that every matching row meets count,
+    so anything under OR or NOT is left out.
+    """
+    lower = upper = None
+    if where.connector != AND or where.negated:
+        return lower, upper
+    for child in where.children:
+        if isinstance(child, WhereNode):
+            bounds = visit_date_bounds(child, alias)
+        elif (
+            isinstance(child, Lookup) and isinstance(child.lhs, Col)
+            and child.lhs.alias == alias and child.lhs.target.name == PARTITION_FIELD
+        ):
+            bounds = _lookup_bounds(child)
+        else:
+            continue
+        lower = max((bound for bound in (lower, bounds[0]) if bound is not None), default=None)
+        upper = min((bound for bound in (upper, bounds[1]) if bound is not None), default=None)
+    return lower, upper
+
+
+def move_visits(cursor, model, source, target, condition='', params=()):
+    """Move the visits of the table `source` matching the SQL `condition` into `target`."""
+    quote = cursor.db.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in model._meta.concrete_fields)
+    where = f' WHERE {condition}' if condition else ''
+    cursor.execute(f'INSERT INTO {quote(target)} ({columns}) SELECT {columns} FROM {quote(source)}{where}', params)
+    cursor.execute(f'DELETE FROM {quote(source)}{where}', params)
+
+
+def _outside(connection, start, end):
+    column = connection.ops.quote_name(PARTITION_FIELD)
+    bounds = [connection.ops.adapt_datetimefield_value(bound) for bound in (start, end)]
+    return f'{column} < %s OR {column} >= %s', bounds
+
+
+def _retargeted(connection, table, partition):
+    # Run the UPDATE that Django builds for `table` on the partition table instead
+    table, partition = connection.ops.quote_name(table), connection.ops.quote_name(partition)
+
+    def execute(execute, sql, params, many, context):
+        if sql.startswith(f'UPDATE {table} '):
+            sql = sql.replace(f'UPDATE {table} ', f'UPDATE {partition} ', 1).replace(f'{table}.', f'{partition}.')
+        return execute(sql, params, many, context)
+
+    return connection.execute_wrapper(execute)
+
+
+class PartitionedVisitTable(BaseTable):
+    """The visits table in a query's FROM, with the partition tables in its visit_date range added."""
+
+    def as_sql(self, compiler, connection):
+        bounds = visit_date_bounds(compiler.query.where, self.table_alias)
+        tables = [name for name, _, _ in partition_tables(connection, self.table_name, *bounds)]
+        if not tables:
+            return super().as_sql(compiler, connection)
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(field.column) for field in compiler.query.get_meta().concrete_fields)
+        union = ' UNION ALL '.join(f'SELECT {columns} FROM {quote(name)}' for name in (self.table_name, *tables))
+        return f'({union}) {compiler.quote_name_unless_alias(self.table_alias)}', []
+
+
+class VisitQuery(Query):
+    base_table_class = PartitionedVisitTable
+
+
+class VisitQuerySet(models.QuerySet):
+    """Visits, read from and updated in visits_visit and its partition tables."""
+
+    def __init__(self, model=None, query=None, using=None, hints=None):
+        super().__init__(model, query or VisitQuery(model), using, hints)
+
+    def _partitions(self):
+        bounds = visit_date_bounds(self.query.where, self.query.base_table)
+        return partition_tables(connections[self.db], self.model._meta.db_table, *bounds)
+
+    def update(self, **kwargs):
+        partitions = self._partitions()
+        if not partitions:
+            return super().update(**kwargs)
+        connection = connections[self.db]
+        with transaction.atomic(using=self.db, savepoint=False):
+            rows = super().update(**kwargs)
+            for name, start, end in partitions:
+                with _retargeted(connection, self.model._meta.db_table, name):
+                    rows += super().update(**kwargs)
+                if PARTITION_FIELD in kwargs and not self._in_period(kwargs[PARTITION_FIELD], start, end):
+                    with connection.cursor() as cursor:
+                        move_visits(cursor, self.model, name, self.model._meta.db_table, *_outside(connection, start, end))
+        return rows
+
+    update.alters_data = True
+
+    def _update(self, values):
+        # Model.save() updates one visit by primary key, usually still in visits_visit: look for it
+        # there first, then in the partitions until it is found
+        rows = super()._update(values)
+        if rows:
+            return rows
+        connection = connections[self.db]
+        for name, start, end in self._partitions():
+            with _retargeted(connection, self.model._meta.db_table, name):
+                rows = super()._update(values)
+            if rows:
+                dated = [value for field, _, value in values if field.name == PARTITION_FIELD]
+                if dated and not self._in_period(dated[0], start, end):
+                    with connection.cursor() as cursor:
+                        move_visits(cursor, self.model, name, self.model._meta.db_table, *_outside(connection, start, end))
+                break
+        return rows
+
+    _update.alters_data = True
+    _update.queryset_only = False
+
+    @staticmethod
+    def _in_period(value, start, end):
+        # Values that are not plain dates (F() expressions, strings) may be anywhere
+        return isinstance(value, datetime) and timezone.is_aware(value) and start <= value < end
@@ -10,12 +10,12 @@ class PrenatalVisitSerializer(serializers.ModelSerializer):
         model = Visit
         fields = [
             "id", "patient", "patient_name", "pregnancy",'provider',
-            "visit_date", "visit_type",'blood_pressure', 'heart_rate', 'hemoglobin_level', 'weight_kg', 'height_cm',
+            "visit_date", "visit_type",'blood_pressure', 'systolic', 'diastolic', 'heart_rate', 'hemoglobin_level', 'weight_kg', 'height_cm',
             "uterine_height_cm", "fetal_heart_rate",
             "fetal_movement_count", "fetal_weight_estimate_g",'follow_up_date',
             "notes", "created_by", "updated_by",
         ]
-        read_only_fields = ["created_by", "updated_by", "visit_type", "patient", "pregnancy", "provider"]
+        read_only_fields = ["created_by", "updated_by", "visit_type", "patient", "pregnancy", "provider", "systolic", "diastolic"]
 
 # Serializer for postnatal visits, with fields relevant to postpartum care and newborn health.
 class PostnatalVisitSerializer(serializers.ModelSerializer):
@@ -25,12 +25,12 @@ class PostnatalVisitSerializer(serializers.ModelSerializer):
         model = Visit
         fields = [
             "id", "patient", "patient_name", "pregnancy", "delivery","provider",
-            "visit_date", "visit_type",'blood_pressure', 'heart_rate', 'hemoglobin_level', 'weight_kg', 'height_cm',
+            "visit_date", "visit_type",'blood_pressure', 'systolic', 'diastolic', 'heart_rate', 'hemoglobin_level', 'weight_kg', 'height_cm',
             "breastfeeding_status", "postpartum_complications",
             "newborn_health_issues", "follow_up_date", "notes",
             "created_by", "updated_by",
         ]
-        read_only_fields = ["created_by", "updated_by", "visit_type", "patient", "pregnancy", "provider", "delivery"]
+        read_only_fields = ["created_by", "updated_by", "visit_type", "patient", "pregnancy", "provider", "delivery", "systolic", "diastolic"]
 
 
 
@@ -65,6 +65,76 @@ class VisitSerializer(serializers.ModelSerializer):
         read_only_fields = ["created_by", "updated_by", "visit_type", "patient", "pregnancy", "provider", "delivery"]
 
 
+# Check that a visit's pregnancy and delivery belong to its patient and decide the visit type from them.
+# Shared by single visit creation and batch submission.
+def visit_type_for(patient_id, pregnancy=None, delivery=None):
+    if pregnancy is not None and patient_id is not None and pregnancy.patient_id != int(patient_id):
+        raise serializers.ValidationError("Pregnancy does not belong to this patient.")
+
+    if delivery is not None and patient_id is not None and delivery.patient_id != int(patient_id):
+        raise serializers.ValidationError("Delivery does not belong to this patient.")
+
+    if pregnancy is not None:
+        return "Antenatal"
+    if delivery is not None:
+        return "Postnatal"
+    return "General"
+
+
+# Serializer for one row of a batch visit submission. Parents are given as ids and resolved
+# against the records the view prefetched for the whole batch (context['parents']).
+class VisitBatchItemSerializer(serializers.ModelSerializer):
+    patient = serializers.IntegerField(min_value=1, required=False)
+    pregnancy = serializers.IntegerField(min_value=1, required=False, allow_null=True)
+    delivery = serializers.IntegerField(min_value=1, required=False, allow_null=True)
+
+    PARENTS = ("patient", "pregnancy", "delivery")
+
+    class Meta:
+        model = Visit
+        fields = [
+            "patient", "pregnancy", "delivery",
+            'blood_pressure', 'heart_rate', 'hemoglobin_level', 'weight_kg', 'height_cm',
+
+            # Prenatal fields
+            "uterine_height_cm", "fetal_heart_rate",
+            "fetal_movement_count", "fetal_weight_estimate_g",
+
+            # Postnatal fields
+            "breastfeeding_status", "postpartum_complications",
+            "newborn_health_issues",
+
+            # Common fields
+            "follow_up_date", "notes", "complications", "interventions", "referrals",
+        ]
+
+    def validate(self, data):
+        parents = {}
+        for name in self.PARENTS:
+            parent_id = data.pop(name, None)
+
+            # On nested routes the parent in the URL applies to every row
+            url_id = self.context.get(f"{name}_pk")
+            if url_id is not None:
+                if parent_id is not None and parent_id != int(url_id):
+                    raise serializers.ValidationError({name: f"Does not match the {name} in the URL."})
+                parent_id = int(url_id)
+
+            parent = None
+            if parent_id is not None:
+                parent = self.context["parents"][name].get(parent_id)
+                if parent is None:
+                    raise serializers.ValidationError({name: f"{name.capitalize()} not found."})
+            parents[name] = parent
+
+        if parents["patient"] is None:
+            raise serializers.ValidationError({"patient": "This field is required."})
+
+        data["visit_type"] = visit_type_for(parents["patient"].pk, parents["pregnancy"], parents["delivery"])
+        data.update(parents)
+        return data
+
+
 # Additional validation to ensure linked pregnancy/delivery belongs to the same patient
 def validate(self, data):
     patient = data.get("patient")
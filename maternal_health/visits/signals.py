@@ -0,0 +1,20 @@
+from django.db import connections
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import GeneralVisit, PostnatalVisit, PrenatalVisit, Visit
+from .routing import partition_tables
+
+
+# Deletes only run on visits_visit; a visit moved to a partition table (routing.py) is deleted there.
+@receiver(post_delete, sender=Visit)
+@receiver(post_delete, sender=PrenatalVisit)
+@receiver(post_delete, sender=PostnatalVisit)
+@receiver(post_delete, sender=GeneralVisit)
+def delete_from_partition(sender, instance, using, **kwargs):
+    connection = connections[using]
+    tables = partition_tables(connection, Visit._meta.db_table, instance.visit_date, instance.visit_date)
+    if tables:
+        with connection.cursor() as cursor:
+            for name, _, _ in tables:
+                cursor.execute(f'DELETE FROM {connection.ops.quote_name(name)} WHERE id = %s', [instance.pk])
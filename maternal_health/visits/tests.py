@@ -1,3 +1,675 @@
-from django.test import TestCase
+import ast
+import csv
+import io
+import os
+import re
+import sys
+import tracemalloc
+from datetime import date, timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from analytics.exports import export_fields
+from config.testing import QueryBudgetMixin
+from deliveries.models import Delivery
+from patients.models import Patient
+from pregnancies.models import Pregnancy, PregnancyRiskScore
+from pregnancies.risk import score_pregnancies
+from .models import Visit
+from .partitions import (
+    add_partitions, is_partitioned, merge_partitions, partition_ranges, partition_statements, partition_visits, partitions,
+)
+from .routing import forget_partitions
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+User = get_user_model()
+
+
+def _peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports kilobytes
+
+
+class VisitExportStreamingTests(TestCase):
+    """Test the streaming CSV export of visits"""
+
+    def setUp(self):
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.client = APIClient()
+
+    def _create_visit(self, **kwargs):
+        defaults = {
+            'patient': self.patient,
+            'provider': self.doctor_user,
+            'visit_type': 'Antenatal',
+            'blood_pressure': '120/80',
+            'heart_rate': 80,
+        }
+        defaults.update(kwargs)
+        return Visit.objects.create(**defaults)
+
+    def _insert_synthetic_visits(self, count):
+        """Insert `count` visits in a single statement so the test data never passes through Python."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < %s)
+                INSERT INTO visits_visit (
+                    patient_id, provider_id, visit_date, created_at, updated_at, visit_type,
+                    blood_pressure, heart_rate, hemoglobin_level, weight_kg, notes
+                )
+                SELECT %s, %s, '2024-01-01 08:00:00', '2024-01-01 08:00:00', '2024-01-01 08:00:00',
+                       'Antenatal', '120/80', 60 + n %% 40, 11.5, 62.25, 'synthetic visit ' || n
+                FROM seq
+                """,
+                [count, self.patient.id, self.doctor_user.id],
+            )
+
+    def test_export_is_streamed_with_stable_columns(self):
+        """Export should stream rows in model field order with converted values"""
+        visit = self._create_visit(hemoglobin_level='11.5', weight_kg='64.20', notes='first')
+        self.client.force_authenticate(user=self.doctor_user)
+        response = self.client.get('/api/analytics/visits/export/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+        self.assertEqual(rows[0], [f.attname for f in export_fields(Visit)])
+        record = dict(zip(rows[0], rows[1]))
+        self.assertEqual(record['id'], str(visit.id))
+        self.assertEqual(record['visit_date'], visit.visit_date.isoformat())
+        self.assertEqual(record['hemoglobin_level'], '11.5')
+        self.assertEqual(record['weight_kg'], '64.20')
+        self.assertEqual(record['pregnancy_id'], '')
+
+    def test_empty_export_returns_404(self):
+        """Export with no matching visits should return 404"""
+        self.client.force_authenticate(user=self.doctor_user)
+        response = self.client.get('/api/analytics/visits/export/')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(EXPORT_CHUNK_SIZE=200)
+    def test_export_holds_one_chunk_of_rows_at_a_time(self):
+        """Peak memory while streaming should follow the chunk size, not the row count"""
+        total = 20_000
+        self._insert_synthetic_visits(total)
+        self.client.force_authenticate(user=self.doctor_user)
+        response = self.client.get('/api/analytics/visits/export/')
+
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        lines = 0
+        for chunk in response.streaming_content:
+            lines += chunk.count(b'\n')
+        _, peak = tracemalloc.get_traced_memory()
+
+        self.assertEqual(lines, total + 1)
+        self.assertLess(peak, 1024 * 1024)  # the whole export is several megabytes
+
+    @tag('slow')
+    @skipUnless(os.environ.get('RUN_SLOW_TESTS'), 'set RUN_SLOW_TESTS=1 to run')
+    def test_export_of_one_million_visits_stays_under_memory_ceiling(self):
+        """Exporting 1M visits should not grow peak memory in proportion to the row count"""
+        if resource is None:
+            self.skipTest('resource module not available')
+
+        total = 1_000_000
+        self._insert_synthetic_visits(total)
+        self.client.force_authenticate(user=self.doctor_user)
+
+        peak_before = _peak_rss_bytes()
+        # Stream it rather than queue it as a background job
+        with self.settings(EXPORT_JOB_THRESHOLD=total):
+            response = self.client.get('/api/analytics/visits/export/')
+        lines = 0
+        for chunk in response.streaming_content:
+            lines += chunk.count(b'\n')
+        growth = _peak_rss_bytes() - peak_before
+
+        self.assertEqual(lines, total + 1)  # header + one line per visit
+        self.assertLess(growth, 64 * 1024 * 1024)
+
+
+class VisitListQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Test that visit list endpoints do not issue queries per visit"""
+
+    def setUp(self):
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.pregnancy = Pregnancy.objects.create(patient=self.patient, gestational_age_weeks=20)
+        self.client = APIClient()
+
+    def _make_visits(self, count):
+        for _ in range(count):
+            Visit.objects.create(
+                patient=self.patient, pregnancy=self.pregnancy, provider=self.doctor_user,
+                visit_type='Antenatal', blood_pressure='120/80', heart_rate=80,
+            )
+
+    def test_global_visit_list(self):
+        """Clinician visit list should cost the same for one visit or a full page"""
+        self.client.force_authenticate(user=self.doctor_user)
+        self.assertListQueriesConstant('/api/visits/', self._make_visits, max_queries=2)
+
+    def test_pregnancy_visit_list(self):
+        """Nested pregnancy visit list should cost the same for one visit or a full page"""
+        self.client.force_authenticate(user=self.doctor_user)
+        url = f'/api/patients/{self.patient.id}/pregnancies/{self.pregnancy.id}/visits/'
+        self.assertListQueriesConstant(url, self._make_visits, max_queries=3)
+
+    def test_patient_own_visit_list(self):
+        """Patient visit list should cost the same for one visit or a full page"""
+        self.client.force_authenticate(user=self.patient_user)
+        self.assertListQueriesConstant('/api/visits/', self._make_visits, max_queries=2)
+
+
+class VisitBatchSubmissionTests(TestCase):
+    """Test the batch visit submission endpoint"""
+
+    def setUp(self):
+        self.patient_user_1 = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient_1 = Patient.objects.get(user=self.patient_user_1)
+        self.patient_user_2 = User.objects.create_user(username='patient2', password='testpass123', role='patient')
+        self.patient_2 = Patient.objects.get(user=self.patient_user_2)
+        self.nurse_user = User.objects.create_user(username='nurse1', password='testpass123', role='nurse')
+        self.pregnancy_1 = Pregnancy.objects.create(patient=self.patient_1, gestational_age_weeks=20)
+        self.pregnancy_2 = Pregnancy.objects.create(patient=self.patient_2, gestational_age_weeks=30)
+        self.delivery_2 = Delivery.objects.create(
+            pregnancy=self.pregnancy_2, patient=self.patient_2, delivery_mode='vaginal', birth_weight_g=3200,
+            place_of_delivery='Hospital A', skilled_birth_attendant=True, newborn_gender='Female',
+            apgar_score_1min=8, apgar_score_5min=9,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.nurse_user)
+
+    def _row(self, patient, **kwargs):
+        row = {'patient': patient.id, 'blood_pressure': '120/80', 'heart_rate': 80}
+        row.update(kwargs)
+        return row
+
+    def test_batch_reports_each_row(self):
+        """Valid visits across patients should be created and invalid ones reported without blocking the rest"""
+        rows = [
+            self._row(self.patient_1, pregnancy=self.pregnancy_1.id, hemoglobin_level='11.5'),
+            self._row(self.patient_2, delivery=self.delivery_2.id, breastfeeding_status=True),
+            self._row(self.patient_1, pregnancy=self.pregnancy_2.id),  # pregnancy belongs to patient 2
+            self._row(self.patient_2),
+            self._row(self.patient_1, delivery=999999),
+            self._row(self.patient_1, heart_rate=500),
+        ]
+        response = self.client.post('/api/visits/batch/', rows, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        body = response.json()
+        self.assertEqual((body['created'], body['failed']), (3, 3))
+        results = body['results']
+        self.assertEqual([r['status'] for r in results], ['created', 'created', 'error', 'created', 'error', 'error'])
+        self.assertIn('delivery', results[4]['errors'])
+        self.assertIn('heart_rate', results[5]['errors'])
+
+        visit_types = [Visit.objects.get(pk=results[i]['id']).visit_type for i in (0, 1, 3)]
+        self.assertEqual(visit_types, ['Antenatal', 'Postnatal', 'General'])
+        visit = Visit.objects.get(pk=results[1]['id'])
+        self.assertEqual((visit.provider, visit.created_by), (self.nurse_user, self.nurse_user))
+
+    def test_nested_batch_applies_url_parents(self):
+        """Batch under a pregnancy route should link every row to it and reject other patients"""
+        url = f'/api/patients/{self.patient_1.id}/pregnancies/{self.pregnancy_1.id}/visits/batch/'
+        rows = [{'blood_pressure': '110/70', 'heart_rate': 72}, self._row(self.patient_2)]
+        response = self.client.post(url, rows, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], ['created', 'error'])
+        visit = Visit.objects.get(pk=results[0]['id'])
+        self.assertEqual((visit.patient_id, visit.pregnancy_id, visit.visit_type), (self.patient_1.id, self.pregnancy_1.id, 'Antenatal'))
+
+    def test_batch_query_count_does_not_grow_with_rows(self):
+        """A batch of 25 visits should take as many queries as a batch of 2 and keep the summary current"""
+        row = self._row(self.patient_1, pregnancy=self.pregnancy_1.id, weight_kg='60.00')
+        counts = []
+        # The first batch also creates the rollup buckets; 25 visits still fit in one SQLite INSERT
+        for size in (1, 2, 25):
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.post('/api/visits/batch/', [row] * size, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            counts.append(len(captured))
+
+        self.assertEqual(counts[1], counts[2])
+        summary = self.client.get(f'/api/patients/{self.patient_1.id}/analytics/visits/summary/').json()
+        self.assertEqual(summary['total_visits'], 28)
+        self.assertEqual(summary['by_type'], {'Antenatal': 28})
+
+    def test_patient_cannot_use_batch(self):
+        """Patients should not be able to submit visits in bulk"""
+        self.client.force_authenticate(user=self.patient_user_1)
+        response = self.client.post('/api/visits/batch/', [self._row(self.patient_1)], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class VisitCursorPaginationTests(TestCase):
+    """Test keyset pagination of the visit list"""
+
+    def setUp(self):
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+        # Several visits share a visit_date so ties must be broken by id
+        Visit.objects.bulk_create([
+            Visit(patient=self.patient, provider=self.doctor_user, visit_type='General', blood_pressure='120/80', heart_rate=80)
+            for _ in range(35)
+        ])
+        Visit.objects.filter(pk__in=Visit.objects.order_by('pk').values('pk')[:12]).update(visit_date='2024-01-01T08:00:00Z')
+        self.expected = list(Visit.objects.order_by('visit_date', 'pk').values_list('pk', flat=True))
+
+    def _walk(self, url, link):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            body = response.json()
+            self.assertNotIn('count', body)
+            ids.append([row['id'] for row in body['results']])
+            url = body[link]
+        return ids
+
+    def test_cursor_pages_cover_every_visit_once(self):
+        """Following next links should return each visit once in (visit_date, id) order, and previous links should walk back"""
+        pages = self._walk('/api/visits/?pagination=cursor', 'next')
+        self.assertEqual([len(page) for page in pages], [10, 10, 10, 5])
+        self.assertEqual(sum(pages, []), self.expected)
+
+        last_page = self.client.get('/api/visits/?pagination=cursor').json()
+        while last_page['next']:
+            last_page = self.client.get(last_page['next']).json()
+        backwards = self._walk(last_page['previous'], 'previous')
+        self.assertEqual(sum(reversed(backwards), []), self.expected[:30])
+
+    def test_deep_page_costs_the_same_as_first_page(self):
+        """A deep cursor page should run the same single query as the first page, without COUNT or OFFSET"""
+        first = self.client.get('/api/visits/?pagination=cursor').json()
+        deep_url = self.client.get(first['next']).json()['next']
+
+        with CaptureQueriesContext(connection) as first_queries:
+            self.client.get('/api/visits/?pagination=cursor')
+        with CaptureQueriesContext(connection) as deep_queries:
+            self.client.get(deep_url)
+
+        self.assertEqual(len(first_queries), len(deep_queries))
+        for query in deep_queries.captured_queries:
+            self.assertNotIn('COUNT(', query['sql'].upper())
+            self.assertNotIn('OFFSET', query['sql'].upper())
+
+        # The page starts with an index seek past the cursor, not a walk over the earlier rows. The plan is
+        # taken for the SQL and parameters as executed, since SQLite plans inlined literals differently.
+        if connection.vendor == 'sqlite':
+            executed = []
+
+            def record(execute, sql, params, many, context):
+                executed.append((sql, params))
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(record):
+                self.client.get(deep_url)
+            (sql, params), = [(sql, params) for sql, params in executed if 'FROM "visits_visit"' in sql]
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = ' '.join(row[-1] for row in cursor.fetchall())
+            self.assertIn('SEARCH visits_visit USING INDEX', plan)
+            self.assertNotIn('SCAN visits_visit', plan)
+
+    def test_page_numbers_remain_the_default(self):
+        """Requests without the cursor option should keep the page-number response"""
+        body = self.client.get('/api/visits/?page=2').json()
+        self.assertEqual(body['count'], 35)
+        self.assertEqual(len(body['results']), 10)
+
+    def test_invalid_cursor_returns_404(self):
+        """A tampered cursor should be rejected"""
+        response = self.client.get('/api/visits/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class VisitBloodPressureTests(TestCase):
+    """Test the numeric systolic/diastolic columns and the blood pressure summary"""
+
+    def setUp(self):
+        self.patient_user = User.objects.create_user(username='patient1', password='testpass123', role='patient')
+        self.patient = Patient.objects.get(user=self.patient_user)
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+    def _create_visit(self, blood_pressure):
+        return Visit.objects.create(
+            patient=self.patient, provider=self.doctor_user, visit_type='General',
+            blood_pressure=blood_pressure, heart_rate=80,
+        )
+
+    def test_save_keeps_numeric_columns_in_sync(self):
+        """Saving should parse blood_pressure, including saves limited by update_fields"""
+        visit = self._create_visit(' 142 / 95')
+        self.assertEqual((visit.systolic, visit.diastolic), (142, 95))
+
+        visit.blood_pressure = '118/76'
+        visit.save(update_fields=['blood_pressure'])
+        visit.refresh_from_db()
+        self.assertEqual((visit.systolic, visit.diastolic), (118, 76))
+
+        visit.blood_pressure = 'n/a'
+        visit.save()
+        visit.refresh_from_db()
+        self.assertEqual((visit.systolic, visit.diastolic), (None, None))
+
+    def test_backfill_command_fills_historical_rows(self):
+        """The backfill should parse rows written without save() and refresh the rollups"""
+        self._create_visit('165/100')
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO visits_visit (patient_id, provider_id, visit_date, created_at, updated_at,
+                                          visit_type, blood_pressure, heart_rate)
+                VALUES (%s, %s, '2024-01-01 08:00:00', '2024-01-01 08:00:00', '2024-01-01 08:00:00', 'General', %s, 80)
+                """,
+                [(self.patient.id, self.doctor_user.id, reading) for reading in ['120/80', '120/80', '150/85', 'bad']],
+            )
+
+        call_command('backfill_blood_pressure', chunk_size=2, stdout=io.StringIO())
+
+        readings = sorted(Visit.objects.values_list('systolic', 'diastolic'), key=repr)
+        self.assertEqual(readings, sorted([(165, 100), (120, 80), (120, 80), (150, 85), (None, None)], key=repr))
+
+        data = self.client.get(f'/api/patients/{self.patient.id}/analytics/visits/summary/').json()
+        self.assertEqual(data['total_visits'], 5)
+        self.assertEqual(data['bp_categories'], {'null': 1, 'hypertensive': 1, 'normal': 2, 'severe': 1})
+        self.assertEqual(data['elevated_bp_visits'], 2)
+        self.assertEqual(data['average_systolic'], 138.75)
+        self.assertEqual(data['average_diastolic'], 86.25)
+        self.assertEqual(data['systolic_distribution'], [
+            {'from': 120, 'to': 129, 'count': 2},
+            {'from': 150, 'to': 159, 'count': 1},
+            {'from': 160, 'to': 169, 'count': 1},
+        ])
+
+
+class VisitDateRangeTests(TestCase):
+    """Test the ?from=/?to= visit date bounds and the partition helpers"""
+
+    def setUp(self):
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.patient = Patient.objects.get(user=User.objects.create_user(username='patient1', password='testpass123', role='patient'))
+        for moment, reading in (('2024-01-15T09:00:00Z', '150/95'), ('2024-03-10T23:30:00Z', '120/80'), ('2025-06-01T08:00:00Z', '118/76')):
+            visit = Visit.objects.create(patient=self.patient, provider=self.doctor_user, visit_type='ANC', blood_pressure=reading, heart_rate=80)
+            Visit.objects.filter(pk=visit.pk).update(visit_date=moment)
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+    def test_list_bounds(self):
+        """Both bounds should be whole days, included, and malformed dates rejected"""
+        self.assertEqual(self.client.get('/api/visits/?from=2024-01-15&to=2024-03-10').json()['count'], 2)
+        self.assertEqual(self.client.get('/api/visits/?from=2024-01-16').json()['count'], 2)
+        self.assertEqual(self.client.get(f'/api/patients/{self.patient.id}/visits/?to=2024-12-31').json()['count'], 2)
+        for query in ('from=2024-13-01', 'to=yesterday'):
+            self.assertEqual(self.client.get(f'/api/visits/?{query}').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_summary_for_a_range(self):
+        """A ranged summary should be computed from the visits in range, in the rollup summary's shape"""
+        url = f'/api/patients/{self.patient.id}/analytics/visits/summary/'
+        self.assertEqual(self.client.get(f'{url}?from=2000-01-01&to=2100-12-31').json(), self.client.get(url).json())
+
+        data = self.client.get(f'{url}?from=2024-01-01&to=2024-12-31').json()
+        self.assertEqual(data['total_visits'], 2)
+        self.assertEqual(data['monthly_counts'], [{'month': '2024-01-01', 'count': 1}, {'month': '2024-03-01', 'count': 1}])
+        self.assertEqual(data['elevated_bp_visits'], 1)
+        self.assertEqual(self.client.get(f'{url}?to=2024-02-30').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ranged_summary_is_aggregated_in_the_database(self):
+        """A ranged summary should cost the same queries however many visits are in range, none of them per visit"""
+        url = '/api/analytics/visits/summary/?from=2000-01-01'
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        Visit.objects.bulk_create([
+            Visit(patient=self.patient, provider=self.doctor_user, visit_type='ANC', blood_pressure='130/85', heart_rate=80)
+            for _ in range(50)
+        ])
+        with CaptureQueriesContext(connection) as many:
+            data = self.client.get(url).json()
+        self.assertEqual(data['total_visits'], 53)
+        self.assertEqual(len(many), len(few))
+        visit_reads = [query['sql'] for query in many if 'FROM "visits_visit"' in query['sql']]
+        self.assertTrue(visit_reads)
+        self.assertTrue(all('COUNT(' in sql for sql in visit_reads))
+
+    def test_partition_ranges(self):
+        """Partitions should cover whole months or years, across year ends"""
+        months = partition_ranges(date(2024, 11, 20), date(2025, 1, 1), 'month')
+        self.assertEqual(months, [
+            ('visits_visit_p2024_11', date(2024, 11, 1), date(2024, 12, 1)),
+            ('visits_visit_p2024_12', date(2024, 12, 1), date(2025, 1, 1)),
+            ('visits_visit_p2025_01', date(2025, 1, 1), date(2025, 2, 1)),
+        ])
+        years = partition_ranges(date(2024, 11, 20), date(2025, 1, 1), 'year')
+        self.assertEqual([name for name, _, _ in years], ['visits_visit_p2024', 'visits_visit_p2025'])
+
+        statements = partition_statements('visits_visit', months[:1])
+        self.assertIn('DELETE FROM "visits_visit_pdefault"', statements[1][0])
+        self.assertIn('ATTACH PARTITION "visits_visit_p2024_11" FOR VALUES FROM (%s) TO (%s)', statements[2][0])
+        self.assertEqual([bound.isoformat() for bound in statements[2][1]], ['2024-11-01T00:00:00+00:00', '2024-12-01T00:00:00+00:00'])
+
+@override_settings(VISIT_PARTITION_REFRESH=0)
+class VisitPartitionTests(TestCase):
+    """Test the per-period visit tables on SQLite"""
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('per-period tables are for SQLite')
+        self.addCleanup(forget_partitions)
+        self.doctor_user = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.patient = Patient.objects.get(user=User.objects.create_user(username='patient1', password='testpass123', role='patient'))
+        self.pregnancy = Pregnancy.objects.create(patient=self.patient, gestational_age_weeks=20)
+        self.visits = {}
+        for moment in ('2024-01-15T09:00:00Z', '2024-02-10T12:00:00Z', '2024-03-10T23:30:00Z', '2025-06-01T08:00:00Z', None):
+            visit = Visit.objects.create(
+                patient=self.patient, pregnancy=self.pregnancy, provider=self.doctor_user,
+                visit_type='ANC', blood_pressure='120/80', heart_rate=80,
+            )
+            if moment:
+                Visit.objects.filter(pk=visit.pk).update(visit_date=moment)
+            self.visits[moment[:7] if moment else 'now'] = visit.pk
+        call_command('partition_visits', stdout=io.StringIO())
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.doctor_user)
+
+    def _rows(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {connection.ops.quote_name(table)} ORDER BY id')
+            return [pk for pk, in cursor.fetchall()]
+
+    def test_closed_months_move_to_their_tables(self):
+        """Visits of past months should leave visits_visit for their month's table, and still be read"""
+        self.assertEqual(self._rows('visits_visit'), [self.visits['now']])
+        self.assertEqual(self._rows('visits_visit_p2024_02'), [self.visits['2024-02']])
+        self.assertEqual(self._rows('visits_visit_p2024_04'), [])
+        self.assertIn('visits_visit_p2025_06', partitions(connection))
+
+        self.assertEqual(sorted(Visit.objects.values_list('pk', flat=True)), sorted(self.visits.values()))
+        self.assertEqual(self.client.get('/api/visits/').json()['count'], 5)
+        self.assertEqual(self.client.get('/api/visits/?from=2024-02-01&to=2024-03-31').json()['count'], 2)
+        self.assertEqual(len(self.client.get(f'/api/patients/{self.patient.id}/timeline/').json()['pregnancies'][0]['visits']), 5)
+
+        cursor_page = self.client.get('/api/visits/?pagination=cursor').json()
+        self.assertEqual([visit['id'] for visit in cursor_page['results']], [
+            self.visits['2024-01'], self.visits['2024-02'], self.visits['2024-03'], self.visits['2025-06'], self.visits['now'],
+        ])
+
+    def test_date_bounded_queries_read_only_their_partitions(self):
+        """A visit_date range should read visits_visit and the tables of its months, no others"""
+        def tables_read(queryset):
+            with CaptureQueriesContext(connection) as queries:
+                list(queryset)
+            return set(re.findall(r'"(visits_visit_p\d{4}_\d{2})"', queries[-1]['sql']))
+
+        bounded = Visit.objects.filter(visit_date__gte='2024-02-01T00:00:00Z', visit_date__lt='2024-03-01T00:00:00Z')
+        self.assertEqual(tables_read(bounded), {'visits_visit_p2024_02'})
+        self.assertEqual(list(bounded.values_list('pk', flat=True)), [self.visits['2024-02']])
+        self.assertEqual(tables_read(Visit.objects.filter(visit_date__range=('2024-03-05T00:00:00Z', '2024-04-02T00:00:00Z'))), {
+            'visits_visit_p2024_03', 'visits_visit_p2024_04',
+        })
+        self.assertEqual(tables_read(Visit.objects.filter(visit_date__gte=timezone.now() - timedelta(minutes=5))), set())
+        self.assertGreater(len(tables_read(Visit.objects.filter(Q(visit_date__lt='2024-02-01T00:00:00Z') | Q(heart_rate=80)))), 12)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/visits/?from=2024-06-01&to=2024-06-30')
+        self.assertEqual(response.json()['count'], 0)
+        read = set(re.findall(r'"(visits_visit_p\d{4}_\d{2})"', ' '.join(query['sql'] for query in queries)))
+        self.assertEqual(read, {'visits_visit_p2024_06'})
+
+    def test_writes_reach_partitioned_visits(self):
+        """Saves, updates, deletes and cascades should find visits in their month's table"""
+        visit = Visit.objects.get(pk=self.visits['2024-01'])
+        visit.notes = 'reviewed'
+        visit.save()
+        self.assertEqual(Visit.objects.get(pk=visit.pk).notes, 'reviewed')
+        self.assertEqual(self._rows('visits_visit_p2024_01'), [visit.pk])
+
+        self.assertEqual(Visit.objects.filter(visit_date__year=2024).update(heart_rate=90), 3)
+        self.assertEqual(Visit.objects.filter(heart_rate=90).count(), 3)
+
+        # A visit moved to another period goes back to visits_visit until the next run
+        Visit.objects.filter(pk=self.visits['2024-02']).update(visit_date='2025-06-20T10:00:00Z')
+        self.assertEqual(self._rows('visits_visit_p2024_02'), [])
+        self.assertEqual(Visit.objects.filter(visit_date__month=6).count(), 2)
+        self.assertIn(self.visits['2024-02'], self._rows('visits_visit'))
+        call_command('partition_visits', stdout=io.StringIO())
+        self.assertEqual(self._rows('visits_visit_p2025_06'), sorted([self.visits['2024-02'], self.visits['2025-06']]))
+
+        self.assertEqual(self.client.delete(f'/api/visits/{self.visits["2024-03"]}/').status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self._rows('visits_visit_p2024_03'), [])
+        self.assertFalse(Visit.objects.filter(pk=self.visits['2024-03']).exists())
+
+        self.assertEqual(score_pregnancies()['scored'], 1)
+        self.assertEqual(PregnancyRiskScore.objects.get(pregnancy=self.pregnancy).visit_count, 4)
+
+        self.patient.delete()
+        self.assertEqual(Visit.objects.count(), 0)
+        self.assertEqual(self._rows('visits_visit_p2025_06'), [])
+        connection.check_constraints()
+
+    def test_merge_moves_every_visit_back(self):
+        """Merging should return the visits to visits_visit and drop the per-period tables"""
+        call_command('partition_visits', '--vacuum', '2', stdout=io.StringIO())
+        call_command('partition_visits', '--merge', stdout=io.StringIO())
+        self.assertEqual(partitions(connection), {})
+        self.assertEqual(self._rows('visits_visit'), sorted(self.visits.values()))
+        with self.assertRaisesMessage(CommandError, 'not partitioned'):
+            call_command('partition_visits', '--merge', stdout=io.StringIO())
+
+
+# A lookup that reaches the visits from another model: visit__..., visit_created_by__... or the
+# bare relation name, as in Count('visit')
+REVERSE_VISIT_LOOKUP = re.compile(r'-?visit(?:_created_by|_updated_by)?(?:__\w+)?')
+
+
+def reverse_visit_lookups(source):
+    """(line, lookup) of the call arguments in `source` that join into the visits from another model."""
+    for node in ast.walk(ast.parse(source)):
+        if not isinstance(node, ast.Call):
+            continue
+        names = [keyword.arg for keyword in node.keywords if keyword.arg]
+        names += [arg.value for arg in node.args if isinstance(arg, ast.Constant) and isinstance(arg.value, str)]
+        for name in names:
+            # The bare 'visit' is also a plain word (dict keys, URL segments); it only counts as a
+            # lookup in calls like Count('visit') or F('visit')
+            if name.lstrip('-') == 'visit' and not isinstance(node.func, ast.Name):
+                continue
+            if REVERSE_VISIT_LOOKUP.fullmatch(name):
+                yield node.lineno, name
+
+
+class VisitReverseJoinTests(TestCase):
+    """Test that the project's own code reaches the visits through Visit, where the partitions are read"""
+
+    def test_no_reverse_joins_into_visits(self):
+        """Queries joining into the visits from another model read visits_visit alone on SQLite"""
+        found = []
+        for config in apps.get_app_configs():
+            if not config.path.startswith(str(settings.BASE_DIR)):
+                continue
+            for root, dirs, files in os.walk(config.path):
+                dirs[:] = [name for name in dirs if name not in ('migrations', 'tests', '__pycache__')]
+                for name in files:
+                    if not name.endswith('.py') or name.startswith('test'):
+                        continue
+                    path = os.path.join(root, name)
+                    with open(path, encoding='utf-8') as source:
+                        found += [f'{path}:{line} {lookup}' for line, lookup in reverse_visit_lookups(source.read())]
+        self.assertEqual(found, [], 'join through a Visit subquery instead')
+
+    def test_finds_reverse_joins(self):
+        source = (
+            "Pregnancy.objects.filter(visit__visit_date__gte=start)\n"
+            "Patient.objects.annotate(visits=Count('visit')).order_by('-visit__visit_date')\n"
+            "Visit.objects.filter(pregnancy__patient=patient)\n"
+            "segments.get('visit')\n"
+        )
+        self.assertEqual(
+            list(reverse_visit_lookups(source)),
+            [(1, 'visit__visit_date__gte'), (2, '-visit__visit_date'), (2, 'visit')],
+        )
+
+
+class PostgreSQLVisitPartitionTests(TestCase):
+    """Test the partitioned visits table on PostgreSQL"""
+
+    def setUp(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('table partitioning needs PostgreSQL')
+        doctor = User.objects.create_user(username='doctor1', password='testpass123', role='doctor')
+        self.patient = Patient.objects.get(user=User.objects.create_user(username='patient1', password='testpass123', role='patient'))
+        for moment in ('2024-01-15T09:00:00Z', '2024-02-10T12:00:00Z'):
+            visit = Visit.objects.create(patient=self.patient, provider=doctor, visit_type='ANC', blood_pressure='120/80', heart_rate=80)
+            Visit.objects.filter(pk=visit.pk).update(visit_date=moment)
+
+    def test_partitioned_table_prunes_date_ranges(self):
+        """The rebuilt table should keep every visit and only scan the partitions in range"""
+        created = partition_visits('month')
+        self.assertIn('visits_visit_p2024_02', created)
+        self.assertTrue(is_partitioned(connection))
+        self.assertEqual(Visit.objects.count(), 2)
+
+        bounded = Visit.objects.filter(visit_date__gte='2024-02-01T00:00:00Z', visit_date__lt='2024-03-01T00:00:00Z')
+        self.assertEqual(bounded.count(), 1)
+        plan = bounded.explain()
+        self.assertIn('visits_visit_p2024_02', plan)
+        self.assertNotIn('visits_visit_p2024_01', plan)
+
+        self.assertEqual(add_partitions(), [])
+        merge_partitions()
+        self.assertFalse(is_partitioned(connection))
+        self.assertEqual(Visit.objects.count(), 2)
\ No newline at end of file
@@ -1,25 +1,70 @@
+from datetime import datetime, time, timedelta
+
 from rest_framework import viewsets, permissions
+from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from .models import Visit
-from .serializers import VisitSerializer, PrenatalVisitSerializer, PostnatalVisitSerializer
+from .serializers import (
+    VisitSerializer, PrenatalVisitSerializer, PostnatalVisitSerializer, VisitBatchItemSerializer, visit_type_for,
+)
 from deliveries.models import Delivery
+from pregnancies.archive import ArchiveReadThroughMixin
 from pregnancies.models import Pregnancy
+from patients.identity import get_patient_id
 from patients.models import Patient
 from rest_framework import serializers, status, filters
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action
 from patients.permissions import IsClinicianOrAdmin
-from patients.models import Patient as PatientModel
-from django.http import HttpResponse
-import csv
-from django.db.models import Count, Avg
-from django.db.models.functions import TruncMonth
+from asgiref.sync import sync_to_async
+from analytics.asyncapi import api_response, asummary_response, async_api_view, export_response, summary_patient_pk
+from analytics.rollups import VISIT_ROLLUP, apply_deltas, aread_rollup, asummarize, collect_deltas
+
+
+# bp_category buckets at or above 140/90
+ELEVATED_BP_CATEGORIES = ('hypertensive', 'severe')
+
+# Upper bound on visits accepted by one batch submission
+VISIT_BATCH_MAX_ROWS = 1000
+
+
+# ?from= and ?to= (YYYY-MM-DD, both included) as visit_date bounds: (start, end) aware datetimes with end exclusive,
+# None where not given. On a partitioned visits table (visits/partitions.py) the bounds also prune partitions.
+def visit_date_bounds(params):
+    bounds = []
+    for name, offset in (('from', 0), ('to', 1)):
+        value = params.get(name)
+        try:
+            day = parse_date(value) if value else None
+        except ValueError:
+            day = None
+        if value and day is None:
+            raise ValueError(f'{name} must be a YYYY-MM-DD date.')
+        bounds.append(timezone.make_aware(datetime.combine(day + timedelta(days=offset), time.min)) if day else None)
+    return tuple(bounds)
+
+
+def filter_visit_dates(queryset, start, end):
+    if start:
+        queryset = queryset.filter(visit_date__gte=start)
+    if end:
+        queryset = queryset.filter(visit_date__lt=end)
+    return queryset
+
+
+def _as_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
 
 # VisitViewSet with dynamic serializer and strict filtering logic to ensure data integrity and proper access control.
-class VisitViewSet(viewsets.ModelViewSet):
+class VisitViewSet(ArchiveReadThroughMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
+    archived_model = Visit  # archived visits are read back on the patient routes
     
     # Implementing filter and search
 
@@ -28,10 +73,12 @@ class VisitViewSet(viewsets.ModelViewSet):
     search_fields = ['visit_type', 'notes', 'patient__first_name', 'patient__last_name']
     ordering_fields = ['visit_date']
     ordering = ['visit_date']
+    cursor_ordering = 'visit_date'  # keyset order for ?pagination=cursor
 
     # Override get_queryset to ensure proper filtering based on nested relationships and user role.
     def get_queryset(self):
-        queryset = Visit.objects.all()
+        # patient_name comes from patient.user, so load both with the visits instead of once per row
+        queryset = Visit.objects.select_related('patient__user')
 
         patient_id = self.kwargs.get("patient_pk")
         pregnancy_id = self.kwargs.get("pregnancy_pk")
@@ -61,9 +108,13 @@ class VisitViewSet(viewsets.ModelViewSet):
         # Restrict patients to only their own visits
         user = self.request.user
         if hasattr(user, "role") and user.role == "patient":
-            queryset = queryset.filter(patient__user=user)
+            queryset = queryset.filter(patient_id=get_patient_id(user))
 
-        return queryset
+        try:
+            start, end = visit_date_bounds(self.request.query_params)
+        except ValueError as exc:
+            raise serializers.ValidationError({'visit_date': [str(exc)]})
+        return filter_visit_dates(queryset, start, end)
 
     # Override get_serializer_class to return different serializers based on the presence of pregnancy_pk (Prenatal) or delivery_pk (Postnatal) in the URL.
     def get_serializer_class(self):
@@ -89,20 +140,8 @@ class VisitViewSet(viewsets.ModelViewSet):
             if delivery_id else None
         )
 
-        # Decide visit type automatically
-        if pregnancy_id:
-            visit_type = "Antenatal"
-        elif delivery_id:
-            visit_type = "Postnatal"
-        else:
-            visit_type = "General"
-
-        # Strict consistency checks
-        if pregnancy and patient and pregnancy.patient_id != int(patient_id):
-            raise serializers.ValidationError("Pregnancy does not belong to this patient.")
-
-        if delivery and patient and delivery.patient_id != int(patient_id):
-            raise serializers.ValidationError("Delivery does not belong to this patient.")
+        # Strict consistency checks, then decide visit type automatically
+        visit_type = visit_type_for(patient_id, pregnancy, delivery)
 
         serializer.save(
             patient=patient,
@@ -114,6 +153,64 @@ class VisitViewSet(viewsets.ModelViewSet):
             updated_by=self.request.user,
         )
 
+    '''
+    Batch submission for clinics that collect visits offline and sync them in bursts.
+    Every referenced patient, pregnancy and delivery is loaded with one in_bulk query per
+    model, rows are checked in memory with the same consistency rules as single creation,
+    valid rows are inserted with a single bulk_create and each row gets its own result.
+    '''
+    @action(detail=False, methods=['post'], url_path='batch', permission_classes=[permissions.IsAuthenticated, IsClinicianOrAdmin])
+    def batch(self, request, patient_pk=None, pregnancy_pk=None, delivery_pk=None):
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            return Response({'detail': 'Expected a non-empty list of visits.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > VISIT_BATCH_MAX_ROWS:
+            return Response({'detail': f'A batch may contain at most {VISIT_BATCH_MAX_ROWS} visits.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        url_ids = {'patient': patient_pk, 'pregnancy': pregnancy_pk, 'delivery': delivery_pk}
+        parent_models = {'patient': Patient, 'pregnancy': Pregnancy, 'delivery': Delivery}
+        parents = {}
+        for name, model in parent_models.items():
+            ids = {_as_id(row.get(name)) for row in rows if isinstance(row, dict)} | {_as_id(url_ids[name])}
+            ids.discard(None)
+            fields = ('id',) if model is Patient else ('id', 'patient_id')
+            parents[name] = model.objects.only(*fields).in_bulk(ids) if ids else {}
+
+        item_serializer = VisitBatchItemSerializer(context={
+            'request': request, 'parents': parents,
+            'patient_pk': patient_pk, 'pregnancy_pk': pregnancy_pk, 'delivery_pk': delivery_pk,
+        })
+        results = []
+        visits = []
+        for index, row in enumerate(rows):
+            try:
+                data = item_serializer.run_validation(row)
+            except serializers.ValidationError as exc:
+                results.append({'index': index, 'status': 'error', 'errors': exc.detail})
+                continue
+            visit = Visit(**data, provider=request.user, created_by=request.user, updated_by=request.user)
+            visit.sync_blood_pressure()
+            visits.append(visit)
+            results.append({'index': index, 'status': 'created'})
+
+        # bulk_create skips signals, so the summary rollups are updated here in the same transaction
+        with transaction.atomic():
+            Visit.objects.bulk_create(visits)
+            apply_deltas(VISIT_ROLLUP, collect_deltas(VISIT_ROLLUP, added=visits))
+
+        created = iter(visits)
+        for result in results:
+            if result['status'] == 'created':
+                result['id'] = next(created).pk
+
+        if not visits:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif len(visits) < len(rows):
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response({'created': len(visits), 'failed': len(rows) - len(visits), 'results': results}, status=response_status)
+
     # Override to provide custom error responses for validation errors
     def handle_exception(self, exc):
         if isinstance(exc, serializers.ValidationError):
@@ -124,7 +221,7 @@ class VisitViewSet(viewsets.ModelViewSet):
 
 
 # Helper function to build queryset for analytics endpoints with consistent filtering logic
-def _build_visit_queryset(request, kwargs):
+def _build_visit_queryset(user, kwargs):
     queryset = Visit.objects.all()
 
     patient_id = kwargs.get("patient_pk")
@@ -147,48 +244,58 @@ def _build_visit_queryset(request, kwargs):
     elif delivery_id:
         queryset = queryset.filter(delivery_id=delivery_id)
 
-    user = request.user
     if hasattr(user, "role") and user.role == "patient":
-        queryset = queryset.filter(patient__user=user)
+        queryset = queryset.filter(patient_id=get_patient_id(user))
 
     return queryset
 
+# Map a summary request to its rollup scope with the same consistency checks as _build_visit_queryset; a None scope means no visits can match.
+async def _visit_summary_scope(patient_pk, pregnancy_pk, delivery_pk):
+    if pregnancy_pk:
+        if patient_pk and not await Pregnancy.objects.filter(pk=pregnancy_pk, patient_id=patient_pk).aexists():
+            return None, 0
+        return 'pregnancy', int(pregnancy_pk)
+    if delivery_pk:
+        if patient_pk and not await Delivery.objects.filter(pk=delivery_pk, patient_id=patient_pk).aexists():
+            return None, 0
+        return 'delivery', int(delivery_pk)
+    if patient_pk:
+        return 'patient', int(patient_pk)
+    return 'global', 0
+
+# Summary payload for one scope's visit rollup; shared with the batch summary endpoint in analytics.
+def visit_summary_data(rollup):
+    bp_categories = rollup.histogram('bp_category')
+    return {
+        'total_visits': rollup.count(),
+        'by_type': rollup.histogram('visit_type'),
+        'average_hemoglobin': rollup.average('hemoglobin_level'),
+        'average_weight_kg': rollup.average('weight_kg'),
+        'monthly_counts': rollup.monthly(),
+        'average_systolic': rollup.average('systolic'),
+        'average_diastolic': rollup.average('diastolic'),
+        'bp_categories': bp_categories,
+        'elevated_bp_visits': sum(bp_categories.get(category, 0) for category in ELEVATED_BP_CATEGORIES),
+        'systolic_distribution': rollup.bands('systolic_band'),
+    }
+
 # Analytics endpoints for visits (CSV export and JSON summary) with consistent filtering logic and role-based access control.
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def export_visits_csv(request, patient_pk=None, pregnancy_pk=None, delivery_pk=None):
+# Both are async views, so under ASGI a long export or summary does not hold a worker thread.
+@async_api_view
+async def export_visits_csv(request, patient_pk=None, pregnancy_pk=None, delivery_pk=None):
     """Export visits as CSV. Optional nested filtering via patient_pk, pregnancy_pk, delivery_pk."""
-    qs = _build_visit_queryset(request, {"patient_pk": patient_pk, "pregnancy_pk": pregnancy_pk, "delivery_pk": delivery_pk})
-
-    rows = list(qs.values())
+    qs = await sync_to_async(_build_visit_queryset)(request.user, {"patient_pk": patient_pk, "pregnancy_pk": pregnancy_pk, "delivery_pk": delivery_pk})
 
-    if not rows:
-        return Response({"detail": "No visits found"}, status=status.HTTP_404_NOT_FOUND)
+    if not await qs.aexists():
+        return api_response({"detail": "No visits found"}, status=status.HTTP_404_NOT_FOUND)
 
-    # Prepare CSV response
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="visits_export.csv"'
-
-    fieldnames = list(rows[0].keys())
-    writer = csv.DictWriter(response, fieldnames=fieldnames)
-    writer.writeheader()
-
-    # convert non-serializable types
-    for r in rows:
-        for k, v in r.items():
-            try:
-                if hasattr(v, 'isoformat'):
-                    r[k] = v.isoformat()
-            except Exception:
-                pass
-        writer.writerow(r)
-
-    return response
+    # Stream the file in chunks so exports never load the whole table into memory; exports too
+    # large to stream before a proxy times out are handed to the background worker instead
+    return await export_response(request, 'visits', qs, {"patient_pk": patient_pk, "pregnancy_pk": pregnancy_pk, "delivery_pk": delivery_pk})
 
 # Summary analytics endpoint for visits, scoped to patient/pregnancy/delivery if provided, with role-based access control.
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def visits_summary(request, patient_pk=None, pregnancy_pk=None, delivery_pk=None):
+@async_api_view
+async def visits_summary(request, patient_pk=None, pregnancy_pk=None, delivery_pk=None):
     """
     Return basic summary statistics for visits as JSON.
 
@@ -198,52 +305,25 @@ def visits_summary(request, patient_pk=None, pregnancy_pk=None, delivery_pk=None
     
     """
     user = request.user
-    if getattr(user, 'role', None) == 'patient':
-        try:
-            patient_obj = PatientModel.objects.get(user=user)
-        except PatientModel.DoesNotExist:
-            return Response({'detail': 'Patient record not found.'}, status=status.HTTP_404_NOT_FOUND)
-        
-        # if a different patient_pk was requested, forbid
-        if patient_pk is not None and int(patient_pk) != patient_obj.id:
-            return Response({'detail': 'Forbidden.'}, status=status.HTTP_403_FORBIDDEN)
-        
-        # scope to the authenticated patient
-        patient_pk = patient_obj.id
-    
-    # For non-patient users, we allow any scope but still enforce role-based access control
-    elif getattr(user, 'role', None) not in ['doctor', 'nurse', 'admin']:
-        return Response({'detail': 'Forbidden.'}, status=status.HTTP_403_FORBIDDEN)
-
-    qs = _build_visit_queryset(request, {"patient_pk": patient_pk, "pregnancy_pk": pregnancy_pk, "delivery_pk": delivery_pk})
-
-    total = qs.count()
-    by_type_qs = qs.values('visit_type').annotate(count=Count('id'))
-    by_type = {item['visit_type']: item['count'] for item in by_type_qs}
-
-    avg_hemo = qs.aggregate(avg_hemo=Avg('hemoglobin_level'))['avg_hemo']
-    avg_weight = qs.aggregate(avg_weight=Avg('weight_kg'))['avg_weight']
-
-    monthly_qs = qs.annotate(month=TruncMonth('visit_date')).values('month').annotate(count=Count('id')).order_by('month')
-    monthly = []
-    for m in monthly_qs:
-        month_val = m.get('month')
-        if month_val is None:
-            month_str = None
-        elif hasattr(month_val, 'date'):
-            month_str = month_val.date().isoformat()
-        elif hasattr(month_val, 'isoformat'):
-            month_str = month_val.isoformat()
-        else:
-            month_str = str(month_val)
-        monthly.append({'month': month_str, 'count': m['count']})
-
-    data = {
-        'total_visits': total,
-        'by_type': by_type,
-        'average_hemoglobin': avg_hemo,
-        'average_weight_kg': avg_weight,
-        'monthly_counts': monthly,
-    }
-
-    return Response(data)
\ No newline at end of file
+    patient_pk, error = await summary_patient_pk(user, patient_pk)
+    if error:
+        return error
+
+    try:
+        start, end = visit_date_bounds(request.query_params)
+    except ValueError as exc:
+        return api_response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    if start or end:
+        # The rollups cover all time, so a date range is summarised from the visits in it
+        kwargs = {"patient_pk": patient_pk, "pregnancy_pk": pregnancy_pk, "delivery_pk": delivery_pk}
+        queryset = filter_visit_dates(await sync_to_async(_build_visit_queryset)(user, kwargs), start, end)
+        return api_response(visit_summary_data(await asummarize(VISIT_ROLLUP, queryset)))
+
+    # Read the precomputed rollup buckets for this scope instead of scanning the visits table,
+    # cached per scope and role until a visit in the scope changes
+    scope, scope_id = await _visit_summary_scope(patient_pk, pregnancy_pk, delivery_pk)
+
+    async def build():
+        return visit_summary_data(await aread_rollup(VISIT_ROLLUP, scope, scope_id))
+
+    return await asummary_response(VISIT_ROLLUP.metric, scope, scope_id, user.role, build)